@@ -0,0 +1,81 @@
+"""Wire bytes per reading: one websocket per instrument versus the gateway.
+
+Compares what a reading costs on the wire with the per-instrument endpoint
+(a JSON text frame per reading) and with the gateway endpoint (msgpack
+READINGS frames carrying a batch of readings), including the websocket
+frame header a client sends (2-14 bytes plus the 4 byte mask). It also
+shows how many hub connections each setup needs.
+
+Run from the hub directory:
+
+    python benchmarks/gateway_overhead.py --instruments 40 --gateways 5
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.gateway import READINGS, encode
+
+
+READING = "+12.345 g"
+
+
+def websocket_frame_size(payload: int) -> int:
+    "Client to server frame: header, extended length, mask, payload"
+    if payload < 126:
+        return 2 + 4 + payload
+    if payload < 65536:
+        return 4 + 4 + payload
+    return 10 + 4 + payload
+
+
+def per_instrument_bytes() -> float:
+    payload = json.dumps({"data": READING}).encode()
+    return websocket_frame_size(len(payload))
+
+
+def gateway_bytes(batch: int, channels: int) -> float:
+    seq, captured_at = 1_760_000_000_000_000, 1_760_000_000.123
+    readings = [
+        [index % channels, seq + index, captured_at + index / 10, READING]
+        for index in range(batch)
+    ]
+    payload = encode([READINGS, readings, captured_at + batch / 10])
+    return websocket_frame_size(len(payload)) / batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--instruments", type=int, default=40)
+    parser.add_argument("--gateways", type=int, default=5)
+    parser.add_argument("--batches", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    channels = max(1, args.instruments // args.gateways)
+    results = {
+        "reading": READING,
+        "per_instrument": {
+            "connections": args.instruments,
+            "bytes_per_reading": per_instrument_bytes(),
+        },
+        "gateway": {
+            "connections": args.gateways,
+            "bytes_per_reading": {
+                batch: round(gateway_bytes(batch, channels), 1)
+                for batch in args.batches
+            },
+        },
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""Micro benchmarks of the hub's hot paths, with JSON results to compare.
+
+Covers the fan-out (`ConnectionManager.broadcast_to_clients`), command
+checks (`validate_command` with a warm and a cold command cache,
+`check_if_led_command`, `convert_commands_string_to_dict`), storing readings
+(one INSERT and commit per reading versus the ingest pipeline) and
+`create_pdf`, each at several sizes. Websockets are stand-ins that accept
+everything, the database is a throwaway SQLite file unless DATABASE_URL
+points somewhere else (e.g. a local or embedded PostgreSQL). Instruments
+and readings the benchmark adds are deleted again.
+
+Run from the hub directory:
+
+    python benchmarks/hot_paths.py --output before.json
+    python benchmarks/hot_paths.py --baseline before.json --quick
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORKDIR = tempfile.mkdtemp(prefix="hub-benchmark-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{WORKDIR}/hub.db")
+
+from sqlalchemy import delete, insert
+
+from src.backplane import InProcessBackplane
+from src.command_cache import command_cache
+from src.db import models
+from src.db.db_init import SQLALCHEMY_DATABASE_URL, SessionLocal, engine, init_db
+from src.ingest import IngestPipeline
+from src.routes.data_routing import ConnectionManager
+from src.utils import (
+    convert_commands_string_to_dict,
+    convert_dict_to_commands_string,
+    create_pdf,
+)
+
+
+# Sizes per benchmark, --quick uses the first ones only
+SIZES = {
+    "broadcast": [(10, 1), (10, 10), (100, 10), (100, 50)],  # instruments, clients each
+    "validate_command": [10, 100, 1000],  # instruments
+    "commands": [5, 50, 500],  # commands in a profile
+    "insert": [1000, 10000],  # readings
+    "create_pdf": [10, 100, 1000],  # calibration rows
+}
+BENCHMARK_PROFILE = uuid.uuid4()
+# Allowed change in ops/s before --baseline calls it a regression
+REGRESSION_THRESHOLD = 10  # percent
+
+
+class StubWebSocket:
+    "Accepts and discards everything, so only the hub's own work is measured"
+
+    def __init__(self):
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.received += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def summary(latencies: list, elapsed: float, ops: int = None) -> dict:
+    "ops/s and latency percentiles in microseconds"
+    ops = len(latencies) if ops is None else ops
+    latencies = sorted(latencies)
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+    return {
+        "ops": ops,
+        "ops_per_second": round(ops / elapsed, 1) if elapsed else None,
+        "latency_us": {
+            "p50": round(percentile(0.5) * 1e6, 2),
+            "p99": round(percentile(0.99) * 1e6, 2),
+            "mean": round(statistics.fmean(latencies) * 1e6, 2),
+        },
+    }
+
+
+def time_calls(function, arguments: list) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    for argument in arguments:
+        call_started = time.perf_counter()
+        function(argument)
+        latencies.append(time.perf_counter() - call_started)
+    return summary(latencies, time.perf_counter() - started)
+
+
+async def time_awaits(function, arguments: list, before=None) -> dict:
+    latencies = []
+    elapsed = 0.0
+    for argument in arguments:
+        if before:
+            before()
+        call_started = time.perf_counter()
+        await function(argument)
+        latencies.append(time.perf_counter() - call_started)
+        elapsed += latencies[-1]
+    return summary(latencies, elapsed)
+
+
+async def bench_broadcast(instruments: int, clients: int, rounds: int) -> dict:
+    "One reading per instrument and round, queued for every subscribed client"
+    manager = ConnectionManager(backplane=InProcessBackplane())
+    instrument_ids = [uuid.uuid4() for _ in range(instruments)]
+    sockets = []
+    for instrument_id in instrument_ids:
+        for _ in range(clients):
+            websocket = StubWebSocket()
+            await manager.connect_client(websocket, instrument_id)
+            sockets.append(websocket)
+
+    latencies = []
+    started = time.perf_counter()
+    for number in range(rounds):
+        message = f"+{number % 1000}.123 g"
+        for instrument_id in instrument_ids:
+            call_started = time.perf_counter()
+            await manager.broadcast_to_clients(instrument_id, message)
+            latencies.append(time.perf_counter() - call_started)
+        await asyncio.sleep(0)  # let the sender tasks write, as between readings
+    expected = rounds * instruments * clients
+    while sum(websocket.received for websocket in sockets) < expected:
+        if time.perf_counter() - started > 60:
+            break
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    delivered = sum(websocket.received for websocket in sockets)
+    for websocket in sockets:
+        manager.disconnect(websocket)
+    result = summary(latencies, elapsed)
+    result["deliveries_per_second"] = round(delivered / elapsed, 1)
+    result["delivered"] = delivered
+    result["expected"] = expected
+    return result
+
+
+def commands_string(count: int) -> str:
+    return convert_dict_to_commands_string(
+        {f"cmd{index}": f"command number {index}" for index in range(count)}
+    )
+
+
+async def add_instruments(count: int) -> list:
+    "Instruments with the benchmark's profile, returns their ids"
+    instrument_ids = [uuid.uuid4() for _ in range(count)]
+    async with SessionLocal() as db:
+        db.add_all(
+            models.Instrument(
+                id=instrument_id, name=f"bench {index}", profile=BENCHMARK_PROFILE
+            )
+            for index, instrument_id in enumerate(instrument_ids)
+        )
+        await db.commit()
+    return instrument_ids
+
+
+async def bench_validate_command(instruments: int, calls: int) -> dict:
+    manager = ConnectionManager(backplane=InProcessBackplane())
+    instrument_ids = await add_instruments(instruments)
+    validate = lambda instrument_id: manager.validate_command("cmd7", instrument_id)
+    arguments = [instrument_ids[index % instruments] for index in range(calls)]
+    # cold: every call loads the profile from the database
+    cold = await time_awaits(
+        validate, arguments[: min(calls, 500)], command_cache.entries.clear
+    )
+    warm = await time_awaits(validate, arguments)
+    await remove_instruments(instrument_ids)
+    return {"cold_cache": cold, "warm_cache": warm}
+
+
+def bench_check_if_led_command(calls: int) -> dict:
+    manager = ConnectionManager(backplane=InProcessBackplane())
+    messages = {
+        "led": "find_my_instrument_red_0.5_3",
+        "command": "tare",
+        "long": "x" * 200,
+    }
+    return {
+        kind: time_calls(manager.check_if_led_command, [message] * calls)
+        for kind, message in messages.items()
+    }
+
+
+def bench_convert_commands(commands: int, calls: int) -> dict:
+    return time_calls(
+        convert_commands_string_to_dict, [commands_string(commands)] * calls
+    )
+
+
+def reading(index: int) -> str:
+    return f"+{index % 1000}.{index % 997:03d} g"
+
+
+async def bench_insert_per_message(readings: int, instruments: int) -> dict:
+    "A session, INSERT and commit per reading"
+    instrument_ids = [uuid.uuid4() for _ in range(instruments)]
+    latencies = []
+    started = time.perf_counter()
+    for index in range(readings):
+        call_started = time.perf_counter()
+        async with SessionLocal() as db:
+            await db.execute(
+                insert(models.InstrumentData).values(
+                    instrument_id=instrument_ids[index % instruments],
+                    data=reading(index),
+                    timestamp=datetime.now(),
+                )
+            )
+            await db.commit()
+        latencies.append(time.perf_counter() - call_started)
+    result = summary(latencies, time.perf_counter() - started)
+    await remove_instruments(instrument_ids)
+    return result
+
+
+async def bench_insert_pipeline(readings: int, instruments: int, seq: bool) -> dict:
+    "Through IngestPipeline, submit latency and rows/s until everything is committed"
+    pipeline = IngestPipeline(flush_interval=0.05)
+    await pipeline.start()
+    instrument_ids = [uuid.uuid4() for _ in range(instruments)]
+    receipt = pipeline.receipt(readings)
+    latencies = []
+    started = time.perf_counter()
+    for index in range(readings):
+        call_started = time.perf_counter()
+        await pipeline.submit(
+            instrument_ids[index % instruments],
+            reading(index),
+            seq=index + 1 if seq else None,
+            stored=receipt,
+        )
+        latencies.append(time.perf_counter() - call_started)
+    await receipt
+    elapsed = time.perf_counter() - started
+    await pipeline.stop()
+    await remove_instruments(instrument_ids)
+    result = summary(latencies, elapsed)
+    result["batches"] = pipeline.batches_flushed
+    result["avg_flush_latency_ms"] = pipeline.metrics()["avg_flush_latency_ms"]
+    return result
+
+
+async def remove_instruments(instrument_ids: list):
+    "Deletes what a benchmark wrote, everything else in the database is left alone"
+    async with SessionLocal() as db:
+        for model, column in (
+            (models.InstrumentData, models.InstrumentData.instrument_id),
+            (models.IngestSequence, models.IngestSequence.instrument_id),
+            (models.Instrument, models.Instrument.id),
+        ):
+            await db.execute(delete(model).where(column.in_(instrument_ids)))
+        await db.commit()
+
+
+def bench_create_pdf(rows: int, repeat: int) -> dict:
+    start = datetime(2024, 1, 1)
+    data = [
+        (
+            "Scale 1",
+            f"inspector {index % 7}",
+            f"{index}.000 g",
+            start + timedelta(hours=index),
+        )
+        for index in range(rows)
+    ]
+    result = time_calls(
+        lambda _: create_pdf(data, "Scale 1", start, None), range(repeat)
+    )
+    result["kb"] = round(len(create_pdf(data, "Scale 1", start, None)) / 1024, 1)
+    return result
+
+
+async def run(quick: bool) -> dict:
+    sizes = {name: values[:1] if quick else values for name, values in SIZES.items()}
+    scale = 1 if quick else 5
+    await init_db()
+    async with SessionLocal() as db:
+        db.add(
+            models.InstrumentProfile(
+                id=BENCHMARK_PROFILE,
+                brand="bench",
+                model="bench",
+                category="bench",
+                commands=commands_string(20),
+            )
+        )
+        await db.commit()
+    results = {}
+
+    for instruments, clients in sizes["broadcast"]:
+        results[f"broadcast_to_clients.{instruments}x{clients}"] = (
+            await bench_broadcast(instruments, clients, rounds=40 * scale)
+        )
+    for instruments in sizes["validate_command"]:
+        results[f"validate_command.{instruments}_instruments"] = (
+            await bench_validate_command(instruments, calls=2000 * scale)
+        )
+    results["check_if_led_command"] = bench_check_if_led_command(calls=20000 * scale)
+    for commands in sizes["commands"]:
+        results[f"convert_commands_string_to_dict.{commands}"] = bench_convert_commands(
+            commands, calls=2000 * scale
+        )
+    # a commit per reading is slow, its rate does not depend on the count
+    readings = sizes["insert"][0]
+    results[f"insert.per_message.{readings}"] = await bench_insert_per_message(
+        readings, instruments=10
+    )
+    for readings in sizes["insert"]:
+        results[f"insert.pipeline.{readings}"] = await bench_insert_pipeline(
+            readings, instruments=10, seq=False
+        )
+        results[f"insert.pipeline_seq.{readings}"] = await bench_insert_pipeline(
+            readings, instruments=10, seq=True
+        )
+    for rows in sizes["create_pdf"]:
+        results[f"create_pdf.{rows}_rows"] = bench_create_pdf(rows, repeat=3 * scale)
+
+    async with SessionLocal() as db:
+        await db.execute(
+            delete(models.InstrumentProfile).filter_by(id=BENCHMARK_PROFILE)
+        )
+        await db.commit()
+    await engine.dispose()
+    return results
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    "name -> ops_per_second for every measured case, nested ones included"
+    rates = {}
+    for name, result in results.items():
+        if not isinstance(result, dict):
+            continue
+        if "ops_per_second" in result:
+            rates[prefix + name] = result["ops_per_second"]
+        else:
+            rates.update(flatten(result, f"{prefix}{name}."))
+    return rates
+
+
+def compare(results: dict, baseline: dict) -> dict:
+    "Change of ops/s against an earlier run in percent, and the cases that got slower"
+    current, before = flatten(results), flatten(baseline)
+    changes = {
+        name: round((rate - before[name]) / before[name] * 100, 1)
+        for name, rate in current.items()
+        if before.get(name) and rate is not None
+    }
+    return {
+        "ops_per_second_change_percent": changes,
+        "regressions": sorted(
+            name for name, change in changes.items() if change < -REGRESSION_THRESHOLD
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="smallest sizes only")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    try:
+        results = asyncio.run(run(args.quick))
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "database": SQLALCHEMY_DATABASE_URL.split(":")[0],
+        "quick": args.quick,
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            report["baseline"] = compare(results, json.load(baseline)["results"])
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
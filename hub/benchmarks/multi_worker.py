@@ -0,0 +1,175 @@
+"""Fan-out throughput and latency of the hub with 1..N uvicorn workers.
+
+Starts the hub with `uvicorn --workers N` on a throwaway SQLite database and
+the Unix socket backplane, connects instruments and dashboard clients
+(each connection lands on whichever worker accepts it) and measures how many
+readings reach their subscribers and how long that takes.
+
+Run from the hub directory:
+
+    python benchmarks/multi_worker.py --workers 1 2 4 --instruments 20 --clients 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import requests
+import websockets
+
+
+HUB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_hub(workers: int, port: int, workdir: str):
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite+aiosqlite:///{workdir}/hub.db"
+    env["HUB_BACKPLANE"] = f"unix://{workdir}/backplane.sock"
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        cwd=HUB_DIR,
+        env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/data_routing/backplane/metrics")
+            # give the remaining workers a moment to join the backplane
+            time.sleep(1 + workers * 0.5)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("hub did not start")
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run_load(port: int, instruments: int, clients: int, readings: int, rate: float):
+    base = f"ws://127.0.0.1:{port}/data_routing/ws"
+    instrument_ids = [str(uuid.uuid4()) for _ in range(instruments)]
+    latencies = []
+    received = 0
+
+    instrument_sockets = [
+        await websockets.connect(f"{base}/instrument/{instrument_id}")
+        for instrument_id in instrument_ids
+    ]
+    client_sockets = [
+        await websockets.connect(f"{base}/client/{instrument_id}")
+        for instrument_id in instrument_ids
+        for _ in range(clients)
+    ]
+    await asyncio.sleep(1)
+
+    async def consume(ws):
+        nonlocal received
+        try:
+            async for message in ws:
+                try:
+                    sent_at = float(message)
+                except ValueError:
+                    continue  # online/offline notifications
+                latencies.append(time.perf_counter() - sent_at)
+                received += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    async def produce(ws):
+        for _ in range(readings):
+            await ws.send(json.dumps({"data": repr(time.perf_counter())}))
+            await asyncio.sleep(1 / rate)
+
+    consumers = [asyncio.create_task(consume(ws)) for ws in client_sockets]
+    started = time.perf_counter()
+    await asyncio.gather(*[produce(ws) for ws in instrument_sockets])
+    expected = instruments * clients * readings
+    # wait for stragglers
+    deadline = time.perf_counter() + 5
+    while received < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    for ws in instrument_sockets + client_sockets:
+        await ws.close()
+    for task in consumers:
+        task.cancel()
+
+    return {
+        "expected": expected,
+        "delivered": received,
+        "delivery_ratio": round(received / expected, 4) if expected else None,
+        "deliveries_per_second": round(received / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+            "p95": round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+            "p99": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+            "mean": (
+                round(statistics.mean(latencies) * 1000, 3) if latencies else None
+            ),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--instruments", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=5, help="per instrument")
+    parser.add_argument("--readings", type=int, default=100, help="per instrument")
+    parser.add_argument("--rate", type=float, default=20, help="readings/s each")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as workdir:
+            hub = start_hub(workers, args.port, workdir)
+            try:
+                result = asyncio.run(
+                    run_load(
+                        args.port,
+                        args.instruments,
+                        args.clients,
+                        args.readings,
+                        args.rate,
+                    )
+                )
+            finally:
+                hub.terminate()
+                hub.wait()
+        result["workers"] = workers
+        results.append(result)
+        print(json.dumps(result))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"benchmark": "multi_worker", "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 # instrument_hub.py
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import uvicorn
 from src.routes import (
@@ -8,9 +10,32 @@ from src.routes import (
     simulation,
     data_routing,
 )
+from src.db.db_init import init_db, engine
+from src.db.partitions import partition_maintenance
+from src.ingest import pipeline
+from src.backplane import backplane
+from src.reports import report_cache
+from src.retention import retention, retention_loop
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_db()
+    await pipeline.start()
+    await backplane.start()
+    maintenance = asyncio.create_task(partition_maintenance(engine))
+    retention_task = asyncio.create_task(retention_loop(retention))
+    yield
+    maintenance.cancel()
+    retention_task.cancel()
+    await backplane.stop()
+    # write out whatever is still queued before shutting down
+    await pipeline.stop()
+    report_cache.shutdown()
+    await engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(instrument_management.router)
 app.include_router(calibration.router)
 app.include_router(data_logs.router)
@@ -0,0 +1,6 @@
+"""Load generator for the hub.
+
+Impersonates instruments and dashboards over the hub's real websocket
+endpoints and reports ingest throughput, fan-out latency and the database
+write rate. Run `python -m simulator --help` from the hub directory.
+"""
@@ -0,0 +1,230 @@
+"""Simulated instruments and dashboards against a running (or throwaway) hub.
+
+Run from the hub directory:
+
+    python -m simulator --start-hub --instruments 50 --dashboards 100 --rate 5
+    python -m simulator --url http://10.0.0.5:9000 --protocol gateway --output run.json
+    python -m simulator --start-hub --recording scale.txt --realtime --baseline run.json
+
+Instruments cycle through `--profiles` (synthetic readings shaped like each
+driver's output) unless `--recording` gives a captured driver output to
+replay. Dashboards are spread evenly over the instruments. The database
+numbers come from /data_routing/ingest/metrics, with several hub workers
+that is the worker that answered.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from .load import SimulatedGateway, SimulatedInstrument, Stats, dashboard
+from .report import compare, latency_summary, load
+from .streams import PROFILES, load_recording, replay, synthetic
+
+
+HUB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_hub(port: int, workers: int, workdir: str) -> subprocess.Popen:
+    "uvicorn on a throwaway SQLite database"
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite+aiosqlite:///{workdir}/hub.db"
+    if workers > 1:
+        env["HUB_BACKPLANE"] = f"unix://{workdir}/backplane.sock"
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        cwd=HUB_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    wait_for_hub(f"http://127.0.0.1:{port}")
+    time.sleep(workers * 0.5)  # the other workers join the backplane
+    return process
+
+
+def wait_for_hub(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(f"{url}/data_routing/ingest/metrics", timeout=2)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f"hub at {url} is not answering")
+
+
+def ingest_metrics(url: str) -> dict:
+    return requests.get(f"{url}/data_routing/ingest/metrics", timeout=5).json()
+
+
+def make_streams(args) -> list:
+    if args.recording:
+        readings = load_recording(args.recording)
+        if not args.realtime:
+            readings = [(None, text) for _, text in readings]
+        return [replay(readings) for _ in range(args.instruments)]
+    profiles = args.profiles.split(",")
+    for name in profiles:
+        if name not in PROFILES:
+            raise SystemExit(f"unknown profile {name}, known: {', '.join(PROFILES)}")
+    return [
+        synthetic(PROFILES[profiles[index % len(profiles)]], seed=args.seed + index)
+        for index in range(args.instruments)
+    ]
+
+
+async def simulate(args) -> dict:
+    base_url = args.url.replace("http", "ws", 1) + "/data_routing/ws"
+    protocol = "outbox" if args.protocol == "gateway" else args.protocol
+    instruments = [
+        SimulatedInstrument(base_url, stream, args.rate, protocol)
+        for stream in make_streams(args)
+    ]
+    stats = Stats()
+    stop = asyncio.Event()
+
+    dashboards = [
+        asyncio.create_task(
+            dashboard(base_url, instruments[index % len(instruments)], stats)
+        )
+        for index in range(args.dashboards)
+    ]
+    await asyncio.sleep(0.5)  # subscribed before the first reading
+
+    if args.protocol == "gateway":
+        senders = [
+            SimulatedGateway(base_url, instruments[start : start + args.per_gateway])
+            for start in range(0, len(instruments), args.per_gateway)
+        ]
+    else:
+        senders = instruments
+    before = await asyncio.to_thread(ingest_metrics, args.url)
+    started = time.perf_counter()
+    runs = [asyncio.create_task(sender.run(stats, stop)) for sender in senders]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    sent_for = time.perf_counter() - started
+    results = await asyncio.gather(*runs, return_exceptions=True)
+    stats.errors = sum(isinstance(result, Exception) for result in results)
+    await asyncio.sleep(1)  # last deliveries and the pipeline's flush
+    elapsed = time.perf_counter() - started
+    after = await asyncio.to_thread(ingest_metrics, args.url)
+    for task in dashboards:
+        task.cancel()
+
+    # every reading should reach each dashboard of its instrument
+    expected = sum(
+        len(instruments[index % len(instruments)].timeline.texts)
+        for index in range(args.dashboards)
+    )
+    rows = after["rows_written"] - before["rows_written"]
+    return {
+        "config": {
+            "instruments": args.instruments,
+            "dashboards": args.dashboards,
+            "rate": args.rate,
+            "duration": args.duration,
+            "protocol": args.protocol,
+            "source": args.recording or args.profiles,
+        },
+        "sent": stats.sent,
+        "sent_per_second": round(stats.sent / sent_for, 1),
+        "connection_errors": stats.errors,
+        "ingest": {
+            "acked": stats.acked if protocol == "outbox" else None,
+            "acked_per_second": (
+                round(stats.acked / elapsed, 1) if protocol == "outbox" else None
+            ),
+            "ack_latency_ms": latency_summary(stats.ack_latencies),
+        },
+        "fanout": {
+            "expected": expected,
+            "delivered": stats.delivered,
+            "delivery_ratio": (
+                round(stats.delivered / expected, 4) if expected else None
+            ),
+            "deliveries_per_second": round(stats.delivered / elapsed, 1),
+            "unmatched": stats.unmatched,
+            "latency_ms": latency_summary(stats.fanout_latencies),
+        },
+        "db": {
+            "rows_written": rows,
+            "rows_per_second": round(rows / elapsed, 1),
+            "rows_replayed": after.get("rows_replayed", 0)
+            - before.get("rows_replayed", 0),
+            "flush_errors": after["flush_errors"] - before["flush_errors"],
+            "avg_flush_latency_ms": after["avg_flush_latency_ms"],
+            "max_flush_latency_ms": after["max_flush_latency_ms"],
+            "backpressure_waits": after["backpressure_waits"]
+            - before["backpressure_waits"],
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:9000", help="hub to load")
+    parser.add_argument(
+        "--start-hub", action="store_true", help="run a hub on a temporary SQLite DB"
+    )
+    parser.add_argument("--port", type=int, default=9400, help="with --start-hub")
+    parser.add_argument("--workers", type=int, default=1, help="with --start-hub")
+    parser.add_argument("--instruments", type=int, default=20)
+    parser.add_argument("--dashboards", type=int, default=20, help="in total")
+    parser.add_argument("--rate", type=float, default=5, help="readings/s each")
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument(
+        "--protocol", choices=["outbox", "json", "gateway"], default="outbox"
+    )
+    parser.add_argument("--per-gateway", type=int, default=8, help="instruments")
+    parser.add_argument("--profiles", default=",".join(PROFILES))
+    parser.add_argument("--recording", help="driver output to replay")
+    parser.add_argument(
+        "--realtime", action="store_true", help="keep the recorded gaps"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--baseline", help="earlier report to compare with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        hub = None
+        if args.start_hub:
+            args.url = f"http://127.0.0.1:{args.port}"
+            hub = start_hub(args.port, args.workers, workdir)
+        try:
+            wait_for_hub(args.url)
+            report = asyncio.run(simulate(args))
+        finally:
+            if hub:
+                hub.terminate()
+                hub.wait()
+
+    if args.baseline:
+        report["change_vs_baseline_percent"] = compare(report, load(args.baseline))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import time
+import uuid
+from typing import Iterator, List
+
+import websockets
+
+from src.gateway import ACK, OPEN, READINGS, decode, encode
+
+
+# Dashboards look for their reading this far ahead in the instrument's timeline
+MATCH_LOOKAHEAD = 1000
+NOTIFICATIONS = ("online", "offline")
+
+
+class Timeline:
+    """Readings one simulated instrument sent, with their send times.
+
+    Every dashboard of the instrument walks through it with its own
+    position, readings the hub dropped for a slow dashboard are skipped.
+    """
+
+    def __init__(self):
+        self.texts = []
+        self.times = []
+
+    def add(self, text: str, sent_at: float):
+        self.texts.append(text)
+        self.times.append(sent_at)
+
+    def match(self, position: int, text: str):
+        "Returns (send time, next position), send time None if it is not there"
+        end = min(len(self.texts), position + MATCH_LOOKAHEAD)
+        for index in range(position, end):
+            if self.texts[index] == text:
+                return self.times[index], index + 1
+        return None, position
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.acked = 0
+        self.ack_latencies = []
+        self.delivered = 0
+        self.fanout_latencies = []
+        self.unmatched = 0
+        self.errors = 0
+
+
+class SimulatedInstrument:
+    """One instrument on /data_routing/ws/instrument/{id}.
+
+    protocol "outbox" speaks like main.js with an outbox (one reading per
+    message with seq and capture time, acknowledged once stored), "json"
+    like the old main.js ({"data": ...}, no acknowledgement).
+    """
+
+    def __init__(self, base_url: str, stream: Iterator, rate: float, protocol: str):
+        self.id = str(uuid.uuid4())
+        self.url = f"{base_url}/instrument/{self.id}"
+        self.stream = stream
+        self.rate = rate
+        self.protocol = protocol
+        self.timeline = Timeline()
+        self.unacked = {}  # seq -> send time
+        self.seq = int(time.time() * 1_000_000)
+
+    def on_ack(self, seq: int, stats: Stats):
+        now = time.time()
+        for sent_seq in [s for s in self.unacked if s <= seq]:
+            stats.ack_latencies.append(now - self.unacked.pop(sent_seq))
+            stats.acked += 1
+
+    async def receive(self, websocket, stats: Stats):
+        async for message in websocket:
+            if message.startswith('{"ack"'):
+                self.on_ack(json.loads(message)["ack"], stats)
+
+    def message(self, text: str, now: float) -> str:
+        if self.protocol == "json":
+            return json.dumps({"data": text})
+        self.seq += 1
+        self.unacked[self.seq] = now
+        return json.dumps({"readings": [[self.seq, now, text]], "sent_at": now})
+
+    async def run(self, stats: Stats, stop: asyncio.Event):
+        async with websockets.connect(self.url) as websocket:
+            receiver = asyncio.create_task(self.receive(websocket, stats))
+            await pace(self.stream, self.rate, stop, self.send(websocket, stats))
+            await drain(lambda: not self.unacked, stop)
+            receiver.cancel()
+
+    def send(self, websocket, stats: Stats):
+        async def send(text: str):
+            now = time.time()
+            self.timeline.add(text, now)
+            await websocket.send(self.message(text, now))
+            stats.sent += 1
+
+        return send
+
+
+class SimulatedGateway:
+    "An edge agent with several instruments on /data_routing/ws/gateway"
+
+    def __init__(self, base_url: str, instruments: List[SimulatedInstrument]):
+        self.url = f"{base_url}/gateway"
+        self.instruments = instruments
+        self.unacked = {}  # seq -> send time
+        self.seq = int(time.time() * 1_000_000)
+
+    async def receive(self, websocket, stats: Stats):
+        async for frame in websocket:
+            message = decode(frame)
+            if message[0] != ACK:
+                continue
+            now = time.time()
+            for seq in [s for s in self.unacked if s <= message[1]]:
+                stats.ack_latencies.append(now - self.unacked.pop(seq))
+                stats.acked += 1
+
+    async def run(self, stats: Stats, stop: asyncio.Event):
+        async with websockets.connect(self.url) as websocket:
+            for channel, instrument in enumerate(self.instruments):
+                instrument_id = uuid.UUID(instrument.id)
+                await websocket.send(encode([OPEN, channel, instrument_id.bytes, True]))
+            receiver = asyncio.create_task(self.receive(websocket, stats))
+            await asyncio.gather(
+                *[
+                    pace(
+                        instrument.stream,
+                        instrument.rate,
+                        stop,
+                        self.send(websocket, stats, channel, instrument),
+                    )
+                    for channel, instrument in enumerate(self.instruments)
+                ]
+            )
+            await drain(lambda: not self.unacked, stop)
+            receiver.cancel()
+
+    def send(self, websocket, stats: Stats, channel: int, instrument):
+        async def send(text: str):
+            now = time.time()
+            self.seq += 1
+            self.unacked[self.seq] = now
+            instrument.timeline.add(text, now)
+            await websocket.send(
+                encode([READINGS, [[channel, self.seq, now, text]], now])
+            )
+            stats.sent += 1
+
+        return send
+
+
+async def pace(stream: Iterator, rate: float, stop: asyncio.Event, send):
+    "Sends readings at `rate` per second, or with the stream's recorded gaps"
+    next_send = time.monotonic()
+    for gap, text in stream:
+        if stop.is_set():
+            return
+        next_send += gap if gap is not None else 1 / rate
+        await send(text)
+        delay = next_send - time.monotonic()
+        if delay > 0:
+            try:
+                await asyncio.wait_for(stop.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def drain(done, stop: asyncio.Event, timeout: float = 5):
+    "Waits a little for acknowledgements still on their way"
+    deadline = time.monotonic() + timeout
+    while not done() and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+
+async def dashboard(base_url: str, instrument: SimulatedInstrument, stats: Stats):
+    "A client watching one instrument, measures the time each reading took"
+    position = 0
+    async with websockets.connect(f"{base_url}/client/{instrument.id}") as websocket:
+        async for message in websocket:
+            if message in NOTIFICATIONS or message.startswith("Error"):
+                continue
+            sent_at, position = instrument.timeline.match(position, message)
+            if sent_at is None:
+                stats.unmatched += 1
+                continue
+            stats.delivered += 1
+            stats.fanout_latencies.append(time.time() - sent_at)
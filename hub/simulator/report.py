@@ -0,0 +1,55 @@
+import json
+
+
+# (path in the report, True if higher is better) compared against a baseline
+TRACKED = [
+    (("ingest", "acked_per_second"), True),
+    (("ingest", "ack_latency_ms", "p95"), False),
+    (("fanout", "deliveries_per_second"), True),
+    (("fanout", "latency_ms", "p50"), False),
+    (("fanout", "latency_ms", "p99"), False),
+    (("db", "rows_per_second"), True),
+]
+
+
+def percentile(values: list, p: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def latency_summary(seconds: list) -> dict:
+    return {
+        name: round(percentile(seconds, p) * 1000, 3) if seconds else None
+        for name, p in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+    }
+
+
+def lookup(report: dict, path: tuple):
+    for key in path:
+        if not isinstance(report, dict):
+            return None
+        report = report.get(key)
+    return report
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    """Change of the tracked numbers against a baseline report, in percent.
+
+    Positive always means better, so a regression shows up as a negative
+    number whichever direction the metric goes.
+    """
+    changes = {}
+    for path, higher_is_better in TRACKED:
+        now, before = lookup(report, path), lookup(baseline, path)
+        if not now or not before:
+            continue
+        change = (now - before) / before * 100
+        changes[".".join(path)] = round(change if higher_is_better else -change, 1)
+    return changes
+
+
+def load(path: str) -> dict:
+    with open(path) as baseline:
+        return json.load(baseline)
@@ -0,0 +1,87 @@
+import random
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+
+@dataclass
+class Profile:
+    "How the readings of one driver type look once the driver printed them"
+
+    base: float
+    spread: float  # random walk step
+    decimals: int
+    unit: str = ""
+    sign: bool = False  # printed with + for positive values
+    status_lines: Tuple[str, ...] = ()  # occasional non-numeric readings
+
+
+PROFILES = {
+    "sartorius_scale": Profile(
+        120.0, 0.05, 3, "g", sign=True, status_lines=("Status: Overload",)
+    ),
+    "quantumt_scanner": Profile(1.2, 0.002, 3, "mm", sign=True),
+    "mitutoyo_caliper": Profile(25.0, 0.01, 2),
+    "mitutoyo_dial_gauge": Profile(0.5, 0.001, 3),
+    "agr_rpt2": Profile(0.35, 0.002, 3, "mm"),
+    "agr_c173": Profile(25.4, 0.05, 1, "um"),
+}
+STATUS_PROBABILITY = 0.002
+
+
+def synthetic(profile: Profile, seed: int = None) -> Iterator[Tuple[None, str]]:
+    """Endless (gap, text) readings of a driver type.
+
+    The value drifts around the profile's base like a part being measured
+    over and over, now and then a status line comes instead. The gap is
+    always None, synthetic streams run at the configured rate.
+    """
+    rng = random.Random(seed)
+    value = profile.base
+    while True:
+        if profile.status_lines and rng.random() < STATUS_PROBABILITY:
+            yield None, rng.choice(profile.status_lines)
+            continue
+        value += rng.gauss(0, profile.spread)
+        value += (profile.base - value) * 0.05  # stay near the base
+        number = f"{value:{'+' if profile.sign else ''}.{profile.decimals}f}"
+        yield None, f"{number} {profile.unit}".strip()
+
+
+def load_recording(path: str) -> List[Tuple[Optional[float], str]]:
+    """Reads driver output captured on a device, e.g.
+
+        DRIVER_TIMESTAMPS=1 python driver.py > scale.txt
+
+    Lines are `<capture time>\\t<reading>` or only the reading. The times
+    (None if there are none) let the stream be replayed with the recorded
+    gaps between readings.
+    """
+    readings = []
+    with open(path) as recording:
+        for line in recording:
+            line = line.rstrip("\n")
+            captured_at, tab, text = line.partition("\t")
+            if not tab:
+                captured_at, text = None, line
+            else:
+                try:
+                    captured_at = float(captured_at)
+                except ValueError:
+                    captured_at, text = None, line
+            if text.strip():
+                readings.append((captured_at, text.strip()))
+    if not readings:
+        raise ValueError(f"{path} holds no readings")
+    return readings
+
+
+def replay(readings: list) -> Iterator[Tuple[Optional[float], str]]:
+    "Loops over a recording as (gap, text), gap is the recorded time since the last one"
+    while True:
+        previous = None
+        for captured_at, text in readings:
+            gap = None
+            if captured_at is not None and previous is not None:
+                gap = max(0.0, captured_at - previous)
+            previous = captured_at
+            yield gap, text
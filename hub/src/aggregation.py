@@ -0,0 +1,219 @@
+import math
+import os
+from datetime import datetime, timezone
+from uuid import UUID
+
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import Integer, cast, func, select
+
+from src import rollups
+from src.db import models
+
+
+AGGREGATE_MAX_POINTS = int(os.getenv("AGGREGATE_MAX_POINTS", "5000"))
+# LTTB needs every numeric reading of the range in memory (16 bytes each)
+AGGREGATE_LTTB_MAX_ROWS = int(os.getenv("AGGREGATE_LTTB_MAX_ROWS", "2000000"))
+AGGREGATE_CHUNK_SIZE = 50000  # rows per fetch for LTTB
+
+# Bucket widths in seconds, the narrowest one giving at most `points` buckets
+# is used. Buckets start at multiples of their width (whole minutes, hours,
+# days in UTC), so they line up however the range is chosen.
+BUCKET_WIDTHS = (
+    [1, 2, 5, 10, 15, 30]
+    + [minutes * 60 for minutes in (1, 2, 5, 10, 15, 30)]
+    + [hours * 3600 for hours in (1, 2, 3, 6, 12)]
+    + [days * 86400 for days in (1, 2, 7)]
+)
+
+
+def to_epoch(timestamp: datetime) -> float:
+    "Timestamps are stored without a zone, they are read as UTC here and in SQL"
+    return timestamp.replace(tzinfo=timezone.utc).timestamp()
+
+
+def from_epoch(seconds: float) -> datetime:
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+
+
+def epoch_column(dialect: str, column=models.InstrumentData.timestamp):
+    "Seconds since 1970 of a timestamp column, as a float"
+    if dialect == "postgresql":
+        return func.extract("epoch", column)
+    # SQLite stores ISO text, julianday() parses it
+    return (func.julianday(column) - 2440587.5) * 86400.0
+
+
+def choose_bucket(since: datetime, until: datetime, points: int) -> int:
+    span = (until - since).total_seconds()
+    for width in BUCKET_WIDTHS:
+        if span / width <= points:
+            return width
+    return int(-(-span // points))
+
+
+def numeric_readings(instrument_id: UUID, since: datetime, until: datetime):
+    return (
+        models.InstrumentData.instrument_id == instrument_id,
+        models.InstrumentData.timestamp >= since,
+        models.InstrumentData.timestamp < until,
+        models.InstrumentData.value.is_not(None),
+    )
+
+
+def bucket_index(dialect: str, column, bucket: float):
+    if dialect == "postgresql":
+        return func.floor(epoch_column(dialect, column) / bucket).label("bucket")
+    # julianday() is a few microseconds off, which would move readings at
+    # the very start of a bucket into the one before. Whole seconds are exact.
+    seconds = cast(func.strftime("%s", column), Integer)
+    return cast(seconds / bucket, Integer).label("bucket")  # epochs are positive
+
+
+def rollup_resolution(bucket: float):
+    "Widest rollup that buckets of this width can be added up from"
+    for resolution in reversed(rollups.RESOLUTIONS):
+        if bucket % resolution == 0:
+            return resolution
+    return None
+
+
+def summarize(bucket_start: float, count, minimum, maximum, total, squares) -> dict:
+    count = int(count)  # sum() of the rollup counts is a numeric on PostgreSQL
+    mean = total / count
+    return {
+        "timestamp": from_epoch(bucket_start),
+        "count": count,
+        "min": minimum,
+        "max": maximum,
+        "mean": mean,
+        "stddev": math.sqrt(max(squares / count - mean * mean, 0.0)),
+    }
+
+
+async def bucket_stats(
+    db,
+    instrument_id: UUID,
+    since: datetime,
+    until: datetime,
+    bucket: float,
+    source: str = "auto",
+) -> list:
+    """count/min/max/mean/stddev of the numeric readings per bucket.
+
+    Buckets that are whole minutes, hours or days are added up from the
+    rollups (source "auto" or "rollup"), their first bucket then also
+    counts the readings before `since` in the same minute/hour/day. Other
+    widths, or source "raw", group the raw readings in SQL. Empty buckets
+    are left out, a chart shows them as gaps.
+    """
+    resolution = rollup_resolution(bucket) if source != "raw" else None
+    if source == "rollup" and resolution is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Rollups need a bucket of whole minutes, hours or days.",
+        )
+    dialect = db.bind.dialect.name
+    if resolution:
+        rollup = models.DataRollup
+        index = bucket_index(dialect, rollup.bucket, bucket)
+        query = select(
+            index,
+            func.sum(rollup.count),
+            func.min(rollup.min),
+            func.max(rollup.max),
+            func.sum(rollup.sum),
+            func.sum(rollup.sumsq),
+        ).filter(
+            rollup.instrument_id == instrument_id,
+            rollup.resolution == resolution,
+            rollup.bucket >= since.replace(**rollups.TRUNCATE[resolution]),
+            rollup.bucket < until,
+        )
+    else:
+        index = bucket_index(dialect, models.InstrumentData.timestamp, bucket)
+        value = models.InstrumentData.value
+        query = select(
+            index,
+            func.count(value),
+            func.min(value),
+            func.max(value),
+            func.sum(value),
+            func.sum(value * value),
+        ).filter(*numeric_readings(instrument_id, since, until))
+    rows = (await db.execute(query.group_by(index).order_by(index))).all()
+    return [summarize(int(row[0]) * bucket, *row[1:]) for row in rows]
+
+
+async def numeric_series(db, instrument_id: UUID, since: datetime, until: datetime):
+    "(epoch seconds, value) arrays of the range, fetched in chunks"
+    epoch = epoch_column(db.bind.dialect.name)
+    query = (
+        select(epoch, models.InstrumentData.value)
+        .filter(*numeric_readings(instrument_id, since, until))
+        .order_by(models.InstrumentData.timestamp)
+        .execution_options(yield_per=AGGREGATE_CHUNK_SIZE)
+    )
+    chunks = []
+    rows = 0
+    result = await db.stream(query)
+    async for chunk in result.partitions():
+        rows += len(chunk)
+        if rows > AGGREGATE_LTTB_MAX_ROWS:
+            await result.close()
+            raise HTTPException(
+                status_code=400,
+                detail=f"More than {AGGREGATE_LTTB_MAX_ROWS} readings in this range, "
+                "use mode=stats or a shorter range",
+            )
+        # np.array() on Row objects goes through the sequence protocol
+        # element by element, fromiter is ~100x faster
+        values = (value for row in chunk for value in row)
+        chunks.append(np.fromiter(values, np.float64, count=2 * len(chunk)))
+    if not chunks:
+        return np.empty(0), np.empty(0)
+    series = np.concatenate(chunks).reshape(-1, 2)
+    return series[:, 0], series[:, 1]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, points: int):
+    """Largest-Triangle-Three-Buckets downsampling to `points` points.
+
+    Keeps the first and last point and from every bucket in between the one
+    forming the largest triangle with the point kept before it and the mean
+    of the next bucket, so peaks survive where averaging would flatten them.
+    Each bucket is one vectorized step.
+    """
+    count = len(x)
+    if points >= count or points < 3:
+        return x, y
+    edges = (np.arange(points - 1) * (count - 2) / (points - 2)).astype(np.int64) + 1
+    edges[-1] = count - 1
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = count - 1
+    kept = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else count
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+        areas = np.abs(
+            (x[kept] - next_x) * (y[start:end] - y[kept])
+            - (x[kept] - x[start:end]) * (next_y - y[kept])
+        )
+        kept = start + int(np.argmax(areas))
+        selected[bucket + 1] = kept
+    return x[selected], y[selected]
+
+
+async def lttb_points(
+    db, instrument_id: UUID, since: datetime, until: datetime, points: int
+) -> list:
+    x, y = await numeric_series(db, instrument_id, since, until)
+    x, y = lttb(x, y, points)
+    # julianday() on SQLite is only exact to about 10 microseconds
+    return [
+        {"timestamp": from_epoch(round(seconds, 3)), "value": value}
+        for seconds, value in zip(x.tolist(), y.tolist())
+    ]
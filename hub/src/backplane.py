@@ -0,0 +1,299 @@
+import asyncio
+import fcntl
+import hmac
+import ipaddress
+import json
+import os
+import uuid
+from typing import Awaitable, Callable, Dict, List
+from urllib.parse import urlparse
+
+
+HUB_BACKPLANE = os.getenv("HUB_BACKPLANE", "local")
+# Stop queueing messages for the broker once this many bytes are unsent
+BACKPLANE_MAX_BUFFER = int(os.getenv("BACKPLANE_MAX_BUFFER", str(4 * 1024 * 1024)))
+BACKPLANE_RECONNECT_DELAY = 1.0  # seconds
+# Received messages waiting for their handlers, per channel
+BACKPLANE_QUEUE_SIZE = int(os.getenv("BACKPLANE_QUEUE_SIZE", "10000"))
+# Every worker sends it first, the broker drops peers without it. Required
+# for a tcp:// backplane that is reachable from other hosts.
+BACKPLANE_SECRET = os.getenv("BACKPLANE_SECRET", "")
+BACKPLANE_AUTH_TIMEOUT = 5.0  # seconds
+
+Handler = Callable[[str, str], Awaitable[None]]
+
+
+class InProcessBackplane:
+    """Backplane for a single hub process.
+
+    The ConnectionManager always delivers to its own sockets first, a
+    backplane only has to reach *other* workers. With one process there are
+    none, so publishing is a no-op.
+    """
+
+    def __init__(self):
+        self.handlers: Dict[str, List[Handler]] = {}
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+
+    def subscribe(self, channel: str, handler: Handler):
+        self.handlers.setdefault(channel, []).append(handler)
+
+    def publish(self, channel: str, key: str, message: str):
+        self.published += 1
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def dispatch(self, channel: str, key: str, message: str):
+        self.received += 1
+        for handler in self.handlers.get(channel, ()):
+            try:
+                await handler(key, message)
+            except Exception as e:
+                print(f"backplane handler for '{channel}' failed: {e}")
+
+    def metrics(self) -> dict:
+        return {
+            "type": type(self).__name__,
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+        }
+
+
+class BackplaneBroker:
+    "Relays every line it gets from one peer to all other peers"
+
+    def __init__(self):
+        self.peers = set()
+        self.server = None
+
+    async def start(self, address):
+        if address.scheme == "unix":
+            self.server = await asyncio.start_unix_server(self._serve, address.path)
+        else:
+            self.server = await asyncio.start_server(
+                self._serve, address.hostname, address.port
+            )
+
+    async def _serve(self, reader, writer):
+        try:
+            secret = await asyncio.wait_for(reader.readline(), BACKPLANE_AUTH_TIMEOUT)
+        except (ValueError, ConnectionError, asyncio.TimeoutError):
+            secret = b""
+        if not hmac.compare_digest(secret.rstrip(b"\n"), BACKPLANE_SECRET.encode()):
+            print(f"backplane peer {writer.get_extra_info('peername')} refused")
+            writer.close()
+            return
+        self.peers.add(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    continue  # longer than the stream limit, readline() skipped it
+                if not line:
+                    break
+                for peer in list(self.peers):
+                    if peer is writer:
+                        continue
+                    # a peer that does not keep up loses messages, not the broker
+                    if peer.transport.get_write_buffer_size() < BACKPLANE_MAX_BUFFER:
+                        peer.write(line)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.peers.discard(writer)
+            writer.close()
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            for peer in list(self.peers):
+                peer.close()
+
+
+class SocketBackplane(InProcessBackplane):
+    """Backplane between hub workers over a Unix or TCP socket.
+
+    Every worker connects to one broker and sends newline delimited JSON
+    messages, the broker relays them to the other workers. The first worker
+    that cannot reach a broker starts one itself, so `uvicorn --workers N`
+    needs no extra process. For several nodes point all of them at the same
+    tcp:// address.
+    """
+
+    def __init__(self, url: str):
+        super().__init__()
+        self.url = url
+        self.address = urlparse(url)
+        self.worker_id = uuid.uuid4().hex
+        self.broker: BackplaneBroker = None
+        self.writer: asyncio.StreamWriter = None
+        self.reader_task: asyncio.Task = None
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.dispatchers: List[asyncio.Task] = []
+        self.stopping = False
+
+    async def start(self):
+        await self._connect()
+        self.reader_task = asyncio.create_task(self._read_loop())
+
+    async def _open(self):
+        if self.address.scheme == "unix":
+            return await asyncio.open_unix_connection(self.address.path)
+        return await asyncio.open_connection(self.address.hostname, self.address.port)
+
+    async def _connect(self):
+        while True:
+            try:
+                self.reader, self.writer = await self._open()
+                self.writer.write(BACKPLANE_SECRET.encode() + b"\n")
+                return
+            except OSError:
+                pass
+            try:
+                await self._become_broker()
+            except OSError as e:
+                # somebody else won the race or the address is not ours to bind
+                print(f"backplane broker not reachable at {self.url}: {e}")
+                await asyncio.sleep(BACKPLANE_RECONNECT_DELAY)
+
+    async def _become_broker(self):
+        if self.address.scheme != "unix":
+            broker = BackplaneBroker()
+            await broker.start(self.address)
+            self.broker = broker
+            return
+        # serialize the election so two workers never unlink each other's socket
+        with open(self.address.path + ".lock", "w") as lock:
+            while True:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(0.05)  # never block the event loop
+            try:
+                reader, writer = await self._open()
+                writer.close()
+                return  # another worker started it while we waited for the lock
+            except OSError:
+                pass
+            if os.path.exists(self.address.path):
+                os.unlink(self.address.path)  # stale socket of a dead broker
+            broker = BackplaneBroker()
+            await broker.start(self.address)
+            self.broker = broker
+
+    async def _read_loop(self):
+        while not self.stopping:
+            try:
+                line = await self.reader.readline()
+            except ValueError:
+                # longer than the stream limit, readline() skipped it
+                self.dropped += 1
+                continue
+            except OSError as e:
+                print(f"backplane read failed: {e}")
+                line = b""
+            if not line:
+                if self.stopping:
+                    return
+                print("backplane connection lost, reconnecting")
+                self.writer.close()
+                await self._connect()
+                continue
+            try:
+                envelope = json.loads(line)
+                worker, channel = envelope["w"], envelope["c"]
+                key, message = envelope["k"], envelope["m"]
+            except (ValueError, KeyError, TypeError):
+                print(f"backplane message malformed: {line[:100]!r}")
+                self.dropped += 1
+                continue
+            if worker != self.worker_id:
+                self._enqueue(channel, key, message)
+
+    def _enqueue(self, channel: str, key: str, message: str):
+        """Hands a message to the channel's dispatcher task.
+
+        One task per channel keeps the order within a channel, while a slow
+        handler (e.g. a fan-out to many sockets) only holds up its own
+        channel and never the read loop.
+        """
+        queue = self.queues.get(channel)
+        if queue is None:
+            queue = self.queues[channel] = asyncio.Queue(BACKPLANE_QUEUE_SIZE)
+            self.dispatchers.append(asyncio.create_task(self._dispatcher(channel)))
+        try:
+            queue.put_nowait((key, message))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _dispatcher(self, channel: str):
+        queue = self.queues[channel]
+        while True:
+            key, message = await queue.get()
+            await self.dispatch(channel, key, message)
+
+    def publish(self, channel: str, key: str, message: str):
+        if self.writer is None or self.writer.is_closing():
+            self.dropped += 1
+            return
+        if self.writer.transport.get_write_buffer_size() >= BACKPLANE_MAX_BUFFER:
+            self.dropped += 1
+            return
+        envelope = {"w": self.worker_id, "c": channel, "k": key, "m": message}
+        self.writer.write(json.dumps(envelope).encode() + b"\n")
+        self.published += 1
+
+    async def stop(self):
+        self.stopping = True
+        if self.writer:
+            self.writer.close()
+        if self.reader_task:
+            self.reader_task.cancel()
+        for dispatcher in self.dispatchers:
+            dispatcher.cancel()
+        if self.broker:
+            await self.broker.stop()
+
+    def metrics(self) -> dict:
+        metrics = super().metrics()
+        metrics["url"] = self.url
+        metrics["is_broker"] = self.broker is not None
+        metrics["queued"] = {
+            channel: queue.qsize() for channel, queue in self.queues.items()
+        }
+        return metrics
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def create_backplane(url: str = HUB_BACKPLANE):
+    if url in ("", "local"):
+        return InProcessBackplane()
+    address = urlparse(url)
+    if address.scheme == "tcp" and not BACKPLANE_SECRET:
+        if not is_loopback(address.hostname):
+            raise ValueError(
+                f"Backplane '{url}' is open to other hosts, set BACKPLANE_SECRET"
+            )
+    if address.scheme in ("unix", "tcp"):
+        return SocketBackplane(url)
+    raise ValueError(f"Unsupported backplane '{url}', use local, unix:// or tcp://")
+
+
+backplane = create_backplane()
@@ -0,0 +1,78 @@
+import os
+import time
+from collections import deque
+
+
+CLOCK_WINDOW = float(os.getenv("CLOCK_WINDOW", "300"))  # seconds of samples
+
+
+class ClockOffset:
+    """Estimates how far one edge device's clock is from the hub's.
+
+    Every message from the device carries the device time it was sent at.
+    Hub time on arrival minus that is the clock offset plus the network and
+    queueing delay, and since the delay only ever adds, the smallest sample
+    of the last `window` seconds is the best estimate (the minimum filter
+    NTP clients use). Old samples expire, so a clock that was stepped is
+    followed within one window.
+    """
+
+    def __init__(self, window: float = CLOCK_WINDOW):
+        self.window = window
+        # (arrival, sample) with growing samples, the first one is the minimum
+        self.samples = deque()
+        self.sample_count = 0
+        self.last_sample = None
+
+    def add(self, sent_at: float, received_at: float = None):
+        received_at = time.time() if received_at is None else received_at
+        sample = received_at - sent_at
+        while self.samples and self.samples[-1][1] >= sample:
+            self.samples.pop()
+        self.samples.append((received_at, sample))
+        while self.samples[0][0] < received_at - self.window:
+            self.samples.popleft()
+        self.sample_count += 1
+        self.last_sample = sample
+
+    @property
+    def offset(self) -> float:
+        "Seconds to add to a device time to get hub time, 0 without samples"
+        return self.samples[0][1] if self.samples else 0.0
+
+    def to_hub_time(self, device_time: float) -> float:
+        return device_time + self.offset
+
+    def metrics(self) -> dict:
+        return {
+            "offset_ms": round(self.offset * 1000, 3),
+            "last_sample_ms": round(self.last_sample * 1000, 3)
+            if self.last_sample is not None
+            else None,
+            "samples": self.sample_count,
+        }
+
+
+class ClockOffsets:
+    """The ClockOffset of every connected edge device.
+
+    An estimate lives as long as the device's connection: the first message
+    after a reconnect brings a fresh sample, and devices behind one NAT
+    address cannot mix up each other's estimates.
+    """
+
+    def __init__(self):
+        self.devices = {}
+
+    def open(self, device: str) -> ClockOffset:
+        clock = self.devices[device] = ClockOffset()
+        return clock
+
+    def close(self, device: str):
+        self.devices.pop(device, None)
+
+    def metrics(self) -> dict:
+        return {device: clock.metrics() for device, clock in self.devices.items()}
+
+
+clock_offsets = ClockOffsets()
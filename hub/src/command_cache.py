@@ -0,0 +1,136 @@
+import abc
+import os
+import time
+from typing import Dict, FrozenSet, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import select
+
+from src.db import models
+from src.db.db_init import SessionLocal
+from src.backplane import backplane
+from src.utils import convert_commands_string_to_dict
+
+
+COMMAND_CACHE_TTL = float(os.getenv("COMMAND_CACHE_TTL", "300"))  # seconds
+INVALIDATION_CHANNEL = "commands"
+
+
+class InvalidatedCache(abc.ABC):
+    """Base of the caches that routes invalidate on every hub worker.
+
+    `invalidate_instrument` and `invalidate_profile` drop the affected
+    entries through `_drop_instrument` / `_drop_profile` and tell the other
+    workers over the backplane `channel`.
+    """
+
+    channel: str
+
+    def __init__(self, backplane=backplane):
+        # other hub workers have their own cache and must drop entries too
+        self.backplane = backplane
+        self.backplane.subscribe(self.channel, self._remote_invalidate)
+        # bumped on every invalidation so loads that raced with one are not stored
+        self.generation = 0
+
+    @abc.abstractmethod
+    def _drop_instrument(self, instrument_id: UUID):
+        "Removes the entries of the instrument from this worker's cache"
+
+    @abc.abstractmethod
+    def _drop_profile(self, profile_id: UUID):
+        "Removes the entries that depend on the profile from this worker's cache"
+
+    def invalidate_instrument(self, instrument_id: UUID, propagate: bool = True):
+        self.generation += 1
+        self._drop_instrument(instrument_id)
+        if propagate:
+            self.backplane.publish(self.channel, "instrument", str(instrument_id))
+
+    def invalidate_profile(self, profile_id: UUID, propagate: bool = True):
+        self.generation += 1
+        self._drop_profile(profile_id)
+        if propagate:
+            self.backplane.publish(self.channel, "profile", str(profile_id))
+
+    async def _remote_invalidate(self, kind: str, id: str):
+        if kind == "instrument":
+            self.invalidate_instrument(UUID(id), propagate=False)
+        else:
+            self.invalidate_profile(UUID(id), propagate=False)
+
+
+class CommandCache(InvalidatedCache):
+    """Instrument id -> set of allowed commands.
+
+    Entries are loaded from the instrument's profile on first use and are
+    dropped by the routes that change instruments or profiles. The TTL only
+    catches changes made behind the hub's back (e.g. directly in the DB).
+    """
+
+    channel = INVALIDATION_CHANNEL
+
+    def __init__(
+        self,
+        ttl: float = COMMAND_CACHE_TTL,
+        session_factory=SessionLocal,
+        backplane=backplane,
+    ):
+        super().__init__(backplane)
+        self.ttl = ttl
+        self.session_factory = session_factory
+        # instrument id -> (commands, profile id, expires at)
+        self.entries: Dict[UUID, Tuple[FrozenSet[str], Optional[UUID], float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_commands(self, instrument_id: UUID) -> FrozenSet[str]:
+        entry = self.entries.get(instrument_id)
+        if entry and entry[2] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        generation = self.generation
+        commands, profile_id = await self._load(instrument_id)
+        if generation == self.generation:
+            self.entries[instrument_id] = (
+                commands,
+                profile_id,
+                time.monotonic() + self.ttl,
+            )
+        return commands
+
+    async def _load(self, instrument_id: UUID):
+        async with self.session_factory() as db:
+            instrument = await db.scalar(
+                select(models.Instrument).filter_by(id=instrument_id)
+            )
+            if not instrument or not instrument.profile:
+                return frozenset(), None
+            profile = await db.scalar(
+                select(models.InstrumentProfile).filter_by(id=instrument.profile)
+            )
+        if not profile or not profile.commands:
+            return frozenset(), instrument.profile
+        commands = convert_commands_string_to_dict(profile.commands)
+        return frozenset(commands), instrument.profile
+
+    def _drop_instrument(self, instrument_id: UUID):
+        self.entries.pop(instrument_id, None)
+
+    def _drop_profile(self, profile_id: UUID):
+        for instrument_id, entry in list(self.entries.items()):
+            if entry[1] == profile_id:
+                del self.entries[instrument_id]
+
+    def metrics(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttl": self.ttl,
+        }
+
+
+command_cache = CommandCache()
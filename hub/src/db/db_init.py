@@ -1,7 +1,7 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+import asyncio
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from .models import Base
+from .partitions import ensure_partitions
 import os
 from dotenv import load_dotenv
 
@@ -9,28 +9,59 @@ load_dotenv()
 
 
 DB_TYPE = os.getenv("DB_TYPE")
+DB_DRIVER = os.getenv("DB_DRIVER", "asyncpg")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 DB_ADDRESS = os.getenv("DB_ADDRESS")
 
-SQLALCHEMY_DATABASE_URL = f"{DB_TYPE}://{DB_USER}:{DB_PASSWORD}@{DB_ADDRESS}/{DB_NAME}"
+# Connection pool settings
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
 
+# DATABASE_URL overrides the individual settings (e.g. sqlite+aiosqlite:///hub.db)
+SQLALCHEMY_DATABASE_URL = os.getenv(
+    "DATABASE_URL",
+    f"{DB_TYPE}+{DB_DRIVER}://{DB_USER}:{DB_PASSWORD}@{DB_ADDRESS}/{DB_NAME}",
+)
+
+pool_settings = {}
+if not SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    pool_settings = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
 
 # Set up the database engine
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL, pool_pre_ping=DB_POOL_PRE_PING, **pool_settings
+)
+
+# Create session (objects stay usable after commit, lazy loading is not available in async)
+SessionLocal = async_sessionmaker(
+    bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
 
-# Create session
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Create the database tables
-Base.metadata.create_all(bind=engine)
+async def init_db():
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await ensure_partitions(conn)
+    except Exception as e:
+        # with several workers another one may have created them in the meantime
+        print(f"create tables failed, retrying once: {e.__class__.__name__}")
+        await asyncio.sleep(1)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await ensure_partitions(conn)
 
 
 # Dependency to get the DB session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -1,4 +1,13 @@
-from sqlalchemy import Column, Integer, String, DateTime, func
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Integer,
+    String,
+    DateTime,
+    Float,
+    Index,
+    func,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.dialects.postgresql import UUID, FLOAT
 import uuid
@@ -24,10 +33,55 @@ class Instrument(Base):
 
 class InstrumentData(Base):
     __tablename__ = "data"
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
-    instrument_id = Column(UUID, index=True)
-    data = Column(String, index=True)
-    timestamp = Column(DateTime, server_default=func.now(), index=True)
+    # On PostgreSQL the table is partitioned by month (see db/partitions.py),
+    # the partition key has to be part of the primary key.
+    __table_args__ = (
+        Index("ix_data_instrument_id_timestamp", "instrument_id", "timestamp"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    timestamp = Column(DateTime, primary_key=True, server_default=func.now())
+    instrument_id = Column(UUID, nullable=False)
+    data = Column(String)  # raw reading as sent by the instrument
+    value = Column(Float, nullable=True)  # parsed from data at ingest
+    unit = Column(String(16), nullable=True)
+    seq = Column(BigInteger, nullable=True)  # edge outbox sequence number
+    # capture time on the device clock, `timestamp` is the same moment in hub
+    # time (corrected by the estimated clock offset, see src/clock.py)
+    device_time = Column(DateTime, nullable=True)
+
+
+class IngestSequence(Base):
+    "Highest edge sequence number stored per instrument, replays below it are skipped"
+
+    __tablename__ = "ingest_sequence"
+
+    instrument_id = Column(UUID(as_uuid=True), primary_key=True)
+    last_seq = Column(BigInteger, nullable=False)
+
+
+class DataRollup(Base):
+    """Numeric readings of one instrument summed up per minute, hour and day.
+
+    Kept up to date by the ingest pipeline, see src/rollups.py. Mean and
+    standard deviation follow from count, sum and sum of squares, and
+    buckets merge into wider ones by adding them up.
+    """
+
+    __tablename__ = "data_rollup"
+    # backfill and retention work on time ranges across all instruments
+    __table_args__ = (
+        Index("ix_data_rollup_resolution_bucket", "resolution", "bucket"),
+    )
+
+    instrument_id = Column(UUID(as_uuid=True), primary_key=True)
+    resolution = Column(Integer, primary_key=True)  # bucket width in seconds
+    bucket = Column(DateTime, primary_key=True)  # start of the bucket
+    count = Column(BigInteger, nullable=False)
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+    sum = Column(Float, nullable=False)
+    sumsq = Column(Float, nullable=False)  # sum of squares
 
 
 class Calibrate(Base):
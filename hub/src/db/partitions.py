@@ -0,0 +1,361 @@
+import argparse
+import asyncio
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import delete, select, text, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from src.utils import parse_measurement
+from .models import Base, InstrumentData
+
+
+# Monthly partitions of the `data` table are created this many months ahead
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "2"))
+PARTITION_MAINTENANCE_INTERVAL = 6 * 3600  # seconds
+# Rows are deleted this many per transaction, with a pause in between so
+# ingest and readers get their turn
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "5000"))
+DELETE_BATCH_PAUSE = float(os.getenv("DELETE_BATCH_PAUSE", "0.05"))  # seconds
+
+TABLE = InstrumentData.__tablename__
+DEFAULT_PARTITION = f"{TABLE}_default"
+PARTITION_NAME = re.compile(rf"^{TABLE}_y(\d{{4}})m(\d{{2}})$")
+
+LEGACY_TABLE = f"{TABLE}_legacy"  # old unpartitioned table while it is migrated
+# pg_advisory_xact_lock key, one worker at a time changes the partitions
+PARTITION_LOCK_KEY = 0x9A7D
+
+# Indexes create_all put on the old unpartitioned table. The composite
+# (instrument_id, timestamp) index and the primary key cover every lookup.
+LEGACY_INDEXES = ["ix_data_id", "ix_data_data", "ix_data_instrument_id"]
+
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(moment: datetime, months: int) -> datetime:
+    month = moment.month - 1 + months
+    return datetime(moment.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"{TABLE}_y{start.year:04d}m{start.month:02d}"
+
+
+COLUMNS = ", ".join(f'"{column.name}"' for column in InstrumentData.__table__.columns)
+
+
+async def table_exists(conn: AsyncConnection, name: str) -> bool:
+    return bool(await conn.scalar(text("SELECT to_regclass(:name)"), {"name": name}))
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    result = await conn.scalar(
+        text(
+            "SELECT count(*) FROM pg_partitioned_table p "
+            "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :table"
+        ),
+        {"table": TABLE},
+    )
+    return bool(result)
+
+
+async def upgrade_legacy_table(conn: AsyncConnection):
+    "Adds the parsed value columns and the composite index to an unpartitioned table"
+    await conn.execute(
+        text(
+            f"ALTER TABLE {TABLE} "
+            "ADD COLUMN IF NOT EXISTS value DOUBLE PRECISION, "
+            "ADD COLUMN IF NOT EXISTS unit VARCHAR(16), "
+            "ADD COLUMN IF NOT EXISTS seq BIGINT, "
+            "ADD COLUMN IF NOT EXISTS device_time TIMESTAMP WITHOUT TIME ZONE"
+        )
+    )
+    await conn.execute(
+        text(
+            f"CREATE INDEX IF NOT EXISTS ix_data_instrument_id_timestamp "
+            f"ON {TABLE} (instrument_id, timestamp)"
+        )
+    )
+    for index in LEGACY_INDEXES:
+        await conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+
+
+async def ensure_partitions(conn: AsyncConnection, now: datetime = None):
+    "Creates this month's partition, the next few months and a catch-all default"
+    if conn.dialect.name != "postgresql":
+        return
+    if not await is_partitioned(conn):
+        # table was created before partitioning, keep it working as it is
+        await upgrade_legacy_table(conn)
+        return
+    # columns added after the table was partitioned
+    await conn.execute(
+        text(
+            f"ALTER TABLE {TABLE} "
+            "ADD COLUMN IF NOT EXISTS seq BIGINT, "
+            "ADD COLUMN IF NOT EXISTS device_time TIMESTAMP WITHOUT TIME ZONE"
+        )
+    )
+    # several workers run this at startup
+    await conn.execute(
+        text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY}
+    )
+    # rows outside the prepared months (e.g. clocks far off) still have a home
+    await conn.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} "
+            f"PARTITION OF {TABLE} DEFAULT"
+        )
+    )
+    start = month_start(now or datetime.now())
+    for offset in range(PARTITION_MONTHS_AHEAD + 1):
+        await create_partition(conn, add_months(start, offset))
+
+
+async def create_partition(conn: AsyncConnection, lower: datetime):
+    """Creates the partition of the month starting at `lower`, if it is missing.
+
+    Rows of that month that went to the default partition in the meantime
+    are moved into it first; PostgreSQL refuses to attach a partition while
+    the default one holds rows in its range.
+    """
+    name = partition_name(lower)
+    if await table_exists(conn, name):
+        return
+    upper = add_months(lower, 1)
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)"))
+    if await table_exists(conn, DEFAULT_PARTITION):
+        await conn.execute(
+            text(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+                "WHERE timestamp >= :lower AND timestamp < :upper "
+                f"RETURNING {COLUMNS}) INSERT INTO {name} ({COLUMNS}) "
+                f"SELECT {COLUMNS} FROM moved"
+            ),
+            {"lower": lower, "upper": upper},
+        )
+    await conn.execute(
+        text(
+            f"ALTER TABLE {TABLE} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+        )
+    )
+
+
+async def list_partitions(conn: AsyncConnection):
+    "Returns [(name, month start)] of the monthly partitions, oldest first"
+    rows = await conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :table"
+        ),
+        {"table": TABLE},
+    )
+    partitions = []
+    for (name,) in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((name, datetime(int(match[1]), int(match[2]), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+async def delete_before(db: AsyncSession, cutoff: datetime) -> dict:
+    """Removes all readings older than `cutoff`.
+
+    Past months' partitions that end before the cutoff are dropped as a
+    whole. The rows of a partition that straddles the cutoff, of the
+    current or a future month, and of the default partition are deleted
+    row by row, in batches.
+    """
+    conn = await db.connection()
+    dropped = []
+    estimated_rows = 0
+    if await is_partitioned(conn):
+        # the current and future months stay, ingest writes into them
+        keep_from = min(cutoff, month_start(datetime.now()))
+        for name, start in await list_partitions(conn):
+            if add_months(start, 1) > keep_from:
+                break
+            # planner statistics, counting would scan the whole partition
+            estimated_rows += max(
+                0,
+                int(
+                    await conn.scalar(
+                        text("SELECT reltuples FROM pg_class WHERE relname = :name"),
+                        {"name": name},
+                    )
+                    or 0
+                ),
+            )
+            await conn.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+
+    await db.commit()
+    deleted = await delete_in_batches(
+        db, InstrumentData, InstrumentData.timestamp < cutoff
+    )
+    return {
+        "dropped_partitions": dropped,
+        "dropped_rows_estimate": estimated_rows,
+        "deleted_rows": deleted,
+    }
+
+
+async def delete_in_batches(
+    db: AsyncSession,
+    model,
+    *filters,
+    batch_size: int = DELETE_BATCH_SIZE,
+    pause: float = DELETE_BATCH_PAUSE,
+) -> int:
+    """Deletes the rows matching `filters` in short transactions, returns how many.
+
+    One big DELETE holds its locks and keeps every deleted row version
+    around until it commits, batches keep both small.
+    """
+    key = model.__table__.primary_key.columns
+    deleted = 0
+    while True:
+        batch = select(*key).filter(*filters).limit(batch_size)
+        result = await db.execute(
+            delete(model)
+            .filter(*filters, tuple_(*key).in_(batch))
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+        await asyncio.sleep(pause)
+
+
+async def fill_values(
+    db: AsyncSession, *filters, batch_size: int = DELETE_BATCH_SIZE
+) -> int:
+    """Parses value and unit of the rows matching `filters` that have none.
+
+    Rows stored before ingest parsed readings have NULL there, the rollups
+    and retention only see numeric values. Commits every batch, returns the
+    rows that got a value; status text stays NULL and is parsed again on
+    the next call.
+    """
+    data = InstrumentData
+    query = (
+        select(data.id, data.timestamp, data.data)
+        .filter(*filters, data.value.is_(None), data.data.is_not(None))
+        .order_by(data.timestamp, data.id)
+        .limit(batch_size)
+    )
+    filled = 0
+    after = None
+    while True:
+        page = query if after is None else query.filter(
+            tuple_(data.timestamp, data.id) > after
+        )
+        rows = (await db.execute(page)).all()
+        values = []
+        for id, timestamp, raw in rows:
+            value, unit = parse_measurement(raw)
+            if value is not None:
+                values.append(
+                    {"id": id, "timestamp": timestamp, "value": value, "unit": unit}
+                )
+        if values:
+            # bulk UPDATE by primary key
+            await db.execute(update(data), values)
+            await db.commit()
+            filled += len(values)
+        if len(rows) < batch_size:
+            return filled
+        after = (rows[-1].timestamp, rows[-1].id)
+
+
+async def migrate_legacy_table(engine):
+    """Moves the rows of an unpartitioned `data` table into monthly partitions.
+
+    The old table is renamed to data_legacy, the partitioned table and one
+    partition per month of the old rows are created, and the rows are
+    copied one month per transaction. Run it with the hub stopped; when
+    interrupted, run it again, it continues where it stopped. data_legacy
+    is left in place for the operator to check and drop.
+    """
+    async with engine.begin() as conn:
+        if conn.dialect.name != "postgresql":
+            print("only PostgreSQL tables are partitioned")
+            return
+        if not await is_partitioned(conn):
+            if await table_exists(conn, LEGACY_TABLE):
+                raise RuntimeError(f"{LEGACY_TABLE} exists already")
+            await conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {LEGACY_TABLE}"))
+            # index names are per schema, the partitioned table needs them
+            for index in (f"{TABLE}_pkey", "ix_data_instrument_id_timestamp"):
+                await conn.execute(
+                    text(
+                        f"ALTER INDEX IF EXISTS {index} "
+                        f"RENAME TO {index.replace(TABLE, LEGACY_TABLE, 1)}"
+                    )
+                )
+            await conn.run_sync(Base.metadata.create_all)
+            await ensure_partitions(conn)
+        if not await table_exists(conn, LEGACY_TABLE):
+            print("data is partitioned already")
+            return
+        oldest, newest = (
+            await conn.execute(
+                text(f"SELECT min(timestamp), max(timestamp) FROM {LEGACY_TABLE}")
+            )
+        ).one()
+    if oldest is None:
+        return
+
+    month = month_start(oldest)
+    while month <= newest:
+        async with engine.begin() as conn:
+            await create_partition(conn, month)
+            result = await conn.execute(
+                text(
+                    f"INSERT INTO {TABLE} ({COLUMNS}) SELECT {COLUMNS} "
+                    f"FROM {LEGACY_TABLE} WHERE timestamp >= :lower "
+                    "AND timestamp < :upper ON CONFLICT DO NOTHING"
+                ),
+                {"lower": month, "upper": add_months(month, 1)},
+            )
+        print(f"{partition_name(month)}: {result.rowcount} rows copied")
+        month = add_months(month, 1)
+    print(f"done, check the data and DROP TABLE {LEGACY_TABLE}")
+
+
+async def partition_maintenance(engine):
+    "Background task keeping future partitions in place"
+    while True:
+        try:
+            async with engine.begin() as conn:
+                await ensure_partitions(conn)
+        except Exception as e:
+            print(f"partition maintenance failed: {e}")
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+
+
+async def main():
+    from .db_init import engine  # db_init imports this module
+
+    parser = argparse.ArgumentParser(description="Maintenance of the data table")
+    parser.add_argument(
+        "command",
+        choices=["migrate"],
+        help="migrate: move an unpartitioned data table into monthly partitions",
+    )
+    parser.parse_args()
+    await migrate_legacy_table(engine)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
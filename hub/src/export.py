@@ -0,0 +1,148 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from uuid import UUID
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select
+
+from src.db import models
+from src.db.db_init import SessionLocal
+
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))  # rows per fetch
+
+COLUMNS = ["timestamp", "data", "value", "unit", "device_time", "seq"]
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+PARQUET_SCHEMA = pa.schema(
+    [
+        ("timestamp", pa.timestamp("us")),
+        ("data", pa.string()),
+        ("value", pa.float64()),
+        ("unit", pa.string()),
+        ("device_time", pa.timestamp("us")),
+        ("seq", pa.int64()),
+    ]
+)
+
+
+async def fetch_chunks(
+    instrument_id: UUID, since: datetime = None, until: datetime = None
+):
+    """Yields lists of rows read through a server-side cursor.
+
+    Only one chunk is held in memory at a time. The session is opened here
+    because the response is still streaming after the route has returned.
+    """
+    query = select(
+        models.InstrumentData.timestamp,
+        models.InstrumentData.data,
+        models.InstrumentData.value,
+        models.InstrumentData.unit,
+        models.InstrumentData.device_time,
+        models.InstrumentData.seq,
+    ).filter(models.InstrumentData.instrument_id == instrument_id)
+    if since:
+        query = query.filter(models.InstrumentData.timestamp >= since)
+    if until:
+        query = query.filter(models.InstrumentData.timestamp <= until)
+    query = query.order_by(models.InstrumentData.timestamp, models.InstrumentData.id)
+
+    async with SessionLocal() as db:
+        result = await db.stream(
+            query.execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        async for rows in result.partitions():
+            yield rows
+
+
+def isoformat(moment: datetime):
+    return moment.isoformat() if moment else None
+
+
+async def csv_stream(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    async for rows in chunks:
+        for timestamp, data, value, unit, device_time, seq in rows:
+            writer.writerow(
+                [timestamp.isoformat(), data, value, unit, isoformat(device_time), seq]
+            )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+async def ndjson_stream(chunks):
+    async for rows in chunks:
+        yield "".join(
+            json.dumps(
+                {
+                    "timestamp": timestamp.isoformat(),
+                    "data": data,
+                    "value": value,
+                    "unit": unit,
+                    "device_time": isoformat(device_time),
+                    "seq": seq,
+                }
+            )
+            + "\n"
+            for timestamp, data, value, unit, device_time, seq in rows
+        )
+
+
+class ChunkSink:
+    "Write-only file object for pyarrow that hands out what was written so far"
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+async def parquet_stream(chunks):
+    # one row group per chunk, the footer is written when the writer closes
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(sink, PARQUET_SCHEMA, compression="zstd")
+    async for rows in chunks:
+        columns = zip(*rows)
+        arrays = [
+            pa.array(column, type=field.type)
+            for column, field in zip(columns, PARQUET_SCHEMA)
+        ]
+        writer.write_table(pa.Table.from_arrays(arrays, schema=PARQUET_SCHEMA))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+STREAMS = {"csv": csv_stream, "ndjson": ndjson_stream, "parquet": parquet_stream}
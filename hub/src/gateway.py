@@ -0,0 +1,122 @@
+import asyncio
+from uuid import UUID
+
+import msgpack
+from fastapi import WebSocket
+
+
+# Message types of the gateway protocol, every frame is one msgpack array.
+# instruments/base/gateway_protocol.py is the edge side of the same protocol.
+# edge -> hub
+OPEN = 0  # [OPEN, channel, instrument id (16 bytes), online]
+STATUS = 1  # [STATUS, channel, online]
+READINGS = 2  # [READINGS, [[channel, seq, captured_at, data], ...], sent_at]
+# hub -> edge
+ACK = 3  # [ACK, seq], all readings up to seq are stored
+COMMAND = 4  # [COMMAND, channel, data]
+# seq comes from the device's outbox and only grows. captured_at (stamped by
+# the driver) and sent_at are device clock times in seconds since the epoch,
+# src/clock.py maps them to hub time. Readings that were not acknowledged are
+# sent again after a reconnect, the ingest pipeline skips the ones already
+# stored.
+
+
+def encode(message: list) -> bytes:
+    return msgpack.packb(message, use_bin_type=True)
+
+
+def decode(frame: bytes) -> list:
+    return msgpack.unpackb(frame, raw=False)
+
+
+class GatewayChannel:
+    """One instrument of an edge agent, multiplexed over the agent's websocket.
+
+    It is registered with the manager like an instrument socket, so commands
+    reach it through the usual fan-out and are tagged with the channel number
+    on the way out.
+    """
+
+    def __init__(self, websocket: WebSocket, channel: int, instrument_id: UUID):
+        self.websocket = websocket
+        self.channel = channel
+        self.instrument_id = instrument_id
+
+    async def send_text(self, message: str):
+        await self.websocket.send_bytes(encode([COMMAND, self.channel, message]))
+
+
+class Acknowledgements:
+    """Tells an edge device which of its readings are stored, in order.
+
+    `send_ack(seq)` goes out once the pipeline receipt of the readings up to
+    `seq` is resolved. After a failed write nothing more is acknowledged and
+    the connection is closed, the device then sends everything it has not
+    seen an ACK for again.
+    """
+
+    def __init__(self, websocket: WebSocket, send_ack):
+        self.websocket = websocket
+        self.send_ack = send_ack
+        self.failed = False
+        self.tasks = set()
+
+    def after_stored(self, receipt: asyncio.Future, seq: int):
+        task = asyncio.create_task(self._acknowledge(receipt, seq))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _acknowledge(self, receipt: asyncio.Future, seq: int):
+        try:
+            await receipt
+        except Exception as e:
+            if self.failed:
+                return
+            self.failed = True
+            print(f"edge readings not stored, closing the connection: {e}")
+            send = self.websocket.close(code=1011)
+        else:
+            if self.failed:
+                return
+            send = self.send_ack(seq)
+        try:
+            await send
+        except Exception:
+            pass  # connection is gone, the device sends the readings again
+
+
+class GatewayStats:
+    "Counters over all gateway connections of this worker"
+
+    def __init__(self):
+        self.connections = 0
+        self.channels = 0
+        self.frames = 0
+        self.bytes = 0
+        self.readings = 0
+        self.sequence_gaps = 0
+        self.unknown_channel = 0
+
+    def received(self, frame: bytes):
+        self.frames += 1
+        self.bytes += len(frame)
+
+    def metrics(self) -> dict:
+        return {
+            "connections": self.connections,
+            "channels": self.channels,
+            "frames": self.frames,
+            "readings": self.readings,
+            "bytes": self.bytes,
+            "bytes_per_reading": round(self.bytes / self.readings, 1)
+            if self.readings
+            else None,
+            "readings_per_frame": round(self.readings / self.frames, 1)
+            if self.frames
+            else None,
+            "sequence_gaps": self.sequence_gaps,
+            "unknown_channel": self.unknown_channel,
+        }
+
+
+gateway_stats = GatewayStats()
@@ -0,0 +1,157 @@
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Optional, Tuple
+from uuid import UUID
+
+
+# Recent readings kept per instrument, by count and by age
+HOT_CACHE_READINGS = int(os.getenv("HOT_CACHE_READINGS", "600"))
+HOT_CACHE_MAX_AGE = float(os.getenv("HOT_CACHE_MAX_AGE", "300"))  # seconds
+# Least recently used instruments are evicted beyond these
+HOT_CACHE_MAX_INSTRUMENTS = int(os.getenv("HOT_CACHE_MAX_INSTRUMENTS", "1000"))
+HOT_CACHE_MAX_MB = float(os.getenv("HOT_CACHE_MAX_MB", "64"))
+# What a dashboard gets on connect: "latest" (the last reading, as a normal
+# message), "window" (one {"snapshot": ...} JSON message) or "off"
+HOT_CACHE_SNAPSHOT = os.getenv("HOT_CACHE_SNAPSHOT", "latest")
+
+# Approximate bytes of one cached reading besides its text (tuple, float, str)
+READING_OVERHEAD = 120
+
+Reading = Tuple[float, str]  # (hub time, data)
+
+
+class RecentReadings:
+    "Ring buffer of one instrument plus its latest reading, which never expires"
+
+    def __init__(self, max_readings: int):
+        self.readings = deque(maxlen=max_readings)
+        self.latest: Optional[Reading] = None
+        self.bytes = 0
+
+    def add(self, reading: Reading) -> int:
+        "Returns the change in cached bytes"
+        added = reading_size(reading)
+        if len(self.readings) == self.readings.maxlen:
+            added -= reading_size(self.readings[0])
+        self.readings.append(reading)
+        self.latest = reading
+        self.bytes += added
+        return added
+
+    def expire(self, oldest: float) -> int:
+        "Drops readings from before `oldest`, returns the bytes freed"
+        freed = 0
+        while self.readings and self.readings[0][0] < oldest:
+            freed += reading_size(self.readings.popleft())
+        self.bytes -= freed
+        return freed
+
+    def since(self, oldest: float) -> list:
+        return [reading for reading in self.readings if reading[0] >= oldest]
+
+
+def reading_size(reading: Reading) -> int:
+    return len(reading[1]) + READING_OVERHEAD
+
+
+class HotCache:
+    """Latest value and the last few minutes of readings per instrument.
+
+    Fed with every live reading (also those other hub workers received, via
+    the backplane), so a dashboard gets the current state on connect and
+    /data_logs/instrument/recent answers without a database query. Each
+    instrument keeps at most `max_readings` readings of the last `max_age`
+    seconds; instruments that were not written or read for the longest time
+    are evicted when there are more than `max_instruments` or the cache
+    grows beyond `max_mb`.
+    """
+
+    def __init__(
+        self,
+        max_readings: int = HOT_CACHE_READINGS,
+        max_age: float = HOT_CACHE_MAX_AGE,
+        max_instruments: int = HOT_CACHE_MAX_INSTRUMENTS,
+        max_mb: float = HOT_CACHE_MAX_MB,
+    ):
+        self.max_readings = max_readings
+        self.max_age = max_age
+        self.max_instruments = max_instruments
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        # least recently used first
+        self.instruments: "OrderedDict[UUID, RecentReadings]" = OrderedDict()
+        self.bytes = 0
+
+        # metrics
+        self.readings_added = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def add(self, instrument_id: UUID, data: str, timestamp: float = None):
+        timestamp = time.time() if timestamp is None else timestamp
+        recent = self.instruments.get(instrument_id)
+        if recent is None:
+            recent = self.instruments[instrument_id] = RecentReadings(self.max_readings)
+        else:
+            self.instruments.move_to_end(instrument_id)
+        self.bytes += recent.add((timestamp, data))
+        self.bytes -= recent.expire(timestamp - self.max_age)
+        self.readings_added += 1
+        self._evict()
+
+    def latest(self, instrument_id: UUID) -> Optional[Reading]:
+        recent = self._get(instrument_id)
+        return recent.latest if recent else None
+
+    def window(self, instrument_id: UUID, seconds: float = None) -> list:
+        "Cached (timestamp, data) readings of the last `seconds`, oldest first"
+        recent = self._get(instrument_id)
+        if recent is None:
+            return []
+        seconds = self.max_age if seconds is None else min(seconds, self.max_age)
+        self.bytes -= recent.expire(time.time() - self.max_age)
+        return recent.since(time.time() - seconds)
+
+    def _get(self, instrument_id: UUID) -> Optional[RecentReadings]:
+        recent = self.instruments.get(instrument_id)
+        if recent is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.instruments.move_to_end(instrument_id)
+        return recent
+
+    def _evict(self):
+        while len(self.instruments) > self.max_instruments or (
+            self.bytes > self.max_bytes and len(self.instruments) > 1
+        ):
+            _, recent = self.instruments.popitem(last=False)
+            self.bytes -= recent.bytes
+            self.evicted += 1
+
+    def metrics(self) -> dict:
+        return {
+            "instruments": len(self.instruments),
+            "readings": sum(
+                len(recent.readings) for recent in self.instruments.values()
+            ),
+            "approx_mb": round(self.bytes / 1024 / 1024, 3),
+            "readings_added": self.readings_added,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "max_readings": self.max_readings,
+            "max_age": self.max_age,
+            "max_instruments": self.max_instruments,
+            "max_mb": self.max_bytes / 1024 / 1024,
+        }
+
+
+def as_log(reading: Reading) -> dict:
+    "A cached reading in the shape of a data log entry"
+    return {"data": reading[1], "timestamp": datetime.fromtimestamp(reading[0])}
+
+
+hot_cache = HotCache()
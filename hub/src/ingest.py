@@ -0,0 +1,241 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from uuid import UUID
+
+from sqlalchemy import insert, select
+
+from src import rollups
+from src.db import models
+from src.db.db_init import SessionLocal
+from src.utils import parse_measurement
+
+
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.5"))  # seconds
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", "3"))
+
+
+class IngestPipeline:
+    """Bounded queue in front of the `data` table.
+
+    Instrument endpoints hand readings to `submit`, a single background task
+    drains the queue and writes them as multi-row INSERTs. A batch is flushed
+    once it reaches `batch_size` rows or `flush_interval` seconds after its
+    first row arrived, whichever comes first. When the queue is full `submit`
+    waits, which stops reading from the instrument socket (backpressure).
+
+    Readings from an edge outbox carry a sequence number. Per instrument only
+    numbers above the highest one stored are written, so replays after a
+    reconnect do not duplicate rows. A `receipt` is resolved once all rows
+    submitted with it are committed, the endpoints acknowledge to the edge
+    only then. Every batch also updates the minute/hour/day rollups in the
+    same transaction (src/rollups.py).
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int = INGEST_QUEUE_SIZE,
+        batch_size: int = INGEST_BATCH_SIZE,
+        flush_interval: float = INGEST_FLUSH_INTERVAL,
+        session_factory=SessionLocal,
+    ):
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.session_factory = session_factory
+        self.queue: asyncio.Queue = None
+        self.writer_task: asyncio.Task = None
+        # `stored` future -> its rows not written yet
+        self.unconfirmed = {}
+
+        # metrics
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.rows_replayed = 0
+        self.batches_flushed = 0
+        self.flush_errors = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+        self.backpressure_waits = 0
+
+    async def start(self):
+        if self.writer_task:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.writer_task = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        "Flushes everything still queued and stops the writer"
+        if not self.writer_task:
+            return
+        await self.queue.join()
+        self.writer_task.cancel()
+        try:
+            await self.writer_task
+        except asyncio.CancelledError:
+            pass
+        self.writer_task = None
+
+    async def submit(
+        self,
+        instrument_id: UUID,
+        data: str,
+        seq: int = None,
+        timestamp: datetime = None,
+        device_time: datetime = None,
+        stored: asyncio.Future = None,
+    ):
+        value, unit = parse_measurement(data)
+        row = {
+            "instrument_id": instrument_id,
+            "data": data,
+            "value": value,
+            "unit": unit,
+            "timestamp": timestamp or datetime.now(),
+            "seq": seq,
+            "device_time": device_time,
+        }
+        if self.queue.full():
+            self.backpressure_waits += 1
+        await self.queue.put((row, stored))
+
+    def receipt(self, rows: int) -> asyncio.Future:
+        "Future to `submit` the next `rows` rows with, resolved once all are committed"
+        future = asyncio.get_running_loop().create_future()
+        if rows:
+            self.unconfirmed[future] = rows
+        else:
+            future.set_result(True)
+        return future
+
+    async def _next_batch(self):
+        # block until the first row arrives, then collect until size or deadline
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _writer(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _flush(self, items: list):
+        batch = [row for row, _ in items]
+        stored = [future for _, future in items if future is not None]
+        for attempt in range(1, INGEST_MAX_RETRIES + 1):
+            started = time.perf_counter()
+            try:
+                await self._write_batch(batch)
+            except Exception as e:
+                self.flush_errors += 1
+                print(f"ingest flush failed (attempt {attempt}): {e}")
+                await asyncio.sleep(min(2**attempt * 0.1, 5))
+                continue
+            latency = time.perf_counter() - started
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self.total_flush_latency += latency
+            self.batches_flushed += 1
+            for future in stored:
+                self._confirm(future, None)
+            return
+        self.rows_failed += len(batch)
+        for future in stored:
+            self._confirm(future, RuntimeError("readings could not be stored"))
+
+    def _confirm(self, future: asyncio.Future, error: Exception):
+        "Resolves a `stored` future with its last row, or fails it with the first error"
+        self.unconfirmed[future] -= 1
+        if not self.unconfirmed[future]:
+            del self.unconfirmed[future]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        elif future not in self.unconfirmed:
+            future.set_result(True)
+
+    async def _write_batch(self, batch: list):
+        async with self.session_factory() as db:
+            rows = await self._skip_replayed(db, batch)
+            if rows:
+                await db.execute(insert(models.InstrumentData), rows)
+                await rollups.add_rows(db, rows)
+            await db.commit()
+        self.rows_written += len(rows)
+        self.rows_replayed += len(batch) - len(rows)
+
+    async def _skip_replayed(self, db, batch: list) -> list:
+        "Drops rows with a sequence number already stored and moves the marks up"
+        instrument_ids = {
+            row["instrument_id"] for row in batch if row["seq"] is not None
+        }
+        if not instrument_ids:
+            return batch
+        # row locks keep a replay on another worker from passing in between
+        marks = {
+            mark.instrument_id: mark
+            for mark in await db.scalars(
+                select(models.IngestSequence)
+                .filter(models.IngestSequence.instrument_id.in_(instrument_ids))
+                .with_for_update()
+            )
+        }
+        rows = []
+        for row in batch:
+            seq = row["seq"]
+            if seq is None:
+                rows.append(row)
+                continue
+            mark = marks.get(row["instrument_id"])
+            if mark is None:
+                mark = models.IngestSequence(
+                    instrument_id=row["instrument_id"], last_seq=seq
+                )
+                db.add(mark)
+                marks[row["instrument_id"]] = mark
+            elif seq <= mark.last_seq:
+                continue
+            mark.last_seq = seq
+            rows.append(row)
+        return rows
+
+    def metrics(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "queue_capacity": self.max_queue_size,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "rows_written": self.rows_written,
+            "rows_failed": self.rows_failed,
+            "rows_replayed": self.rows_replayed,
+            "batches_flushed": self.batches_flushed,
+            "flush_errors": self.flush_errors,
+            "backpressure_waits": self.backpressure_waits,
+            "last_flush_latency_ms": round(self.last_flush_latency * 1000, 3),
+            "max_flush_latency_ms": round(self.max_flush_latency * 1000, 3),
+            "avg_flush_latency_ms": round(
+                self.total_flush_latency * 1000 / self.batches_flushed, 3
+            )
+            if self.batches_flushed
+            else 0.0,
+        }
+
+
+pipeline = IngestPipeline()
@@ -0,0 +1,111 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import select
+
+from src.db import models
+from src.backplane import backplane
+from src.command_cache import InvalidatedCache
+
+
+LOOKUP_CACHE_TTL = float(os.getenv("LOOKUP_CACHE_TTL", "300"))  # seconds
+# Ids that were not found are remembered for a shorter time
+LOOKUP_CACHE_NEGATIVE_TTL = float(os.getenv("LOOKUP_CACHE_NEGATIVE_TTL", "10"))
+# Per model, least recently used entries are evicted beyond this
+LOOKUP_CACHE_MAX_ENTRIES = int(os.getenv("LOOKUP_CACHE_MAX_ENTRIES", "10000"))
+INVALIDATION_CHANNEL = "lookups"
+
+
+class LookupCache(InvalidatedCache):
+    """Read-through cache of Instrument and InstrumentProfile rows by id.
+
+    Cached rows are copies that belong to no session: read them, never add
+    them to one or change them. Unknown ids are cached as None for
+    `negative_ttl`. Like the command cache, entries are dropped by the
+    routes that change instruments or profiles, on every hub worker; the
+    TTL only catches changes made behind the hub's back.
+    """
+
+    channel = INVALIDATION_CHANNEL
+
+    def __init__(
+        self,
+        ttl: float = LOOKUP_CACHE_TTL,
+        negative_ttl: float = LOOKUP_CACHE_NEGATIVE_TTL,
+        max_entries: int = LOOKUP_CACHE_MAX_ENTRIES,
+        backplane=backplane,
+    ):
+        super().__init__(backplane)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        # model -> OrderedDict of id -> (row or None, expires at), least
+        # recently used first
+        self.entries = {
+            models.Instrument: OrderedDict(),
+            models.InstrumentProfile: OrderedDict(),
+        }
+        self.stats = {
+            model: {"hits": 0, "negative_hits": 0, "misses": 0, "evicted": 0}
+            for model in self.entries
+        }
+
+    async def instrument(self, db, instrument_id: UUID) -> Optional[models.Instrument]:
+        return await self._get(db, models.Instrument, instrument_id)
+
+    async def profile(self, db, profile_id: UUID) -> Optional[models.InstrumentProfile]:
+        if profile_id is None:
+            return None
+        return await self._get(db, models.InstrumentProfile, profile_id)
+
+    async def _get(self, db, model, id: UUID):
+        entries = self.entries[model]
+        stats = self.stats[model]
+        entry = entries.get(id)
+        if entry and entry[1] > time.monotonic():
+            entries.move_to_end(id)
+            stats["hits" if entry[0] is not None else "negative_hits"] += 1
+            return entry[0]
+
+        stats["misses"] += 1
+        generation = self.generation
+        # loaded as plain columns, an ORM object of the request's session
+        # could not be shared with other requests
+        columns = model.__table__.columns
+        row = (await db.execute(select(*columns).filter_by(id=id))).first()
+        value = model(**row._mapping) if row else None
+        if generation == self.generation:
+            ttl = self.ttl if value is not None else self.negative_ttl
+            entries[id] = (value, time.monotonic() + ttl)
+            entries.move_to_end(id)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                stats["evicted"] += 1
+        return value
+
+    def _drop_instrument(self, instrument_id: UUID):
+        self.entries[models.Instrument].pop(instrument_id, None)
+
+    def _drop_profile(self, profile_id: UUID):
+        self.entries[models.InstrumentProfile].pop(profile_id, None)
+
+    def metrics(self) -> dict:
+        metrics = {"ttl": self.ttl, "negative_ttl": self.negative_ttl}
+        for model, stats in self.stats.items():
+            lookups = stats["hits"] + stats["negative_hits"] + stats["misses"]
+            metrics[model.__tablename__] = {
+                "entries": len(self.entries[model]),
+                **stats,
+                "hit_ratio": round(
+                    (stats["hits"] + stats["negative_hits"]) / lookups, 4
+                )
+                if lookups
+                else None,
+            }
+        return metrics
+
+
+lookup_cache = LookupCache()
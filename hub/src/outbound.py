@@ -0,0 +1,133 @@
+import asyncio
+import os
+from collections import deque
+from uuid import UUID
+
+from fastapi import WebSocket
+
+
+# What to do when a client's outbound queue is full
+DROP_OLDEST = "drop_oldest"  # discard the oldest queued message
+COALESCE = "coalesce"  # throw away the backlog, keep only the latest message
+DISCONNECT = "disconnect"  # close the slow client's socket
+OVERFLOW_POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+CLIENT_QUEUE_SIZE = int(os.getenv("CLIENT_QUEUE_SIZE", "100"))
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "2"))  # seconds per socket
+CLIENT_OVERFLOW_POLICY = os.getenv("CLIENT_OVERFLOW_POLICY", DROP_OLDEST)
+if CLIENT_OVERFLOW_POLICY not in OVERFLOW_POLICIES:
+    raise ValueError(
+        f"Unknown CLIENT_OVERFLOW_POLICY '{CLIENT_OVERFLOW_POLICY}', "
+        f"use one of {OVERFLOW_POLICIES}"
+    )
+
+# 1013 = "try again later"
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# the event loop only keeps weak references to tasks
+closing_tasks = set()
+
+
+class ClientConnection:
+    """Outbound side of one client websocket.
+
+    Broadcasts only append to a bounded queue, a dedicated sender task
+    writes to the socket. A stalled client therefore only fills its own
+    queue and never blocks the instrument that produced the message.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        instrument_id: UUID,
+        max_size: int = CLIENT_QUEUE_SIZE,
+        policy: str = CLIENT_OVERFLOW_POLICY,
+    ):
+        self.websocket = websocket
+        self.instrument_id = instrument_id
+        self.max_size = max_size
+        self.policy = policy
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.sender_task: asyncio.Task = None
+        self.closed = False
+
+        # metrics
+        self.sent = 0
+        self.dropped = 0
+
+    def start(self):
+        self.sender_task = asyncio.create_task(self._sender())
+
+    def put(self, message: str) -> bool:
+        "Queues a message without waiting, applies the overflow policy when full"
+        if self.closed:
+            return False
+        if len(self.queue) >= self.max_size:
+            if self.policy == DROP_OLDEST:
+                self.queue.popleft()
+                self.dropped += 1
+            elif self.policy == COALESCE:
+                self.dropped += len(self.queue)
+                self.queue.clear()
+            else:
+                self.dropped += len(self.queue) + 1
+                self.queue.clear()
+                self._close_slow_consumer()
+                return False
+        self.queue.append(message)
+        self.wakeup.set()
+        return True
+
+    async def _sender(self):
+        while not self.closed:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.queue and not self.closed:
+                message = self.queue.popleft()
+                try:
+                    await asyncio.wait_for(
+                        self.websocket.send_text(message), SEND_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    # stalled peer, it would pin this task forever
+                    self.dropped += len(self.queue) + 1
+                    self.queue.clear()
+                    self._close_slow_consumer()
+                    return
+                except Exception:
+                    # socket is gone, the endpoint cleans up on its next receive
+                    self.closed = True
+                    return
+                self.sent += 1
+
+    def _close_slow_consumer(self):
+        self.closed = True
+        task = asyncio.create_task(self._close())
+        closing_tasks.add(task)
+        task.add_done_callback(closing_tasks.discard)
+
+    async def _close(self):
+        print(f"closing slow client of instrument {self.instrument_id}")
+        try:
+            await asyncio.wait_for(
+                self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE), SEND_TIMEOUT
+            )
+        except Exception:
+            pass
+
+    def stop(self):
+        self.closed = True
+        if self.sender_task:
+            self.sender_task.cancel()
+
+    def metrics(self) -> dict:
+        return {
+            "instrument_id": str(self.instrument_id),
+            "policy": self.policy,
+            "queue_depth": len(self.queue),
+            "queue_capacity": self.max_size,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "closed": self.closed,
+        }
@@ -0,0 +1,57 @@
+import base64
+from datetime import datetime
+from uuid import UUID
+
+from fastapi import HTTPException, Response
+from sqlalchemy import tuple_
+
+
+# Response header carrying the cursor of the next page (absent on the last page)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(timestamp: datetime, id: UUID) -> str:
+    raw = f"{timestamp.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(timestamp), UUID(id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+
+
+def keyset_page(
+    query,
+    model,
+    cursor: str = None,
+    since: datetime = None,
+    until: datetime = None,
+    descending: bool = False,
+):
+    """Orders `query` by (timestamp, id) and continues after `cursor`.
+
+    Seeking on the ordered key instead of using OFFSET makes every page cost
+    the same, however deep it is.
+    """
+    key = tuple_(model.timestamp, model.id)
+    if since:
+        query = query.filter(model.timestamp >= since)
+    if until:
+        query = query.filter(model.timestamp <= until)
+    if cursor:
+        after = tuple_(*decode_cursor(cursor))
+        query = query.filter(key < after if descending else key > after)
+    if descending:
+        return query.order_by(model.timestamp.desc(), model.id.desc())
+    return query.order_by(model.timestamp, model.id)
+
+
+def set_next_cursor(response: Response, rows: list, limit: int):
+    # a short page is the last one
+    if rows and len(rows) == limit:
+        last = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.timestamp, last.id)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from uuid import UUID
 
@@ -52,6 +52,12 @@ class InstrumentDataLog(BaseModel):
         form_attributes = True
 
 
+class RecentReadings(BaseModel):
+    instrument_id: UUID
+    latest: Optional[InstrumentDataLog] = None
+    readings: List[InstrumentDataLog]
+
+
 class CalibrationData(BaseModel):
     instrument_name: str
     inspector: str
@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+
+from src.utils import PDF_DIR, create_pdf
+
+
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+# Oldest cached reports are removed beyond this many files
+REPORT_CACHE_MAX_FILES = int(os.getenv("REPORT_CACHE_MAX_FILES", "500"))
+# Reports served or written within this many seconds are never removed
+REPORT_CACHE_GRACE = 300
+
+
+class ReportCache:
+    """Content-addressed store for rendered calibration reports.
+
+    Calibration records are never edited, so a report is fully determined
+    by the instrument, the requested range and the newest calibration (and
+    number of calibrations) in that range. That tuple is hashed into the
+    file name: repeated downloads are served from disk, concurrent requests
+    for the same report render it once and different reports can never
+    overwrite each other.
+    """
+
+    def __init__(self, directory: str = PDF_DIR, workers: int = REPORT_WORKERS):
+        self.directory = directory
+        self.workers = workers
+        self.pool: ProcessPoolExecutor = None
+        # key -> render in progress, so concurrent requests share one render
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.renders = 0
+
+    @staticmethod
+    def key(instrument_id, name, start, end, latest_calibration) -> str:
+        parts = [instrument_id, name, start, end, latest_calibration]
+        parts = [str(part) for part in parts]
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    async def get_or_render(self, key: str, rows_loader, name, start, end) -> str:
+        "Returns the path of the cached report, rendering it first if needed"
+        path = self.path(key)
+        try:
+            # a fresh mtime keeps the file from being pruned while it is sent
+            os.utime(path)
+            self.hits += 1
+            return path
+        except FileNotFoundError:
+            pass
+        if key in self.pending:
+            self.hits += 1
+            return await asyncio.shield(self.pending[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            rows = await rows_loader()
+            pdf = await asyncio.get_running_loop().run_in_executor(
+                self._pool(), create_pdf, rows, name, start, end
+            )
+            await asyncio.to_thread(self._write, path, pdf)
+            self.renders += 1
+            future.set_result(path)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # retrieved, also when nobody else waited
+            raise
+        finally:
+            if not future.done():
+                future.cancel()  # this request was cancelled, so are the waiters
+            del self.pending[key]
+        return path
+
+    def _pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self.pool
+
+    def _write(self, path: str, pdf: bytes):
+        # write next to the target and rename, readers never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(pdf)
+        os.replace(tmp_path, path)
+        self._prune()
+
+    def _prune(self):
+        files = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".pdf")
+        ]
+        if len(files) <= REPORT_CACHE_MAX_FILES:
+            return
+        modified = {}
+        for file in files:
+            try:
+                modified[file] = os.path.getmtime(file)
+            except FileNotFoundError:
+                pass
+        in_use = time.time() - REPORT_CACHE_GRACE
+        files = sorted(modified, key=modified.get)
+        for old in files[: len(files) - REPORT_CACHE_MAX_FILES]:
+            if modified[old] > in_use:
+                break
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self):
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def metrics(self) -> dict:
+        return {"hits": self.hits, "renders": self.renders, "workers": self.workers}
+
+
+report_cache = ReportCache()
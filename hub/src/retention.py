@@ -0,0 +1,392 @@
+import asyncio
+import fcntl
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from uuid import UUID
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import func, select, text
+
+from src import rollups
+from src.db import models
+from src.db.db_init import SessionLocal
+from src.db.partitions import delete_in_batches, fill_values
+
+
+# JSON file with the policies, see retention.json.example. Without it
+# nothing is ever deleted.
+RETENTION_POLICIES = os.getenv("RETENTION_POLICIES", "retention.json")
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", str(6 * 3600)))  # seconds
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./archive")
+ARCHIVE_CHUNK_SIZE = 50000  # rows per parquet row group
+REPORTS_KEPT = 20
+# pg_try_advisory_lock key, one hub worker runs retention at a time
+ADVISORY_LOCK_KEY = 0x1257E7
+
+# Days are whole days, None keeps forever
+DEFAULT_POLICY = {
+    "raw_days": None,  # raw readings in the data table
+    "archive": True,  # parquet copy of raw readings before they are deleted
+    "minute_rollup_days": None,
+    "hour_rollup_days": None,
+}
+
+ARCHIVE_SCHEMA = pa.schema(
+    [
+        ("id", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+        ("data", pa.string()),
+        ("value", pa.float64()),
+        ("unit", pa.string()),
+        ("device_time", pa.timestamp("us")),
+        ("seq", pa.int64()),
+    ]
+)
+
+
+def load_policies(path: str = RETENTION_POLICIES):
+    """Returns (default policy, {group: policy}), None if there is no file.
+
+    {"default": {"raw_days": 365}, "groups": {"lab": {"raw_days": 30}}},
+    settings a group leaves out come from "default".
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        config = json.load(file)
+    unknown = set(config.get("default", {})) - set(DEFAULT_POLICY)
+    for policy in config.get("groups", {}).values():
+        unknown |= set(policy) - set(DEFAULT_POLICY)
+    if unknown:
+        raise ValueError(f"Unknown retention settings in {path}: {sorted(unknown)}")
+    default = {**DEFAULT_POLICY, **config.get("default", {})}
+    groups = {
+        group: {**default, **policy} for group, policy in config.get("groups", {}).items()
+    }
+    return default, groups
+
+
+def day_cutoff(now: datetime, days) -> datetime:
+    "Start of the first day to keep, whole days so rollups and archives line up"
+    if days is None:
+        return None
+    return (now - timedelta(days=days)).replace(**rollups.TRUNCATE[rollups.DAY])
+
+
+class RetentionManager:
+    """Applies the retention policies of the instrument groups.
+
+    For every instrument, raw readings older than `raw_days` go through:
+
+    1. compact: the day's rollups are rebuilt from the raw readings if they
+       do not cover them all (history from before rollups existed),
+    2. archive: the readings are written to a zstd parquet file per day
+       under ARCHIVE_DIR/<instrument id>/,
+    3. delete: in small batches (src/db/partitions.py).
+
+    Minute and hour rollups older than their limits are deleted the same
+    way, day rollups are kept. A day is only ever deleted after its
+    rollups are complete, so an interrupted run can simply be repeated;
+    it may leave a second archive part of a day with rows the first one
+    already has (same `id`).
+    """
+
+    def __init__(
+        self,
+        policies_path: str = RETENTION_POLICIES,
+        archive_dir: str = ARCHIVE_DIR,
+        session_factory=SessionLocal,
+    ):
+        self.policies_path = policies_path
+        self.archive_dir = archive_dir
+        self.session_factory = session_factory
+        self.reports = deque(maxlen=REPORTS_KEPT)
+        self.running = False
+
+    async def run(self, now: datetime = None) -> dict:
+        "One pass over all instruments, returns what it did"
+        policies = load_policies(self.policies_path)
+        if policies is None:
+            return {"skipped": f"no retention policies ({self.policies_path})"}
+        if self.running:
+            return {"skipped": "already running in this worker"}
+        self.running = True
+        try:
+            # one connection held for the whole run, the lock belongs to it
+            engine = self.session_factory.kw["bind"]
+            async with engine.connect() as lock:
+                if not await self._lock(lock):
+                    return {"skipped": "another hub worker is running retention"}
+                try:
+                    return await self._run(*policies, now or datetime.now())
+                finally:
+                    await self._unlock(lock)
+        finally:
+            self.running = False
+
+    async def _lock(self, connection) -> bool:
+        "Takes a lock for the run across workers (and hub nodes on PostgreSQL)"
+        if connection.dialect.name == "postgresql":
+            locked = await connection.scalar(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY}
+            )
+            # a session lock, it outlives the transaction but not the connection
+            await connection.commit()
+            return locked
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self.lock_file = open(os.path.join(self.archive_dir, ".retention.lock"), "w")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            self.lock_file.close()
+            return False
+
+    async def _unlock(self, connection):
+        if connection.dialect.name == "postgresql":
+            await connection.execute(
+                text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY}
+            )
+            await connection.commit()
+        else:
+            self.lock_file.close()
+
+    async def _run(self, default: dict, groups: dict, now: datetime) -> dict:
+        started = time.perf_counter()
+        report = {
+            "started_at": now.isoformat(timespec="seconds"),
+            "instruments": 0,
+            "days_compacted": 0,
+            "days_archived": 0,
+            "archived_rows": 0,
+            "archive_files": [],
+            "deleted_rows": 0,
+            "deleted_rollups": 0,
+            "errors": [],
+        }
+        async with self.session_factory() as db:
+            instrument_groups = dict(
+                (
+                    await db.execute(
+                        select(models.Instrument.id, models.Instrument.group)
+                    )
+                ).all()
+            )
+        # instruments outside the configured groups, also ones that are not
+        # registered (any more), fall under the default policy
+        policies = {None: default, **groups}
+        members = {group: [] for group in policies}
+        for instrument_id, group in instrument_groups.items():
+            members[group if group in groups else None].append(instrument_id)
+
+        # raw readings
+        cutoffs = {
+            group: day_cutoff(now, policy["raw_days"])
+            for group, policy in policies.items()
+        }
+        latest_cutoff = max(filter(None, cutoffs.values()), default=None)
+        if latest_cutoff:
+            for instrument_id in await self._instruments_before(latest_cutoff):
+                group = instrument_groups.get(instrument_id)
+                group = group if group in groups else None
+                if cutoffs[group] is None:
+                    continue
+                deleted = report["deleted_rows"]
+                try:
+                    await self._expire_raw(
+                        instrument_id, policies[group], cutoffs[group], report
+                    )
+                except Exception as e:
+                    print(f"retention of instrument {instrument_id} failed: {e}")
+                    report["errors"].append(f"{instrument_id}: {e}")
+                if report["deleted_rows"] > deleted:
+                    report["instruments"] += 1
+
+        # minute and hour rollups, day rollups are kept
+        rollup = models.DataRollup
+        for resolution, setting in (
+            (rollups.MINUTE, "minute_rollup_days"),
+            (rollups.HOUR, "hour_rollup_days"),
+        ):
+            for group, policy in policies.items():
+                cutoff = day_cutoff(now, policy[setting])
+                if cutoff is None:
+                    continue
+                filters = [rollup.resolution == resolution, rollup.bucket < cutoff]
+                if group is not None:
+                    filters.append(rollup.instrument_id.in_(members[group]))
+                else:
+                    others = [id for group in groups for id in members[group]]
+                    if others:
+                        filters.append(rollup.instrument_id.not_in(others))
+                async with self.session_factory() as db:
+                    report["deleted_rollups"] += await delete_in_batches(
+                        db, rollup, *filters
+                    )
+
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        self.reports.append(report)
+        print(
+            f"retention: {report['deleted_rows']} readings of "
+            f"{report['instruments']} instruments deleted, "
+            f"{report['archived_rows']} archived, "
+            f"{report['deleted_rollups']} rollups deleted, "
+            f"{len(report['errors'])} errors in {report['seconds']}s"
+        )
+        return report
+
+    async def _instruments_before(self, cutoff: datetime) -> list:
+        data = models.InstrumentData
+        async with self.session_factory() as db:
+            return list(
+                await db.scalars(
+                    select(data.instrument_id).filter(data.timestamp < cutoff).distinct()
+                )
+            )
+
+    async def _expire_raw(
+        self, instrument_id: UUID, policy: dict, cutoff: datetime, report: dict
+    ):
+        "Compacts, archives and deletes the readings of one instrument day by day"
+        data = models.InstrumentData
+        after = None
+        while True:
+            # the next day that has readings, empty days cost nothing
+            filters = [data.instrument_id == instrument_id, data.timestamp < cutoff]
+            if after is not None:
+                filters.append(data.timestamp >= after)
+            async with self.session_factory() as db:
+                oldest = await db.scalar(
+                    select(func.min(data.timestamp)).filter(*filters)
+                )
+            if oldest is None:
+                return
+            day = oldest.replace(**rollups.TRUNCATE[rollups.DAY])
+            after = day + timedelta(days=1)
+            in_day = [
+                data.instrument_id == instrument_id,
+                data.timestamp >= day,
+                data.timestamp < after,
+            ]
+            async with self.session_factory() as db:
+                if await self._compact(db, instrument_id, day, in_day):
+                    report["days_compacted"] += 1
+                if policy["archive"]:
+                    path, rows = await self._archive(db, instrument_id, day, in_day)
+                    if rows:
+                        report["days_archived"] += 1
+                        report["archived_rows"] += rows
+                        report["archive_files"].append(path)
+                report["deleted_rows"] += await delete_in_batches(db, data, *in_day)
+
+    async def _compact(self, db, instrument_id: UUID, day: datetime, in_day) -> bool:
+        "Rebuilds the day's rollups if they miss some of its readings"
+        data = models.InstrumentData
+        rollup = models.DataRollup
+        await fill_values(db, *in_day)  # readings stored before values were parsed
+        readings = await db.scalar(
+            select(func.count(data.value)).filter(*in_day, data.value.is_not(None))
+        )
+        rolled_up = await db.scalar(
+            select(rollup.count).filter(
+                rollup.instrument_id == instrument_id,
+                rollup.resolution == rollups.DAY,
+                rollup.bucket == day,
+            )
+        )
+        # fewer readings than rolled up: a run deleting this day was interrupted
+        if not readings or readings <= (rolled_up or 0):
+            return False
+        await rollups.rebuild_day(db, day, instrument_id)
+        await db.commit()
+        return True
+
+    async def _archive(self, db, instrument_id: UUID, day: datetime, in_day):
+        "Writes the day's readings to a parquet file, returns (path, rows)"
+        data = models.InstrumentData
+        query = (
+            select(
+                data.id,
+                data.timestamp,
+                data.data,
+                data.value,
+                data.unit,
+                data.device_time,
+                data.seq,
+            )
+            .filter(*in_day)
+            .order_by(data.timestamp)
+            .execution_options(yield_per=ARCHIVE_CHUNK_SIZE)
+        )
+        rows = 0
+        writer = None  # created with the first rows, no file for an empty day
+        try:
+            result = await db.stream(query)
+            async for chunk in result.partitions():
+                if writer is None:
+                    path = self._archive_path(instrument_id, day)
+                    writer = pq.ParquetWriter(
+                        path + ".tmp", ARCHIVE_SCHEMA, compression="zstd"
+                    )
+                rows += len(chunk)
+                await asyncio.to_thread(write_chunk, writer, chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+        await db.commit()
+        if writer is None:
+            return None, 0
+        # renamed once complete, a file under the final name is never partial
+        os.replace(path + ".tmp", path)
+        return path, rows
+
+    def _archive_path(self, instrument_id: UUID, day: datetime) -> str:
+        "<archive_dir>/<instrument>/<day>.parquet, numbered if that exists"
+        directory = os.path.join(self.archive_dir, str(instrument_id))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{day.date().isoformat()}.parquet")
+        part = 1
+        while os.path.exists(path):
+            part += 1
+            path = os.path.join(directory, f"{day.date().isoformat()}.{part}.parquet")
+        return path
+
+    def metrics(self) -> dict:
+        return {
+            "policies": self.policies_path,
+            "enabled": os.path.exists(self.policies_path),
+            "running": self.running,
+            "interval": RETENTION_INTERVAL,
+            "archive_dir": self.archive_dir,
+        }
+
+
+def write_chunk(writer: pq.ParquetWriter, chunk: list):
+    columns = list(zip(*chunk))
+    columns[0] = [str(id) for id in columns[0]]
+    writer.write_table(
+        pa.Table.from_arrays(
+            [
+                pa.array(column, type=field.type)
+                for column, field in zip(columns, ARCHIVE_SCHEMA)
+            ],
+            schema=ARCHIVE_SCHEMA,
+        )
+    )
+
+
+async def retention_loop(manager: "RetentionManager"):
+    "Background task applying the policies every RETENTION_INTERVAL"
+    while True:
+        try:
+            await manager.run()
+        except Exception as e:
+            print(f"retention run failed: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+
+retention = RetentionManager()
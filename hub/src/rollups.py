@@ -0,0 +1,261 @@
+"""Per-instrument minute, hour and day rollups of the numeric readings.
+
+The ingest pipeline adds every batch it writes to the rollups in the same
+transaction (`add_rows`), so they always match the `data` table. `backfill`
+builds them from the raw readings already stored, run it once after
+upgrading:
+
+    python -m src.rollups --since 2024-01-01
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+from uuid import UUID
+
+from sqlalchemy import delete, func, literal, select, text, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from src.db import models
+from src.db.db_init import SessionLocal, engine, init_db
+from src.db.partitions import fill_values
+
+
+MINUTE, HOUR, DAY = 60, 3600, 86400
+RESOLUTIONS = (MINUTE, HOUR, DAY)  # seconds
+
+# datetime.replace() arguments truncating a timestamp to its bucket
+TRUNCATE = {
+    MINUTE: {"second": 0, "microsecond": 0},
+    HOUR: {"minute": 0, "second": 0, "microsecond": 0},
+    DAY: {"hour": 0, "minute": 0, "second": 0, "microsecond": 0},
+}
+# The same in SQL. SQLite keeps timestamps as text in SQLAlchemy's format,
+# bucket starts have to match it exactly to hit the primary key.
+POSTGRES_TRUNCATE = {MINUTE: "minute", HOUR: "hour", DAY: "day"}
+SQLITE_TRUNCATE = {
+    MINUTE: "%Y-%m-%d %H:%M:00.000000",
+    HOUR: "%Y-%m-%d %H:00:00.000000",
+    DAY: "%Y-%m-%d 00:00:00.000000",
+}
+
+Rollup = models.DataRollup
+
+
+def partial_rollups(rows: list) -> dict:
+    "(instrument_id, resolution, bucket) -> [count, min, max, sum, sumsq] of `rows`"
+    partials = {}
+    for row in rows:
+        value = row["value"]
+        if value is None:
+            continue
+        for resolution in RESOLUTIONS:
+            key = (
+                row["instrument_id"],
+                resolution,
+                row["timestamp"].replace(**TRUNCATE[resolution]),
+            )
+            partial = partials.get(key)
+            if partial is None:
+                partials[key] = [1, value, value, value, value * value]
+            else:
+                partial[0] += 1
+                partial[1] = min(partial[1], value)
+                partial[2] = max(partial[2], value)
+                partial[3] += value
+                partial[4] += value * value
+    return partials
+
+
+async def add_rows(db, rows: list):
+    """Adds the numeric readings of `rows` to their rollups (upserts).
+
+    Runs in the caller's transaction. Keys are written in a fixed order so
+    two hub workers updating the same buckets cannot deadlock.
+    """
+    partials = partial_rollups(rows)
+    if not partials:
+        return
+    values = []
+    for key, partial in sorted(partials.items()):
+        instrument_id, resolution, bucket = key
+        count, minimum, maximum, total, squares = partial
+        values.append(
+            {
+                "instrument_id": instrument_id,
+                "resolution": resolution,
+                "bucket": bucket,
+                "count": count,
+                "min": minimum,
+                "max": maximum,
+                "sum": total,
+                "sumsq": squares,
+            }
+        )
+    if db.bind.dialect.name == "postgresql":
+        statement = postgresql.insert(Rollup)
+        lower, higher = func.least, func.greatest
+    else:
+        statement = sqlite.insert(Rollup)
+        lower, higher = func.min, func.max  # with two arguments
+    added = statement.excluded
+    statement = statement.on_conflict_do_update(
+        index_elements=[Rollup.instrument_id, Rollup.resolution, Rollup.bucket],
+        set_={
+            "count": Rollup.count + added.count,
+            "min": lower(Rollup.min, added.min),
+            "max": higher(Rollup.max, added.max),
+            "sum": Rollup.sum + added.sum,
+            "sumsq": Rollup.sumsq + added.sumsq,
+        },
+    )
+    await db.execute(statement, values)
+
+
+def truncate_column(dialect: str, resolution: int):
+    if dialect == "postgresql":
+        return func.date_trunc(
+            POSTGRES_TRUNCATE[resolution], models.InstrumentData.timestamp
+        )
+    return func.strftime(SQLITE_TRUNCATE[resolution], models.InstrumentData.timestamp)
+
+
+async def rebuild_day(db, day: datetime, instrument_id: UUID = None) -> int:
+    """Recomputes the rollups of one day from its raw readings.
+
+    Only the (instrument, bucket) rollups that still have numeric raw
+    readings are replaced. The others are left alone, they may be all that
+    is left after retention deleted the readings. Returns the rollup rows
+    written.
+    """
+    data = models.InstrumentData
+    in_day = [
+        data.timestamp >= day,
+        data.timestamp < day + timedelta(days=1),
+        data.value.is_not(None),
+    ]
+    if instrument_id:
+        in_day.append(data.instrument_id == instrument_id)
+    has_readings = await db.scalar(select(data.timestamp).filter(*in_day).limit(1))
+    if has_readings is None:
+        return 0
+
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        # blocks ingest from adding to the rollups until this day is rebuilt,
+        # batches that are already in the readings get added afterwards
+        await db.execute(
+            text(f"LOCK TABLE {Rollup.__tablename__} IN SHARE ROW EXCLUSIVE MODE")
+        )
+    # on SQLite the first write takes the database lock for the same effect
+
+    written = 0
+    for resolution in RESOLUTIONS:
+        bucket = truncate_column(dialect, resolution)
+        recomputed = (
+            select(data.instrument_id, bucket)
+            .filter(*in_day)
+            .group_by(data.instrument_id, bucket)
+        )
+        await db.execute(
+            delete(Rollup).filter(
+                Rollup.resolution == resolution,
+                tuple_(Rollup.instrument_id, Rollup.bucket).in_(recomputed),
+            )
+        )
+        query = (
+            select(
+                data.instrument_id,
+                literal(resolution),
+                bucket,
+                func.count(data.value),
+                func.min(data.value),
+                func.max(data.value),
+                func.sum(data.value),
+                func.sum(data.value * data.value),
+            )
+            .filter(*in_day)
+            .group_by(data.instrument_id, bucket)
+        )
+        result = await db.execute(
+            Rollup.__table__.insert().from_select(
+                [
+                    "instrument_id",
+                    "resolution",
+                    "bucket",
+                    "count",
+                    "min",
+                    "max",
+                    "sum",
+                    "sumsq",
+                ],
+                query,
+            )
+        )
+        written += max(result.rowcount, 0)
+    return written
+
+
+async def backfill(
+    since: datetime = None,
+    until: datetime = None,
+    instrument_id: UUID = None,
+    session_factory=SessionLocal,
+) -> dict:
+    """Rebuilds the rollups of every day from `since` to `until` from raw readings.
+
+    Readings without a parsed value (stored before values were parsed at
+    ingest) are parsed first. Defaults to everything stored. One
+    transaction per day, so ingest is only ever held up for the time one
+    day takes.
+    """
+    data = models.InstrumentData
+    async with session_factory() as db:
+        if since is None:
+            since = await db.scalar(select(func.min(data.timestamp)))
+        if until is None:
+            until = await db.scalar(select(func.max(data.timestamp)))
+    report = {
+        "days": 0,
+        "days_without_readings": 0,
+        "rollup_rows": 0,
+        "values_parsed": 0,
+    }
+    if since is None or until is None:
+        return report
+
+    started = time.perf_counter()
+    day = since.replace(**TRUNCATE[DAY])
+    while day <= until:
+        async with session_factory() as db:
+            # readings stored before ingest parsed them
+            in_day = [data.timestamp >= day, data.timestamp < day + timedelta(days=1)]
+            if instrument_id:
+                in_day.append(data.instrument_id == instrument_id)
+            report["values_parsed"] += await fill_values(db, *in_day)
+            written = await rebuild_day(db, day, instrument_id)
+            await db.commit()
+        if written:
+            report["days"] += 1
+            report["rollup_rows"] += written
+        else:
+            report["days_without_readings"] += 1
+        day += timedelta(days=1)
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Builds the rollups from raw readings")
+    parser.add_argument("--since", type=datetime.fromisoformat)
+    parser.add_argument("--until", type=datetime.fromisoformat)
+    parser.add_argument("--instrument", type=UUID)
+    args = parser.parse_args()
+    await init_db()
+    print(await backfill(args.since, args.until, args.instrument))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,15 +1,18 @@
 # instrument_hub.py
-from fastapi import Depends, HTTPException, Query, APIRouter
+from fastapi import Depends, HTTPException, Query, APIRouter, Response
+from fastapi.responses import FileResponse
 from typing import List
 from src.db.db_init import get_db
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, desc
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, desc, func, select
 from src.db import models
-from src import utils
+from src.reports import report_cache
+from src.lookup_cache import lookup_cache
 from src.pydantic_models import (
     CalibrationData,
     LastCalibration
 )
+from src.pagination import keyset_page, set_next_cursor
 from datetime import datetime
 from uuid import UUID
 
@@ -25,9 +28,9 @@ async def calibrate(
     instrument_id: UUID,
     inspector_name: str,
     value: float,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    instrument = db.query(models.Instrument).filter_by(id=instrument_id).first()
+    instrument = await lookup_cache.instrument(db, instrument_id)
     if not instrument:
         raise HTTPException(
             status_code=404,
@@ -37,30 +40,42 @@ async def calibrate(
         instrument_name=instrument.name,
         instrument_id=instrument.id,
         inspector=inspector_name,
-        value=value,
+        value=str(value),  # column is a string, asyncpg does not coerce
     )
     db.add(new_calibration)
-    db.commit()
+    await db.commit()
     return new_calibration
 
 
 @router.get("/instrument/calibration_data", response_model=List[CalibrationData])
 async def calibration_data(
-    instrument_id: UUID, skip: int = 0, limit: int = 10, db: Session = Depends(get_db)
+    instrument_id: UUID,
+    response: Response,
+    cursor: str = None,
+    since: datetime = None,
+    until: datetime = None,
+    descending: bool = False,
+    skip: int = 0,
+    limit: int = 10,
+    db: AsyncSession = Depends(get_db),
 ):
-    instrument = db.query(models.Instrument).filter_by(id=instrument_id).first()
+    instrument = await lookup_cache.instrument(db, instrument_id)
     if not instrument:
         raise HTTPException(
             status_code=404,
             detail=f"Instrument with name '{instrument_id}' not found.",
         )
-    return (
-        db.query(models.Calibrate)
-        .filter_by(instrument_id=instrument_id)
-        .offset(skip)
-        .limit(limit)
-        .all()
+    query = keyset_page(
+        select(models.Calibrate).filter_by(instrument_id=instrument_id),
+        models.Calibrate,
+        cursor=cursor,
+        since=since,
+        until=until,
+        descending=descending,
     )
+    rows = (await db.scalars(query.offset(skip).limit(limit))).all()
+    set_next_cursor(response, rows, limit)
+    return rows
 
 
 def parse_timestamp(timestamp_str: str):
@@ -77,9 +92,9 @@ async def calibration_data_report(
     instrument_id: UUID,
     start_timestamp: str = Query(None, description="Start timestamp (ISO 8601 format)"),
     end_timestamp: str = Query(None, description="End timestamp (ISO 8601 format)"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    instrument = db.query(models.Instrument).filter_by(id=instrument_id).first()
+    instrument = await lookup_cache.instrument(db, instrument_id)
     if not instrument:
         raise HTTPException(
             status_code=404,
@@ -96,33 +111,68 @@ async def calibration_data_report(
         end_time = parse_timestamp(end_timestamp)
         filters.append(models.Calibrate.timestamp <= end_time)
 
-    # Fetch data from the database using SQLAlchemy with filters
-    data = db.query(models.Calibrate).filter(and_(*filters)).all()
+    # Calibrations are only ever added, the newest one in range (plus the
+    # count, timestamps can tie) identifies the report's content
+    latest_calibration_id = await db.scalar(
+        select(models.Calibrate.id)
+        .filter(and_(*filters))
+        .order_by(desc(models.Calibrate.timestamp), desc(models.Calibrate.id))
+        .limit(1)
+    )
+    calibration_count = await db.scalar(
+        select(func.count()).select_from(models.Calibrate).filter(and_(*filters))
+    )
 
-    return utils.create_pdf(
-        data=data,
-        name=instrument.name,
-        timestamp_start=start_timestamp,
-        timestamp_end=end_timestamp,
+    async def load_rows():
+        # Fetch data from the database using SQLAlchemy with filters
+        rows = await db.execute(
+            select(
+                models.Calibrate.instrument_name,
+                models.Calibrate.inspector,
+                models.Calibrate.value,
+                models.Calibrate.timestamp,
+            )
+            .filter(and_(*filters))
+            .order_by(models.Calibrate.timestamp, models.Calibrate.id)
+        )
+        return [tuple(row) for row in rows]
+
+    key = report_cache.key(
+        instrument_id,
+        instrument.name,
+        start_timestamp,
+        end_timestamp,
+        f"{latest_calibration_id}/{calibration_count}",
+    )
+    # rendering runs in a worker process, repeated downloads come from disk
+    pdf_file = await report_cache.get_or_render(
+        key, load_rows, instrument.name, start_timestamp, end_timestamp
+    )
+    return FileResponse(
+        path=pdf_file,
+        filename=f"{instrument.name}_calibration_log.pdf",
+        media_type="application/pdf",
     )
 
 
 @router.get("/instrument/last_calibration", response_model=LastCalibration)
-async def get_last_calibration(instrument_id: UUID, db: Session = Depends(get_db)):
+async def get_last_calibration(
+    instrument_id: UUID, db: AsyncSession = Depends(get_db)
+):
     # Fetch the latest calibration log for the specified instrument
     
-    instrument = db.query(models.Instrument).filter_by(id=instrument_id).first()
+    instrument = await lookup_cache.instrument(db, instrument_id)
     if not instrument:
         raise HTTPException(
             status_code=404,
             detail=f"Instrument with id '{instrument_id}' not found.",
         )
         
-    last_calibration = (
-        db.query(models.Calibrate)
+    last_calibration = await db.scalar(
+        select(models.Calibrate)
         .filter(models.Calibrate.instrument_id == instrument_id)
         .order_by(desc(models.Calibrate.timestamp))
-        .first()
+        .limit(1)
     )
 
     if not last_calibration:
@@ -1,12 +1,20 @@
-from fastapi import Depends, HTTPException, APIRouter
+from fastapi import Depends, HTTPException, APIRouter, Response, Query
+from fastapi.responses import StreamingResponse
 from typing import List
 from src.db.db_init import get_db
-from sqlalchemy.orm import Session
-from src.db import models
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from src.db import models, partitions
 from src.pydantic_models import (
     InstrumentDataLog,
+    RecentReadings,
 )
-from datetime import datetime
+from src.pagination import keyset_page, set_next_cursor
+from src import aggregation, export
+from src.hot_cache import as_log, hot_cache
+from src.lookup_cache import lookup_cache
+from src.retention import retention
+from datetime import datetime, timedelta
 from uuid import UUID
 
 
@@ -18,26 +26,130 @@ router = APIRouter(
 
 @router.get("/instrument/data_log", response_model=List[InstrumentDataLog])
 async def data_log(
-    instrument_id: UUID, skip: int = 0, limit: int = 10, db: Session = Depends(get_db)
+    instrument_id: UUID,
+    response: Response,
+    cursor: str = None,
+    since: datetime = None,
+    until: datetime = None,
+    descending: bool = False,
+    skip: int = 0,
+    limit: int = 10,
+    db: AsyncSession = Depends(get_db),
 ):
-    "Route for getting a log of data trafic"
-    instrument = db.query(models.Instrument).filter_by(id=instrument_id).first()
+    "Route for getting a log of data trafic, page with the X-Next-Cursor header"
+    instrument = await lookup_cache.instrument(db, instrument_id)
     if not instrument:
         raise HTTPException(
             status_code=404, detail=f"No instrument with id '{instrument_id}' found."
         )
 
-    return (
-        db.query(models.InstrumentData)
-        .filter_by(instrument_id=instrument_id)
-        .offset(skip)
-        .limit(limit)
-        .all()
+    query = keyset_page(
+        select(models.InstrumentData).filter_by(instrument_id=instrument_id),
+        models.InstrumentData,
+        cursor=cursor,
+        since=since,
+        until=until,
+        descending=descending,
+    )
+    # skip is only kept for old clients, deep offsets get slow
+    rows = (await db.scalars(query.offset(skip).limit(limit))).all()
+    set_next_cursor(response, rows, limit)
+    return rows
+
+
+@router.get("/instrument/recent", response_model=RecentReadings)
+async def recent_readings(instrument_id: UUID, seconds: float = Query(None, gt=0)):
+    "Latest reading and the last minutes of live readings, from memory (no DB query)"
+    latest = hot_cache.latest(instrument_id)
+    readings = hot_cache.window(instrument_id, seconds)
+    return RecentReadings(
+        instrument_id=instrument_id,
+        latest=as_log(latest) if latest else None,
+        readings=[as_log(reading) for reading in readings],
+    )
+
+
+@router.get("/instrument/aggregate")
+async def aggregate_data_log(
+    instrument_id: UUID,
+    since: datetime = None,
+    until: datetime = None,
+    mode: str = Query("stats", pattern="^(stats|lttb)$"),
+    points: int = Query(1000, ge=3, le=aggregation.AGGREGATE_MAX_POINTS),
+    bucket: float = Query(None, gt=0),
+    source: str = Query("auto", pattern="^(auto|raw|rollup)$"),
+    db: AsyncSession = Depends(get_db),
+):
+    """Numeric readings of a range reduced to at most `points` points for charts.
+
+    mode=stats gives count/min/max/mean/stddev per time bucket (`bucket`
+    seconds, chosen from the range by default), read from the rollups when
+    the buckets are whole minutes, hours or days. mode=lttb gives the
+    readings picked by LTTB downsampling. The range defaults to the last
+    24 hours.
+    """
+    instrument = await lookup_cache.instrument(db, instrument_id)
+    if not instrument:
+        raise HTTPException(
+            status_code=404, detail=f"No instrument with id '{instrument_id}' found."
+        )
+    until = until or datetime.now()
+    since = since or until - timedelta(days=1)
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since has to be before until.")
+
+    if mode == "lttb":
+        data = await aggregation.lttb_points(db, instrument_id, since, until, points)
+        bucket = None
+    else:
+        bucket = bucket or aggregation.choose_bucket(since, until, points)
+        if (until - since).total_seconds() / bucket > aggregation.AGGREGATE_MAX_POINTS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"More than {aggregation.AGGREGATE_MAX_POINTS} buckets, "
+                "use a wider bucket or a shorter range.",
+            )
+        data = await aggregation.bucket_stats(
+            db, instrument_id, since, until, bucket, source
+        )
+    return {
+        "instrument_id": instrument_id,
+        "since": since,
+        "until": until,
+        "mode": mode,
+        "bucket_seconds": bucket,
+        "points": data,
+    }
+
+
+@router.get("/instrument/export")
+async def export_data_log(
+    instrument_id: UUID,
+    format: str = Query("csv", pattern="^(csv|ndjson|parquet)$"),
+    since: datetime = None,
+    until: datetime = None,
+    db: AsyncSession = Depends(get_db),
+):
+    "Route for downloading the full data log of an instrument as csv, ndjson or parquet"
+    instrument = await lookup_cache.instrument(db, instrument_id)
+    if not instrument:
+        raise HTTPException(
+            status_code=404, detail=f"No instrument with id '{instrument_id}' found."
+        )
+
+    chunks = export.fetch_chunks(instrument_id, since=since, until=until)
+    filename = f"{instrument.name or instrument_id}_data_log.{format}"
+    return StreamingResponse(
+        export.STREAMS[format](chunks),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
 
 @router.delete("/instrument/data_logs")
-async def delete_data_logs(older_than_year: str, db: Session = Depends(get_db)):
+async def delete_data_logs(
+    older_than_year: str, db: AsyncSession = Depends(get_db)
+):
     "Route for cleaning database"
     try:
         # Parse the year input
@@ -48,13 +160,27 @@ async def delete_data_logs(older_than_year: str, db: Session = Depends(get_db)):
             status_code=400, detail="Invalid year format. Please provide a valid year."
         )
 
-    logs_to_delete = db.query(models.InstrumentData).filter(
-        models.InstrumentData.timestamp < cutoff_date
-    )
-    count = logs_to_delete.count()
+    # drops whole monthly partitions where possible
+    result = await partitions.delete_before(db, cutoff_date)
+
+    return {
+        "message": f"Deleted {result['deleted_rows']} data logs and dropped "
+        f"{len(result['dropped_partitions'])} partitions "
+        f"(~{result['dropped_rows_estimate']} rows) older than {older_than_year}",
+        **result,
+    }
 
-    # Perform the deletion
-    logs_to_delete.delete(synchronize_session=False)
-    db.commit()
 
-    return {"message": f"Deleted {count} data logs older than {older_than_year}"}
+@router.get("/retention/report")
+async def retention_report():
+    "Policies in use and what the last retention runs did"
+    return {**retention.metrics(), "runs": list(retention.reports)}
+
+
+@router.post("/retention/run")
+async def run_retention():
+    "Applies the retention policies now instead of waiting for the next run"
+    try:
+        return await retention.run()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -1,14 +1,13 @@
 from fastapi import (
     WebSocket,
     WebSocketDisconnect,
-    Depends,
     Request,
     APIRouter,
+    Query,
 )
 from starlette.websockets import WebSocketDisconnect
-from typing import Dict, List
-from src.db.db_init import get_db
-from sqlalchemy.orm import Session
+from typing import Dict, List, Set
+from src.db.db_init import SessionLocal
 from src.db import models
 from src.pydantic_models import (
     InstrumentCreate,
@@ -18,9 +17,38 @@ from .instrument_management import create_instrument, get_instrument_profile
 import json
 from uuid import UUID
 from datetime import datetime
-from sqlalchemy import func
-from src.utils import convert_commands_string_to_dict
+from sqlalchemy import select
+from src.command_cache import command_cache
+from src.lookup_cache import lookup_cache
+from src.ingest import pipeline
+from src.outbound import SEND_TIMEOUT, ClientConnection
+from src.backplane import backplane
+from src.clock import ClockOffset, clock_offsets
+from src.hot_cache import HOT_CACHE_SNAPSHOT, as_log, hot_cache
+from src.gateway import (
+    ACK,
+    OPEN,
+    READINGS,
+    STATUS,
+    Acknowledgements,
+    GatewayChannel,
+    decode,
+    encode,
+    gateway_stats,
+)
+import asyncio
+import os
 import re
+import time
+
+# Edge readings captured longer ago than this are replays from the device's
+# outbox, they are stored but not pushed to the dashboards as live values
+LIVE_WINDOW = float(os.getenv("LIVE_WINDOW", "10"))  # seconds
+
+# Backplane channels
+CLIENTS_CHANNEL = "clients"
+READINGS_CHANNEL = "readings"  # [timestamp, data], also cached by every worker
+INSTRUMENT_CHANNEL = "instrument"
 
 router = APIRouter(
     prefix="/data_routing",
@@ -29,37 +57,142 @@ router = APIRouter(
 
 
 class ConnectionManager:
-    def __init__(self):
-        # Separate dictionaries for clients and instruments
-        self.active_client_connections: Dict[WebSocket, str] = {}
-        self.active_instrument_connections: Dict[WebSocket, str] = {}
+    def __init__(self, backplane=backplane):
+        # Separate dictionaries for clients and instruments (socket -> instrument id)
+        self.active_client_connections: Dict[WebSocket, UUID] = {}
+        self.active_instrument_connections: Dict[WebSocket, UUID] = {}
+        # Subscription registry (instrument id -> sockets) used for fan-out
+        self.client_subscriptions: Dict[UUID, Set[WebSocket]] = {}
+        self.instrument_sockets: Dict[UUID, Set[WebSocket]] = {}
+        # Bounded outbound queue and sender task per client
+        self.client_outbound: Dict[WebSocket, ClientConnection] = {}
+        # Reaches sockets held by other hub workers
+        self.backplane = backplane
+        self.backplane.subscribe(CLIENTS_CHANNEL, self._remote_to_clients)
+        self.backplane.subscribe(READINGS_CHANNEL, self._remote_reading)
+        self.backplane.subscribe(INSTRUMENT_CHANNEL, self._remote_to_instrument)
 
-    async def connect_client(self, websocket: WebSocket, instrument_id: UUID):
+    async def connect_client(
+        self, websocket: WebSocket, instrument_id: UUID, snapshot: str = "off"
+    ):
         await websocket.accept()
+        client = ClientConnection(websocket, instrument_id)
+        client.start()
+        self.client_outbound[websocket] = client
+        # queued before the client is subscribed, so it comes before live readings
+        for message in self.snapshot_messages(instrument_id, snapshot):
+            client.put(message)
         self.active_client_connections[websocket] = instrument_id
+        self.client_subscriptions.setdefault(instrument_id, set()).add(websocket)
 
     async def connect_instrument(self, websocket: WebSocket, instrument_id: UUID):
         await websocket.accept()
+        self.register_instrument(websocket, instrument_id)
+
+    def register_instrument(self, websocket: WebSocket, instrument_id: UUID):
         self.active_instrument_connections[websocket] = instrument_id
+        self.instrument_sockets.setdefault(instrument_id, set()).add(websocket)
 
     def disconnect(self, websocket: WebSocket):
-        # Remove from both dictionaries if present
-        self.active_client_connections.pop(websocket, None)
-        self.active_instrument_connections.pop(websocket, None)
+        # Remove from both registries if present
+        instrument_id = self.active_client_connections.pop(websocket, None)
+        if instrument_id is not None:
+            self._unsubscribe(self.client_subscriptions, instrument_id, websocket)
+        client = self.client_outbound.pop(websocket, None)
+        if client:
+            client.stop()
+        instrument_id = self.active_instrument_connections.pop(websocket, None)
+        if instrument_id is not None:
+            self._unsubscribe(self.instrument_sockets, instrument_id, websocket)
+
+    def _unsubscribe(self, registry: dict, instrument_id: UUID, websocket: WebSocket):
+        sockets = registry.get(instrument_id)
+        if sockets is None:
+            return
+        sockets.discard(websocket)
+        if not sockets:
+            del registry[instrument_id]
 
     async def send_message(self, websocket: WebSocket, message: str):
-        await websocket.send_text(message)
+        try:
+            await asyncio.wait_for(websocket.send_text(message), SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            # slow socket, skip this message for it
+            print(f"send timed out after {SEND_TIMEOUT}s, message dropped")
+        except Exception:
+            # socket is gone, its endpoint cleans up on the next receive
+            self.disconnect(websocket)
+
+    async def fan_out(self, sockets: Set[WebSocket], message: str):
+        if not sockets:
+            return
+        # copy, the set can change while we are awaiting the sends
+        await asyncio.gather(
+            *[self.send_message(websocket, message) for websocket in list(sockets)]
+        )
 
     async def broadcast_to_clients(self, instrument_id: UUID, message: str):
-        # Broadcast message to all clients subscribed to this instrument
-        for websocket, subscribed_id in self.active_client_connections.items():
-            if subscribed_id == instrument_id:
-                await self.send_message(websocket, message)
+        self.deliver_to_clients(instrument_id, message)
+        self.backplane.publish(CLIENTS_CHANNEL, str(instrument_id), message)
+
+    async def broadcast_reading(
+        self, instrument_id: UUID, data: str, timestamp: float = None
+    ):
+        "Like broadcast_to_clients for readings, which also go into the hot cache"
+        timestamp = time.time() if timestamp is None else timestamp
+        hot_cache.add(instrument_id, data, timestamp)
+        self.deliver_to_clients(instrument_id, data)
+        self.backplane.publish(
+            READINGS_CHANNEL, str(instrument_id), json.dumps([timestamp, data])
+        )
 
-    async def broadcast_to_instrument(self, instrument_id: UUID, message: str, db):
+    def snapshot_messages(self, instrument_id: UUID, snapshot: str) -> List[str]:
+        if snapshot == "latest":
+            latest = hot_cache.latest(instrument_id)
+            return [latest[1]] if latest else []
+        if snapshot == "window":
+            latest = hot_cache.latest(instrument_id)
+            readings = hot_cache.window(instrument_id)
+            message = {
+                "snapshot": {
+                    "latest": as_log(latest) if latest else None,
+                    "readings": [as_log(reading) for reading in readings],
+                }
+            }
+            return [json.dumps(message, default=datetime.isoformat)]
+        return []
+
+    def deliver_to_clients(self, instrument_id: UUID, message: str):
+        # Queue message for all local clients subscribed to this instrument,
+        # their sender tasks do the actual (possibly slow) socket writes
+        for websocket in self.client_subscriptions.get(instrument_id, ()):
+            self.client_outbound[websocket].put(message)
+
+    async def _remote_to_clients(self, instrument_id: str, message: str):
+        self.deliver_to_clients(UUID(instrument_id), message)
+
+    async def _remote_reading(self, instrument_id: str, message: str):
+        timestamp, data = json.loads(message)
+        hot_cache.add(UUID(instrument_id), data, timestamp)
+        self.deliver_to_clients(UUID(instrument_id), data)
+
+    async def _remote_to_instrument(self, instrument_id: str, message: str):
+        # checked again, whatever reaches the backplane must not drive instruments
+        if not self.check_if_led_command(message=message):
+            if not await self.validate_command(
+                message=message, instrument_id=UUID(instrument_id)
+            ):
+                print(f"backplane command for {instrument_id} refused: {message!r}")
+                return
+        await self.fan_out(self.instrument_sockets.get(UUID(instrument_id)), message)
+
+    def client_metrics(self) -> List[dict]:
+        return [client.metrics() for client in self.client_outbound.values()]
+
+    async def broadcast_to_instrument(self, instrument_id: UUID, message: str):
         if not self.check_if_led_command(message=message):
             is_valid_command = await self.validate_command(
-                message=message, instrument_id=instrument_id, db=db
+                message=message, instrument_id=instrument_id
             )
   
             if not is_valid_command:
@@ -68,27 +201,14 @@ class ConnectionManager:
                 )
               
                 return False
-        
-        for websocket, subscribed_id in self.active_instrument_connections.items():
-            if subscribed_id == instrument_id:
-                await self.send_message(websocket, message)
-
-    async def validate_command(self, message: str, instrument_id: UUID, db):
-        instrument = db.query(models.Instrument).filter_by(id=instrument_id).first()
-        if not instrument:
-            return False
-        if not instrument.profile:
-            return False
-        
-        profile = db.query(models.InstrumentProfile).filter_by(id=instrument.profile).first()
-       
-        if not profile.commands:
-            return False
-        commands = convert_commands_string_to_dict(profile.commands)
-        if message in commands:
-            return True
-        else:
-            return False
+
+        await self.fan_out(self.instrument_sockets.get(instrument_id), message)
+        self.backplane.publish(INSTRUMENT_CHANNEL, str(instrument_id), message)
+
+    async def validate_command(self, message: str, instrument_id: UUID):
+        # pre-parsed whitelist, only hits the DB when the cache has no entry
+        commands = await command_cache.get_commands(instrument_id)
+        return message in commands
 
     def check_if_led_command(self, message: str):
         pattern = r"find_my_instrument_(red|green)_(\d+(\.\d+)?)_(\d+)"
@@ -100,44 +220,134 @@ class ConnectionManager:
 
 
 manager = ConnectionManager()
+# Highest outbox sequence number forwarded per instrument by this worker
+forwarded_seq: Dict[UUID, int] = {}
+
+
+async def set_instrument_online(instrument_id: UUID, online: int):
+    async with SessionLocal() as db:
+        instrument_in_db = await db.scalar(
+            select(models.Instrument).filter_by(id=instrument_id)
+        )
+        if instrument_in_db:
+            instrument_in_db.online = online
+            if online:
+                instrument_in_db.last_logon = datetime.now()
+            await db.commit()
+            lookup_cache.invalidate_instrument(instrument_id)
+        elif online:
+            # register instrument in database
+            instrument_create = InstrumentCreate(
+                id=instrument_id,
+            )
+            await create_instrument(instrument=instrument_create, db=db)
+
+
+async def forward_reading(
+    instrument_id: UUID,
+    seq: int,
+    captured_at: float,
+    data: str,
+    receipt,
+    clock: ClockOffset,
+):
+    "Hands a reading from an edge outbox to the clients (if recent) and the pipeline"
+    hub_time = clock.to_hub_time(captured_at)
+    # the pipeline skips replays only when storing, a reading resent after a
+    # quick reconnect is still live and must not reach the dashboards twice
+    if seq > forwarded_seq.get(instrument_id, -1):
+        forwarded_seq[instrument_id] = seq
+        if time.time() - hub_time < LIVE_WINDOW:
+            await manager.broadcast_reading(instrument_id, data, hub_time)
+    await pipeline.submit(
+        instrument_id,
+        data,
+        seq=seq,
+        timestamp=datetime.fromtimestamp(hub_time),
+        device_time=datetime.fromtimestamp(captured_at),
+        stored=receipt,
+    )
+
 
+@router.get("/ingest/metrics")
+async def ingest_metrics():
+    "Queue depth and flush statistics of the data ingest pipeline"
+    return pipeline.metrics()
 
+
+@router.get("/clients/metrics")
+async def client_metrics():
+    "Outbound queue depth and dropped message counters per connected client"
+    return manager.client_metrics()
+
+
+@router.get("/gateway/metrics")
+async def gateway_metrics():
+    "Edge gateway connections, channels and bytes per reading"
+    return gateway_stats.metrics()
+
+
+@router.get("/hot_cache/metrics")
+async def hot_cache_metrics():
+    "Instruments and readings in this worker's cache of recent readings"
+    return hot_cache.metrics()
+
+
+@router.get("/lookup_cache/metrics")
+async def lookup_cache_metrics():
+    "Hit ratio of the instrument and profile lookup cache"
+    return lookup_cache.metrics()
+
+
+@router.get("/clock/metrics")
+async def clock_metrics():
+    "Estimated clock offset per edge device, as seen by this worker"
+    return clock_offsets.metrics()
+
+
+@router.get("/backplane/metrics")
+async def backplane_metrics():
+    "Messages exchanged with other hub workers"
+    return backplane.metrics()
+
+
+# Websocket handlers live as long as their connection, so they open short
+# sessions when they need the database instead of holding a pooled one.
 @router.websocket("/ws/client/{instrument_id}")
 async def websocket_client_endpoint(
-    websocket: WebSocket, instrument_id: UUID, db: Session = Depends(get_db)
+    websocket: WebSocket,
+    instrument_id: UUID,
+    snapshot: str = Query(HOT_CACHE_SNAPSHOT, pattern="^(latest|window|off)$"),
 ):
-    await manager.connect_client(websocket, instrument_id)
     try:
+        await manager.connect_client(websocket, instrument_id, snapshot)
         while True:
             command = await websocket.receive_text()
             print(command)
             await manager.broadcast_to_instrument(
-                instrument_id=instrument_id, message=command, db=db
+                instrument_id=instrument_id, message=command
             )
 
     except WebSocketDisconnect:
+        pass
+    finally:
+        # also on errors, or the subscription and sender task would leak
         manager.disconnect(websocket)
 
 
 # Instrument WebSocket endpoint
 @router.websocket("/ws/instrument/{instrument_id}")
-async def websocket_instrument_endpoint(
-    websocket: WebSocket, instrument_id: UUID, db: Session = Depends(get_db)
-):
+async def websocket_instrument_endpoint(websocket: WebSocket, instrument_id: UUID):
 
     await manager.connect_instrument(websocket, instrument_id)
     await manager.broadcast_to_clients(instrument_id, "online")
-    instrument_in_db = db.query(models.Instrument).filter_by(id=instrument_id).first()
-    if instrument_in_db:
-        instrument_in_db.online = 1
-        instrument_in_db.last_logon = datetime.now()
-        db.commit()
-    else:
-        # register instrument in database
-        instrument_create = InstrumentCreate(
-            id=instrument_id,
-        )
-        await create_instrument(instrument=instrument_create, db=db)
+    await set_instrument_online(instrument_id, 1)
+
+    async def send_ack(seq: int):
+        await websocket.send_text(json.dumps({"ack": seq}))
+
+    acknowledgements = Acknowledgements(websocket, send_ack)
+    clock = clock_offsets.open(str(instrument_id))
 
     try:
         while True:
@@ -147,25 +357,115 @@ async def websocket_instrument_endpoint(
             print(instrument_text)
             instrument_data = json.loads(instrument_text)
 
-            await manager.broadcast_to_clients(
-                instrument_id, str(instrument_data["data"])
-            )
+            if "readings" in instrument_data:
+                # [[seq, captured_at, data], ...] from the device's outbox
+                readings = instrument_data["readings"]
+                if "sent_at" in instrument_data:
+                    clock.add(instrument_data["sent_at"])
+                if not readings:
+                    continue
+                receipt = pipeline.receipt(len(readings))
+                for seq, captured_at, data in readings:
+                    await forward_reading(
+                        instrument_id, seq, captured_at, str(data), receipt, clock
+                    )
+                acknowledgements.after_stored(receipt, readings[-1][0])
+                continue
 
-            # log data
-            new_data = models.InstrumentData(
-                instrument_id=instrument_id, data=str(instrument_data["data"])
-            )
+            await manager.broadcast_reading(instrument_id, str(instrument_data["data"]))
 
-            db.add(new_data)
-            db.commit()
+            # log data (batched by the ingest pipeline)
+            await pipeline.submit(instrument_id, str(instrument_data["data"]))
 
     except Exception as e:
         print("offline")
         await manager.broadcast_to_clients(instrument_id, "offline")
-        if instrument_in_db:
-            instrument_in_db.online = 0
-        else:  # only during initial connection
-            db.query(models.Instrument).filter_by(id=instrument_id).first().online = 0
-        db.commit()
+        await set_instrument_online(instrument_id, 0)
         print(f"error: {e}")
         manager.disconnect(websocket)
+        clock_offsets.close(str(instrument_id))
+
+
+# Edge agent WebSocket endpoint, one connection for all instruments of a device.
+# Binary msgpack frames, see src/gateway.py for the message types.
+@router.websocket("/ws/gateway")
+async def websocket_gateway_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    gateway_stats.connections += 1
+    # every channel is bound for the whole connection, the online ones are
+    # also registered with the manager to receive commands
+    channels: Dict[int, GatewayChannel] = {}
+    online: Set[int] = set()
+    last_seq = None
+
+    async def send_ack(seq: int):
+        await websocket.send_bytes(encode([ACK, seq]))
+
+    acknowledgements = Acknowledgements(websocket, send_ack)
+    host, port = websocket.client or ("unknown", id(websocket))
+    device = f"gateway {host}:{port}"
+    clock = clock_offsets.open(device)
+
+    async def set_channel_online(number: int, is_online: bool):
+        channel = channels.get(number)
+        if channel is None or (number in online) == is_online:
+            return
+        if is_online:
+            online.add(number)
+            manager.register_instrument(channel, channel.instrument_id)
+        else:
+            online.discard(number)
+            manager.disconnect(channel)
+        await manager.broadcast_to_clients(
+            channel.instrument_id, "online" if is_online else "offline"
+        )
+        await set_instrument_online(channel.instrument_id, int(is_online))
+
+    async def open_channel(number: int, instrument_id: UUID, is_online: bool):
+        if number not in channels:
+            channels[number] = GatewayChannel(websocket, number, instrument_id)
+            gateway_stats.channels += 1
+        await set_channel_online(number, is_online)
+
+    try:
+        while True:
+            frame = await websocket.receive_bytes()
+            gateway_stats.received(frame)
+            message = decode(frame)
+            if message[0] == READINGS:
+                readings = message[1]
+                if len(message) > 2:
+                    clock.add(message[2])
+                if not readings:
+                    continue
+                known = [reading for reading in readings if reading[0] in channels]
+                gateway_stats.unknown_channel += len(readings) - len(known)
+                receipt = pipeline.receipt(len(known))
+                for number, seq, captured_at, data in known:
+                    if last_seq is not None and seq != last_seq + 1:
+                        gateway_stats.sequence_gaps += 1
+                    last_seq = seq
+                    await forward_reading(
+                        channels[number].instrument_id,
+                        seq,
+                        captured_at,
+                        str(data),
+                        receipt,
+                        clock,
+                    )
+                gateway_stats.readings += len(readings)
+                acknowledgements.after_stored(receipt, readings[-1][1])
+            elif message[0] == OPEN:
+                _, number, instrument_id, is_online = message
+                await open_channel(number, UUID(bytes=instrument_id), is_online)
+            elif message[0] == STATUS:
+                await set_channel_online(message[1], message[2])
+
+    except Exception as e:
+        print(f"gateway offline: {e}")
+        for number in list(online):
+            await set_channel_online(number, False)
+    finally:
+        gateway_stats.connections -= 1
+        gateway_stats.channels -= len(channels)
+        clock_offsets.close(device)
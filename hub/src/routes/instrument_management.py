@@ -10,7 +10,8 @@ from fastapi import (
 from typing import List, Optional
 from src.db import models
 from src.db.db_init import get_db
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
 from src.pydantic_models import (
     InstrumentRead,
     InstrumentCreate,
@@ -20,6 +21,9 @@ from src.pydantic_models import (
 )
 from uuid import UUID
 from src.utils import convert_dict_to_commands_string
+from src.pagination import keyset_page, set_next_cursor
+from src.command_cache import command_cache
+from src.lookup_cache import lookup_cache
 
 
 DEFAULT_INSTRUMENT_PORT = 8080
@@ -36,30 +40,32 @@ router = APIRouter(
 
 @router.get("/", response_model=List[InstrumentRead])
 async def all_instruments(
-    group: str = "", skip: int = 0, limit: int = 10, db: Session = Depends(get_db)
+    response: Response,
+    group: str = "",
+    cursor: str = None,
+    skip: int = 0,
+    limit: int = 10,
+    db: AsyncSession = Depends(get_db),
 ):
     "Route that returns a list of all instruments"
 
+    query = select(models.Instrument)
     if len(group) > 0:
-        return (
-            db.query(models.Instrument)
-            .filter_by(group=group)
-            .offset(skip)
-            .limit(limit)
-            .all()
-        )
-    else:
-        return db.query(models.Instrument).offset(skip).limit(limit).all()
+        query = query.filter_by(group=group)
+    query = keyset_page(query, models.Instrument, cursor=cursor)
+    instruments = (await db.scalars(query.offset(skip).limit(limit))).all()
+    set_next_cursor(response, instruments, limit)
+    return instruments
 
 
 @router.post("/create", response_model=InstrumentRead)
 async def create_instrument(
-    instrument: InstrumentCreate, db: Session = Depends(get_db)
+    instrument: InstrumentCreate, db: AsyncSession = Depends(get_db)
 ):
     "Route for creating new instruments"
     print(f"creating instrument: ({instrument})")
-    allready_existing_instrument = (
-        db.query(models.Instrument).filter_by(id=instrument.id).first()
+    allready_existing_instrument = await db.scalar(
+        select(models.Instrument).filter_by(id=instrument.id)
     )
     if allready_existing_instrument:
         raise HTTPException(
@@ -79,17 +85,21 @@ async def create_instrument(
         profile=instrument.profile,
     )
     db.add(new_instrument)
-    db.commit()
-    db.refresh(new_instrument)
+    await db.commit()
+    await db.refresh(new_instrument)
+    lookup_cache.invalidate_instrument(new_instrument.id)
+    command_cache.invalidate_instrument(new_instrument.id)
     return new_instrument
 
 
 @router.post("/registration", response_model=InstrumentRead)
 async def register_instrument(
-    instrument: InstrumentRegister, db: Session = Depends(get_db)
+    instrument: InstrumentRegister, db: AsyncSession = Depends(get_db)
 ):
     "Registers and enables instrument"
-    instrument_in_db = db.query(models.Instrument).filter_by(id=instrument.id).first()
+    instrument_in_db = await db.scalar(
+        select(models.Instrument).filter_by(id=instrument.id)
+    )
     if not instrument_in_db:
         raise HTTPException(
             status_code=404,
@@ -103,22 +113,26 @@ async def register_instrument(
     instrument_in_db.group = instrument.group
     instrument_in_db.profile = instrument.profile
     db.add(instrument_in_db)
-    db.commit()
+    await db.commit()
+    lookup_cache.invalidate_instrument(instrument_in_db.id)
+    command_cache.invalidate_instrument(instrument_in_db.id)
     return instrument_in_db
 
 
 @router.delete("/delete")
-async def delete_instrument(id: UUID, db: Session = Depends(get_db)):
+async def delete_instrument(id: UUID, db: AsyncSession = Depends(get_db)):
     "Route for deleting instrument profiles"
-    instrument = db.query(models.Instrument).filter_by(id=id).first()
+    instrument = await db.scalar(select(models.Instrument).filter_by(id=id))
     if not instrument:
         raise HTTPException(
             status_code=404, detail=f"No instrument found with id '{id}'"
         )
 
     instrument_name = instrument.name
-    db.delete(instrument)
-    db.commit()
+    await db.delete(instrument)
+    await db.commit()
+    lookup_cache.invalidate_instrument(id)
+    command_cache.invalidate_instrument(id)
     return (
         f"Successfully deleted instrument with name '{instrument_name}' and id '{id}'"
     )
@@ -128,24 +142,22 @@ async def delete_instrument(id: UUID, db: Session = Depends(get_db)):
 async def get_instrument_profile(
     instrument_id: Optional[UUID] = None,
     profile_id: Optional[UUID] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     "Route for getting instrument profiles"
     if instrument_id == None and profile_id == None:
-        profiles = db.query(models.InstrumentProfile).all()
+        profiles = (await db.scalars(select(models.InstrumentProfile))).all()
         return profiles
 
     profile = None
 
     if instrument_id:
-        instrument = db.query(models.Instrument).filter_by(id=instrument_id).first()
+        instrument = await lookup_cache.instrument(db, instrument_id)
         if not instrument:
             raise HTTPException(
                 status_code=404, detail=f"No instrument found with id '{id}'"
             )
-        profile = (
-            db.query(models.InstrumentProfile).filter_by(id=instrument.profile).first()
-        )
+        profile = await lookup_cache.profile(db, instrument.profile)
         if not profile:
             raise HTTPException(
                 status_code=404,
@@ -153,7 +165,7 @@ async def get_instrument_profile(
             )
 
     elif profile_id:
-        profile = db.query(models.InstrumentProfile).filter_by(id=profile_id).first()
+        profile = await lookup_cache.profile(db, profile_id)
         print("test")
         if not profile:
             raise HTTPException(
@@ -166,7 +178,7 @@ async def get_instrument_profile(
 @router.post("/profile/create", response_model=InstrumentProfileRead)
 async def create_instrument_profile(
     new_instrument_profile: InstrumentProfileCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     "Route for creating instrument profiles"
     commands = ""
@@ -181,8 +193,8 @@ async def create_instrument_profile(
         commands=commands,
     )
     db.add(new_profile)
-    db.commit()
-    db.refresh(new_profile)
+    await db.commit()
+    await db.refresh(new_profile)
     return new_profile
 
 
@@ -190,35 +202,39 @@ async def create_instrument_profile(
 async def update_instrument_profile(
     id: UUID,
     new_commands: dict,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     "Route for updateing instrument profiles"
-    profile = db.query(models.InstrumentProfile).filter_by(id=id).first()
+    profile = await db.scalar(select(models.InstrumentProfile).filter_by(id=id))
     if not profile:
         raise HTTPException(
             status_code=404,
             detail=f"No profile found with id: {id}",
         )
     profile.commands = convert_dict_to_commands_string(new_commands)
-    db.commit()
-    db.refresh(profile)
+    await db.commit()
+    await db.refresh(profile)
+    lookup_cache.invalidate_profile(id)
+    command_cache.invalidate_profile(id)
     return profile
 
 
 @router.delete("/profil/delete", response_model=str)
 async def delete_instrument_profile(
     id: UUID,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     "Route for updateing instrument profiles"
-    profile = db.query(models.InstrumentProfile).filter_by(id=id).first()
+    profile = await db.scalar(select(models.InstrumentProfile).filter_by(id=id))
     if not profile:
         raise HTTPException(
             status_code=404,
             detail=f"No profile found with id: {id}",
         )
-    db.delete(profile)
-    db.commit()
+    await db.delete(profile)
+    await db.commit()
+    lookup_cache.invalidate_profile(id)
+    command_cache.invalidate_profile(id)
 
     return Response(
         content=f"Successfully deleted profile with id: {id}", status_code=200
@@ -1,9 +1,10 @@
-from fastapi.responses import FileResponse
+import io
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
 import os
+import re
 from datetime import datetime
 import requests
 
@@ -13,15 +14,16 @@ if not os.path.exists(PDF_DIR):
 
 
 def create_pdf(
-    data: any,
+    data: list,
     name: str,
     timestamp_start: datetime = None,
     timestamp_end: datetime = None,
-) -> FileResponse:
-    # Create the PDF file path
-    pdf_file = os.path.join(PDF_DIR, f"{name}_calibration_log.pdf")
+) -> bytes:
+    # Plain (instrument_name, inspector, value, timestamp) tuples in, PDF bytes
+    # out, so this can run in a worker process and nothing is shared on disk
 
-    # Create the PDF document
+    # Create the PDF document in memory
+    pdf_file = io.BytesIO()
     doc = SimpleDocTemplate(pdf_file, pagesize=A4)
     elements = []
 
@@ -35,10 +37,8 @@ def create_pdf(
 
     # Prepare the data for the table (including column headers)
     table_data = [["Instrument Name", "Inspector", "Value", "Timestamp"]]  # Headers
-    for entry in data:
-        table_data.append(
-            [entry.instrument_name, entry.inspector, entry.value, entry.timestamp]
-        )
+    for instrument_name, inspector, value, timestamp in data:
+        table_data.append([instrument_name, inspector, value, timestamp])
 
     # Create the table with the data
     table = Table(table_data)
@@ -61,10 +61,7 @@ def create_pdf(
     # Build the PDF
     doc.build(elements)
 
-    # Return the generated PDF as a file response
-    return FileResponse(
-        path=pdf_file, filename=os.path.basename(pdf_file), media_type="application/pdf"
-    )
+    return pdf_file.getvalue()
 
 
 def convert_dict_to_commands_string(commands: dict):
@@ -86,3 +83,19 @@ def convert_commands_string_to_dict(commands: str):
         com, description = command.split(":")
         new_dict[com] = description
     return new_dict
+
+
+# sign, number (optionally with exponent) and an optional unit, e.g. "+ 12.345 g"
+MEASUREMENT_PATTERN = re.compile(
+    r"^\s*([+-]?)\s*(\d+(?:\.\d*)?|\.\d+)(?:[eE]([+-]?\d+))?\s*([^\s\d+-]\S{0,15})?\s*$"
+)
+
+
+def parse_measurement(data: str):
+    "Splits a raw reading into (value, unit), (None, None) for status/error text"
+    match = MEASUREMENT_PATTERN.match(data)
+    if not match:
+        return None, None
+    sign, number, exponent, unit = match.groups()
+    value = float(f"{sign}{number}" + (f"e{exponent}" if exponent else ""))
+    return value, unit
@@ -0,0 +1,237 @@
+# edge_agent.py (runs several instrument drivers in one process)
+import asyncio
+import importlib.util
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from collections import deque
+
+import websockets
+
+from evdev_driver import EvdevDriver
+from gateway_protocol import ACK, COMMAND, OPEN, READINGS, STATUS, decode, encode
+from outbox import Outbox
+from port_discovery import PortDiscovery
+from serial_driver import SerialDriver
+
+
+AGENT_CONFIG = os.getenv("AGENT_CONFIG", "agent.json")
+AGENT_BATCH_SIZE = int(os.getenv("AGENT_BATCH_SIZE", "100"))  # readings per frame
+# Extra time to collect readings for a frame, 0 sends what is queued right away
+AGENT_BATCH_LINGER = float(os.getenv("AGENT_BATCH_LINGER", "0"))  # seconds
+# READINGS frames sent before waiting for the hub's ACKs, bounds a replay
+AGENT_WINDOW = int(os.getenv("AGENT_WINDOW", "4"))
+AGENT_STATUS_LED = os.getenv("AGENT_STATUS_LED", "1") == "1"
+RECONNECT_INTERVAL = 5  # seconds, grows with every failed attempt
+MAX_RECONNECT_INTERVAL = 300
+
+LED_COMMAND = re.compile(r"find_my_instrument_(red|green)_(\d+(\.\d+)?)_(\d+)")
+
+
+def load_driver(path: str):
+    "Imports a driver.py and returns an instance of the driver class it defines"
+    name = "driver_" + re.sub(r"\W", "_", os.path.dirname(os.path.abspath(path)))
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for value in vars(module).values():
+        if (
+            isinstance(value, type)
+            and issubclass(value, (SerialDriver, EvdevDriver))
+            and value.__module__ == name
+        ):
+            return value()
+    raise ValueError(f"{path} does not define a driver class")
+
+
+class StatusLed:
+    "status_led.py's controller in this process, shared by all instruments"
+
+    def __init__(self, enabled: bool = AGENT_STATUS_LED):
+        self.enabled = enabled
+        self.controller = None
+
+    def start(self):
+        if self.enabled:
+            # imported here, gpiozero is only needed when there is an LED
+            from status_led import LEDController
+
+            self.controller = LEDController()
+            self.controller.start()
+
+    def write(self, command: str):
+        if self.controller:
+            self.controller.command(command)
+
+
+class EdgeAgent:
+    """Runs the drivers of all instruments on this device in one event loop.
+
+    Serial ports and input devices are multiplexed by the loop, and the
+    readings of all instruments share one websocket to the hub's gateway
+    endpoint. Each instrument is a numbered channel on it (OPEN binds the
+    number to the instrument id), and the readings queued while a frame was
+    being sent go out together in the next READINGS frame (see
+    gateway_protocol.py).
+
+    Readings go through the outbox, connected or not, and leave it once the
+    hub acknowledged that it stored them. After a reconnect everything still
+    in there is sent again, oldest first.
+    """
+
+    def __init__(self, config: dict):
+        self.url = config["hub_gateway_url"]
+        # channel number -> (instrument id, driver)
+        self.channels = {}
+        for channel, instrument in enumerate(config["instruments"]):
+            driver = load_driver(instrument["driver"])
+            if isinstance(driver, SerialDriver):
+                driver.discovery = PortDiscovery(
+                    driver, name=instrument["id"], port=instrument.get("port")
+                )
+            self.channels[channel] = (uuid.UUID(instrument["id"]), driver)
+        self.channel_numbers = {
+            str(instrument_id): channel
+            for channel, (instrument_id, _) in self.channels.items()
+        }
+        self.online = set()
+        self.outbox = Outbox()
+        self.outbox.keep_only(list(self.channel_numbers))
+        # encoded control frames, they go out before any readings
+        self.control = deque()
+        self.wakeup = asyncio.Event()
+        self.websocket = None
+        self.led = StatusLed()
+        self.sent = 0  # highest seq sent on this connection
+        self.in_flight = 0  # READINGS frames waiting for their ACK
+
+    def send_control(self, message: list):
+        self.control.append(encode(message))
+        self.wakeup.set()
+
+    def emitter(self, channel: int):
+        instrument = str(self.channels[channel][0])
+
+        def emit(reading, captured_at: float):
+            self.outbox.append(instrument, captured_at, str(reading))
+            if self.websocket is None:
+                # kept for later, red still tells the operator it did not arrive
+                self.led.write("red_0.5_2")
+                return
+            self.wakeup.set()
+            self.led.write("green_0.2_1")
+
+        return emit
+
+    def status_setter(self, channel: int):
+        def set_online(online: bool):
+            if online:
+                self.online.add(channel)
+            else:
+                self.online.discard(channel)
+            if self.websocket is not None:
+                self.send_control([STATUS, channel, online])
+
+        return set_online
+
+    def open_message(self, channel: int) -> list:
+        instrument_id = self.channels[channel][0]
+        return [OPEN, channel, instrument_id.bytes, channel in self.online]
+
+    def on_message(self, frame: bytes):
+        message = decode(frame)
+        if message[0] == ACK:
+            self.outbox.acknowledge(message[1])
+            self.in_flight -= 1
+            self.wakeup.set()
+        elif message[0] == COMMAND:
+            _, channel, command = message
+            match = LED_COMMAND.match(command)
+            if match:
+                color, duration, _, count = match.groups()
+                self.led.write(f"find_{color}_{duration}_{count}")
+            elif channel in self.channels:
+                self.channels[channel][1].send_command(command)
+
+    def next_frame(self) -> bytes:
+        "Takes the next control frame or a batch of unsent readings, None if idle"
+        if self.control:
+            return self.control.popleft()
+        if self.in_flight >= AGENT_WINDOW:
+            return None
+        rows = self.outbox.pending(self.sent, AGENT_BATCH_SIZE)
+        if not rows:
+            return None
+        self.sent = rows[-1][0]
+        self.in_flight += 1
+        readings = [
+            [self.channel_numbers[instrument], seq, captured_at, data]
+            for seq, instrument, captured_at, data in rows
+        ]
+        return encode([READINGS, readings, time.time()])
+
+    async def sender(self, websocket):
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                if AGENT_BATCH_LINGER:
+                    await asyncio.sleep(AGENT_BATCH_LINGER)
+                continue
+            await websocket.send(frame)
+
+    async def connect(self):
+        attempts = 0
+        while True:
+            try:
+                async with websockets.connect(self.url) as websocket:
+                    attempts = 0
+                    # unacknowledged readings of the last connection go again
+                    self.control.clear()
+                    self.sent = 0
+                    self.in_flight = 0
+                    self.websocket = websocket
+                    self.led.write("standby_on")
+                    print(f"Connected to server, {len(self.outbox)} readings to send")
+                    for channel in self.channels:
+                        self.send_control(self.open_message(channel))
+                    sender = asyncio.create_task(self.sender(websocket))
+                    try:
+                        async for message in websocket:
+                            self.on_message(message)
+                    finally:
+                        sender.cancel()
+                        self.websocket = None
+            except (OSError, websockets.WebSocketException) as e:
+                print(f"WebSocket connection closed: {e}")
+            self.led.write("standby_off")
+            attempts += 1
+            await asyncio.sleep(
+                min(RECONNECT_INTERVAL * attempts, MAX_RECONNECT_INTERVAL)
+            )
+
+    async def run(self):
+        self.led.start()
+        tasks = [
+            driver.run_async(self.emitter(channel), self.status_setter(channel))
+            for channel, (_, driver) in self.channels.items()
+        ]
+        await asyncio.gather(self.connect(), *tasks)
+
+
+def main():
+    try:
+        with open(AGENT_CONFIG) as config_file:
+            config = json.load(config_file)
+    except (OSError, ValueError) as e:
+        print(f"Error reading config file: {e}", file=sys.stderr)
+        sys.exit(1)
+    asyncio.run(EdgeAgent(config).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# evdev_driver.py (shared core of instruments that type their readings as a USB keyboard)
+import asyncio
+import os
+import sys
+import time
+
+import evdev
+
+
+RECONNECT_INTERVAL = 0.5  # seconds
+# Prefix every line on stdout with the capture time (main.js sets it)
+DRIVER_TIMESTAMPS = os.getenv("DRIVER_TIMESTAMPS") == "1"
+
+# Mapping from key codes to corresponding numbers
+KEY_MAPPING = {
+    "KEY_KP1": "1",
+    "KEY_KP2": "2",
+    "KEY_KP3": "3",
+    "KEY_KP4": "4",
+    "KEY_KP5": "5",
+    "KEY_KP6": "6",
+    "KEY_KP7": "7",
+    "KEY_KP8": "8",
+    "KEY_KP9": "9",
+    "KEY_KP0": "0",
+    "KEY_KPDOT": ".",
+    "KEY_ENTER": "",
+    "KEY_NUMLOCK": "",
+}
+
+
+class EvdevDriver:
+    """Driver for instruments that show up as a keyboard (e.g. Mitutoyo USB-ITN).
+
+    Key presses are collected until ENTER and the digits typed so far are
+    one reading, captured when ENTER was pressed (the kernel's event time).
+    The device stays open between readings and is reopened when it was
+    unplugged.
+    """
+
+    device_path = None  # /dev/input/by-id/... of the instrument
+    key_mapping = KEY_MAPPING
+
+    def __init__(self):
+        self.current_input = ""
+
+    def on_event(self, event):
+        "Returns the finished reading on ENTER, None otherwise"
+        if event.type != evdev.ecodes.EV_KEY:
+            return None
+        key_event = evdev.categorize(event)
+        if key_event.keystate != evdev.KeyEvent.key_down:
+            return None
+        keycode = key_event.keycode
+        if keycode not in self.key_mapping:
+            return None
+        if keycode == "KEY_ENTER":
+            reading, self.current_input = self.current_input, ""
+            return reading or None
+        self.current_input += self.key_mapping[keycode]
+        return None
+
+    def try_open(self, reported: bool) -> evdev.InputDevice:
+        try:
+            return evdev.InputDevice(self.device_path)
+        except OSError as e:
+            if not reported:
+                print(f"Error: {self.device_path}: {e}", file=sys.stderr)
+            return None
+
+    def open(self) -> evdev.InputDevice:
+        device = self.try_open(reported=False)
+        while device is None:
+            time.sleep(RECONNECT_INTERVAL)
+            device = self.try_open(reported=True)
+        return device
+
+    def send_command(self, command: str):
+        # keyboard style instruments cannot receive anything
+        pass
+
+    def emit(self, reading: str, captured_at: float):
+        line = f"{reading}\n"
+        if DRIVER_TIMESTAMPS:
+            line = f"{captured_at:.6f}\t{line}"
+        sys.stdout.write(line)
+        sys.stdout.flush()  # Make sure data is sent immediately to stdout
+
+    def run(self):
+        while True:
+            device = self.open()
+            try:
+                for event in device.read_loop():
+                    reading = self.on_event(event)
+                    if reading is not None:
+                        self.emit(reading, event.timestamp())
+            except OSError as e:
+                print(f"Error: device lost: {e}", file=sys.stderr)
+            finally:
+                device.close()
+            self.current_input = ""
+
+    async def run_async(self, emit, set_online):
+        "Edge agent entry point, see SerialDriver.run_async"
+        while True:
+            device = self.try_open(reported=False)
+            while device is None:
+                await asyncio.sleep(RECONNECT_INTERVAL)
+                device = self.try_open(reported=True)
+            set_online(True)
+            try:
+                async for event in device.async_read_loop():
+                    reading = self.on_event(event)
+                    if reading is not None:
+                        emit(reading, event.timestamp())
+            except OSError as e:
+                print(f"Error: device lost: {e}", file=sys.stderr)
+            finally:
+                device.close()
+                set_online(False)
+            self.current_input = ""
@@ -0,0 +1,131 @@
+# framing.py (stream reassembly and reading parsers for serial drivers)
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+
+# Reading status codes
+OK = "ok"
+OVERLOAD = "overload"
+UNDERLOAD = "underload"
+CALIBRATION = "calibration"
+ERROR = "error"
+UNKNOWN = "unknown"
+
+STATUS_TEXT = {
+    OVERLOAD: "Status: Overload",
+    UNDERLOAD: "Status: Underload",
+    CALIBRATION: "Status: Calibration/Adjustment",
+    UNKNOWN: "Error: Unknown data format received",
+}
+
+# optional sign, number, optional unit, anywhere at the end of the frame
+NUMBER_PATTERN = re.compile(
+    r"([+-]?)\s*(\d+(?:\.\d*)?|\.\d+)\s*([A-Za-z%/]{1,8})?\s*$"
+)
+ERROR_CODE_PATTERN = re.compile(r"E\D*(\d+)")
+
+
+@dataclass
+class Reading:
+    value: Optional[float]
+    unit: str = ""
+    status: str = OK
+    code: str = ""  # instrument error code, if any
+    text: str = ""  # number as printed by the instrument, raw frame if UNKNOWN
+
+    def __str__(self):
+        "Line sent to the hub"
+        if self.status == OK:
+            return f"{self.text} {self.unit}".strip()
+        if self.status == UNKNOWN and self.text:
+            return self.text
+        if self.status == ERROR:
+            return f"Error Code: {self.code}"
+        return STATUS_TEXT[self.status]
+
+
+class FrameBuffer:
+    """Reassembles frames from the chunks a serial port hands out.
+
+    Frames end with CR, LF or CR LF. With `frame_length` set, a frame must
+    also have exactly that many bytes (terminator excluded); anything else is
+    line noise or a partial frame and is dropped, so a single corrupt byte
+    costs one reading instead of shifting every reading after it. Bytes
+    without a terminator beyond `max_size` are dropped as well.
+    """
+
+    def __init__(self, frame_length: int = None, max_size: int = 4096):
+        self.frame_length = frame_length
+        self.max_size = max_size
+        self.buffer = bytearray()
+        self.frames = 0
+        self.dropped_bytes = 0
+
+    def feed(self, data: bytes) -> List[bytes]:
+        self.buffer += data
+        frames = []
+        start = 0
+        buffer = self.buffer
+        end = len(buffer)
+        while start < end:
+            cr = buffer.find(b"\r", start)
+            lf = buffer.find(b"\n", start)
+            stop = min(cr, lf) if cr >= 0 and lf >= 0 else max(cr, lf)
+            if stop < 0:
+                break
+            if stop > start:
+                frame = bytes(buffer[start:stop])
+                if self.frame_length is None or len(frame) == self.frame_length:
+                    frames.append(frame)
+                else:
+                    self.dropped_bytes += len(frame)
+            start = stop + 1
+        del buffer[:start]
+        if len(buffer) > self.max_size:
+            # no terminator in sight, wait for the next one
+            self.dropped_bytes += len(buffer)
+            buffer.clear()
+        self.frames += len(frames)
+        return frames
+
+
+def number_reading(frame: bytes) -> Optional[Reading]:
+    "Trailing number and unit of a text frame, passed on as is if there is none"
+    text = frame.decode("ascii", errors="ignore").strip()
+    match = NUMBER_PATTERN.search(text)
+    if not match:
+        return Reading(None, status=UNKNOWN, text=text) if text else None
+    sign, number, unit = match.groups()
+    return Reading(float(sign + number), unit or "", text=sign + number)
+
+
+def text_reading(frame: bytes) -> Optional[Reading]:
+    "The whole text frame, for formats nobody wrote a parser for yet"
+    text = frame.decode("ascii", errors="ignore").strip()
+    return Reading(None, text=text) if text else None
+
+
+def sbi_reading(frame: bytes) -> Reading:
+    """Sartorius SBI print frame, e.g. b"+   12.345 g  ".
+
+    Weights start with the sign; status frames carry a letter instead
+    (H overload, L underload, C calibration, E plus an error code).
+    """
+    text = frame.decode("ascii", errors="ignore").strip()
+    if not text:
+        return Reading(None, status=UNKNOWN)
+    if text[0] in "+-" or text[0].isdigit():
+        reading = number_reading(frame)
+        if reading and reading.status == OK:
+            return reading
+    if "H" in text:
+        return Reading(None, status=OVERLOAD)
+    if "L" in text:
+        return Reading(None, status=UNDERLOAD)
+    if "C" in text:
+        return Reading(None, status=CALIBRATION)
+    if "E" in text:
+        code = ERROR_CODE_PATTERN.search(text)
+        return Reading(None, status=ERROR, code=code.group(1) if code else "")
+    return Reading(None, status=UNKNOWN)
@@ -0,0 +1,23 @@
+# gateway_protocol.py (frames exchanged with the hub's /data_routing/ws/gateway)
+import msgpack
+
+
+# Message types, every frame is one msgpack array. hub/src/gateway.py is the
+# hub side of the same protocol.
+# edge -> hub
+OPEN = 0  # [OPEN, channel, instrument id (16 bytes), online]
+STATUS = 1  # [STATUS, channel, online]
+READINGS = 2  # [READINGS, [[channel, seq, captured_at, data], ...], sent_at]
+# hub -> edge
+ACK = 3  # [ACK, seq], all readings up to seq are stored
+COMMAND = 4  # [COMMAND, channel, data]
+# seq is given by outbox.py, captured_at (stamped by the driver) and sent_at
+# are device clock times in seconds since the epoch
+
+
+def encode(message: list) -> bytes:
+    return msgpack.packb(message, use_bin_type=True)
+
+
+def decode(frame: bytes) -> list:
+    return msgpack.unpackb(frame, raw=False)
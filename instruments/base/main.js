@@ -1,6 +1,7 @@
 const WebSocket = require("ws");
 const { spawn } = require("child_process");
 const fs = require("fs");
+const { Database } = require("bun:sqlite");
 
 let config;
 try {
@@ -12,15 +13,94 @@ try {
 }
 
 const wsUrl = config.hub_ws_url + config.id;
-const driverProcess = spawn(config.driver_runtime_path, [
-  config.driver_filename,
-]);
+// DRIVER_TIMESTAMPS makes the driver prefix each reading with its capture time
+const driverProcess = spawn(
+  config.driver_runtime_path,
+  [config.driver_filename],
+  { env: { ...process.env, DRIVER_TIMESTAMPS: "1" } }
+);
 const ledProcess = spawn("venv/bin/python", ["status_led.py"]);
 var ws;
 var connected = false;
 var reconnectInterval = 5000; // Reconnect every 5 seconds if disconnected
 var reconnectAttempts = 0;
-var maxReconnectAttempts = 10; // Limit to prevent excessive reconnections
+var maxReconnectInterval = 300000; // Backoff stops growing at 5 minutes
+
+// Readings wait in the outbox (SQLite, WAL journal) until the hub acknowledged
+// that it stored them, so nothing is lost while the hub is unreachable. After a
+// reconnect everything still in there is sent again, oldest first. Sequence
+// numbers only grow, a new outbox starts at the current time in microseconds,
+// and the hub skips readings with a number it already stored.
+const outboxMaxRows = config.outbox_max_rows || 500000; // oldest are dropped
+const outboxMaxBytes = (config.outbox_max_mb || 100) * 1024 * 1024; // same
+const sizeCheckInterval = 1000; // appends between file size checks
+const batchSize = 100; // readings per message
+const sendWindow = 4; // messages sent before waiting for their ACKs
+const outbox = new Database(config.outbox_path || "outbox.db");
+outbox.exec("PRAGMA journal_mode=WAL");
+outbox.exec("PRAGMA synchronous=NORMAL");
+outbox.exec(
+  "CREATE TABLE IF NOT EXISTS readings (" +
+    "seq INTEGER PRIMARY KEY AUTOINCREMENT, " +
+    "captured_at REAL NOT NULL, " +
+    "data TEXT NOT NULL)"
+);
+if (outbox.query("SELECT count(*) AS n FROM sqlite_sequence").get().n === 0) {
+  outbox
+    .query("INSERT INTO sqlite_sequence (name, seq) VALUES ('readings', ?)")
+    .run(Date.now() * 1000);
+}
+const appendReading = outbox.query(
+  "INSERT INTO readings (captured_at, data) VALUES (?, ?)"
+);
+const pendingReadings = outbox.query(
+  "SELECT seq, captured_at, data FROM readings WHERE seq > ? ORDER BY seq LIMIT ?"
+);
+const acknowledgeReadings = outbox.query("DELETE FROM readings WHERE seq <= ?");
+const dropOldestReadings = outbox.query(
+  "DELETE FROM readings WHERE seq IN (SELECT seq FROM readings ORDER BY seq LIMIT ?)"
+);
+const countReadings = outbox.query("SELECT count(*) AS n FROM readings");
+const pageCount = outbox.query("PRAGMA page_count");
+const freePages = outbox.query("PRAGMA freelist_count");
+const pageSize = outbox.query("PRAGMA page_size");
+var outboxRows = countReadings.get().n;
+var appendedSinceCheck = 0;
+var sentSeq = 0; // highest seq sent on this connection
+var inFlight = 0; // messages waiting for their ACK
+
+// Bytes in use, deleted rows leave free pages that new rows reuse
+function outboxBytes() {
+  appendedSinceCheck = 0;
+  const pages = pageCount.values()[0][0] - freePages.values()[0][0];
+  return pages * pageSize.values()[0][0];
+}
+
+function storeReading(reading, capturedAt) {
+  appendReading.run(capturedAt, reading);
+  outboxRows++;
+  appendedSinceCheck++;
+  if (
+    outboxRows > outboxMaxRows ||
+    (appendedSinceCheck >= sizeCheckInterval && outboxBytes() > outboxMaxBytes)
+  ) {
+    dropOldestReadings.run(Math.ceil(outboxMaxRows / 100));
+    const dropped = outboxRows - countReadings.get().n;
+    outboxRows -= dropped;
+    console.log(`Outbox full, dropped the ${dropped} oldest readings`);
+  }
+}
+
+function sendPending() {
+  while (connected && inFlight < sendWindow) {
+    const rows = pendingReadings.values(sentSeq, batchSize);
+    if (rows.length === 0) return;
+    sentSeq = rows[rows.length - 1][0];
+    inFlight++;
+    // sent_at lets the hub estimate the offset of this device's clock
+    ws.send(JSON.stringify({ readings: rows, sent_at: Date.now() / 1000 }));
+  }
+}
 
 // Function to initialize the WebSocket connection
 function connectWebSocket() {
@@ -35,14 +115,22 @@ function connectWebSocket() {
   ws.on("message", (message) => {
     console.log(`Received message from server: ${message}`);
     let string_message = message.toString();
-    if (
+    if (string_message.startsWith('{"ack"')) {
+      // the hub stored everything up to this sequence number
+      const ack = JSON.parse(string_message).ack;
+      acknowledgeReadings.run(ack);
+      outboxRows = countReadings.get().n;
+      inFlight--;
+      sendPending();
+    } else if (
       string_message.match(/find_my_instrument_(red|green)_(\d+(\.\d+)?)_(\d+)/)
     ) {
       let message_data = string_message.split("_");
       let color = message_data[3];
       let duration = message_data[4];
       let count = message_data[5];
-      let led_command = `${color}_${duration}_${count}\n`;
+      // find_ blinks go before any queued data blinks, see status_led.py
+      let led_command = `find_${color}_${duration}_${count}\n`;
       console.log("led execute: " + led_command);
       ledProcess.stdin.write(led_command);
     } else if (string_message != "hi") {
@@ -56,7 +144,11 @@ function connectWebSocket() {
     connected = true;
     reconnectAttempts = 0; // Reset on successful connection
     ledProcess.stdin.write("standby_on\n");
-    console.log("Connected to server");
+    console.log(`Connected to server, ${outboxRows} readings to send`);
+    // unacknowledged readings of the last connection go again
+    sentSeq = 0;
+    inFlight = 0;
+    sendPending();
   });
 
   ws.on("close", async () => {
@@ -71,19 +163,16 @@ function connectWebSocket() {
 async function reconnect() {
   if (connected) return;
 
-  let backoffTime;
-  if (reconnectAttempts >= maxReconnectAttempts) {
-    console.log("Max reconnection attempts reached. Reconnecting every hour.");
-    backoffTime = 3600000; // 1 hour
-  } else {
-    reconnectAttempts++;
-    backoffTime = reconnectInterval * reconnectAttempts;
-    console.log(
-      `Attempting to reconnect (#${reconnectAttempts}) in ${
-        backoffTime / 1000
-      } seconds...`
-    );
-  }
+  reconnectAttempts++;
+  const backoffTime = Math.min(
+    reconnectInterval * reconnectAttempts,
+    maxReconnectInterval
+  );
+  console.log(
+    `Attempting to reconnect (#${reconnectAttempts}) in ${
+      backoffTime / 1000
+    } seconds...`
+  );
 
   await Bun.sleep(backoffTime);
 
@@ -98,17 +187,30 @@ async function reconnect() {
 // Initial connection
 connectWebSocket();
 
-// Listen for data from the Driver process
+// Listen for data from the Driver process. The driver writes one reading per
+// line, a chunk can hold several readings or only part of one.
+var driverOutput = "";
 driverProcess.stdout.on("data", (data) => {
-  console.log(`Received data from Driver: ${data}`);
-  const payload = `{"data" : "${data}" }`;
-
-  // Send data to the server if connected
-  if (connected) {
-    ws.send(payload);
-    ledProcess.stdin.write("green_0.2_1\n");
-  } else {
-    ledProcess.stdin.write("red_0.5_2\n");
+  driverOutput += data.toString();
+  const lines = driverOutput.split("\n");
+  driverOutput = lines.pop(); // keep the unfinished line for the next chunk
+
+  for (const line of lines) {
+    // "<capture time>\t<reading>", drivers without timestamps send the reading only
+    const stamped = line.match(/^(\d+\.\d+)\t(.*)$/);
+    const capturedAt = stamped ? parseFloat(stamped[1]) : Date.now() / 1000;
+    const reading = (stamped ? stamped[2] : line).trim();
+    if (!reading) continue;
+    console.log(`Received data from Driver: ${reading}`);
+    storeReading(reading, capturedAt);
+
+    // Send data to the server if connected, otherwise it waits in the outbox
+    if (connected) {
+      sendPending();
+      ledProcess.stdin.write("green_0.2_1\n");
+    } else {
+      ledProcess.stdin.write("red_0.5_2\n");
+    }
   }
 });
 
@@ -0,0 +1,116 @@
+# outbox.py (readings kept on the device until the hub has stored them)
+import os
+import sqlite3
+import time
+
+
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.db")
+# Oldest readings are dropped beyond this, ~100 bytes each on disk
+OUTBOX_MAX_ROWS = int(os.getenv("OUTBOX_MAX_ROWS", "500000"))
+OUTBOX_MAX_MB = float(os.getenv("OUTBOX_MAX_MB", "100"))
+TRIM_FRACTION = 0.01  # of max_rows dropped at once when a cap is hit
+SIZE_CHECK_INTERVAL = 1000  # appends between file size checks
+
+
+class Outbox:
+    """Durable queue of readings in a SQLite database (WAL journal).
+
+    Every reading gets a sequence number when it is appended. Numbers only
+    grow, also across restarts and when the database file was deleted: a
+    new database starts counting at the current time in microseconds. The
+    hub uses them to recognize readings it already stored, so anything not
+    acknowledged yet can simply be sent again after a reconnect.
+    """
+
+    def __init__(
+        self,
+        path: str = OUTBOX_PATH,
+        max_rows: int = OUTBOX_MAX_ROWS,
+        max_mb: float = OUTBOX_MAX_MB,
+    ):
+        self.path = path
+        self.max_rows = max_rows
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # WAL with NORMAL survives a crash of the process, a power cut can
+        # lose the last moments but never corrupts the file
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS readings ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "instrument TEXT NOT NULL, "
+            "captured_at REAL NOT NULL, "
+            "data TEXT NOT NULL)"
+        )
+        if self.db.execute("SELECT count(*) FROM sqlite_sequence").fetchone()[0] == 0:
+            self.db.execute(
+                "INSERT INTO sqlite_sequence (name, seq) VALUES ('readings', ?)",
+                (int(time.time() * 1_000_000),),
+            )
+        self.rows = self.db.execute("SELECT count(*) FROM readings").fetchone()[0]
+        self.appended_since_check = 0
+        self.dropped = 0
+
+    def append(self, instrument: str, captured_at: float, data: str) -> int:
+        seq = self.db.execute(
+            "INSERT INTO readings (instrument, captured_at, data) VALUES (?, ?, ?)",
+            (instrument, captured_at, data),
+        ).lastrowid
+        self.rows += 1
+        self.appended_since_check += 1
+        if self.rows > self.max_rows or (
+            self.appended_since_check >= SIZE_CHECK_INTERVAL
+            and self.size() > self.max_bytes
+        ):
+            self.trim()
+        return seq
+
+    def pending(self, after: int, limit: int) -> list:
+        "Returns up to `limit` (seq, instrument, captured_at, data) rows after `after`"
+        return self.db.execute(
+            "SELECT seq, instrument, captured_at, data FROM readings "
+            "WHERE seq > ? ORDER BY seq LIMIT ?",
+            (after, limit),
+        ).fetchall()
+
+    def acknowledge(self, seq: int):
+        "Deletes everything up to and including `seq`, the hub has it"
+        self.rows -= self.db.execute(
+            "DELETE FROM readings WHERE seq <= ?", (seq,)
+        ).rowcount
+
+    def keep_only(self, instruments: list):
+        "Deletes the readings of instruments that are no longer configured"
+        marks = ", ".join("?" * len(instruments))
+        removed = self.db.execute(
+            f"DELETE FROM readings WHERE instrument NOT IN ({marks})", instruments
+        ).rowcount
+        self.rows -= removed
+        if removed:
+            print(f"Outbox: dropped {removed} readings of removed instruments")
+
+    def size(self) -> int:
+        "Bytes in use, deleted rows leave free pages that new rows reuse"
+        self.appended_since_check = 0
+        pages = self.db.execute("PRAGMA page_count").fetchone()[0]
+        free = self.db.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free) * self.db.execute("PRAGMA page_size").fetchone()[0]
+
+    def trim(self):
+        "Drops the oldest readings to stay within the caps"
+        count = max(1, int(self.max_rows * TRIM_FRACTION))
+        dropped = self.db.execute(
+            "DELETE FROM readings WHERE seq IN "
+            "(SELECT seq FROM readings ORDER BY seq LIMIT ?)",
+            (count,),
+        ).rowcount
+        self.rows -= dropped
+        self.dropped += dropped
+        print(f"Outbox full, dropped the {dropped} oldest readings")
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,208 @@
+# port_discovery.py (finds the serial port an instrument is attached to)
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+from serial.tools import list_ports
+
+from framing import UNKNOWN, FrameBuffer
+
+
+PORT_CACHE = os.getenv("PORT_CACHE", "port_cache.json")
+HANDSHAKE_TIMEOUT = float(os.getenv("HANDSHAKE_TIMEOUT", "1.5"))  # seconds
+RECONNECT_INTERVAL = float(os.getenv("RECONNECT_INTERVAL", "0.5"))  # seconds
+SERIAL_DEVICE_PREFIXES = ("/dev/ttyUSB", "/dev/ttyACM")
+
+
+def fingerprint(port) -> dict:
+    "What identifies the adapter, independent of the /dev name it got"
+    return {
+        "device": port.device,
+        "vid": port.vid,
+        "pid": port.pid,
+        "serial_number": port.serial_number,
+        "location": port.location,
+    }
+
+
+def same_adapter(port, cached: dict) -> bool:
+    if port.vid is None or (port.vid, port.pid) != (cached["vid"], cached["pid"]):
+        return False
+    # adapters without a serial number are told apart by the USB socket
+    if port.serial_number or cached["serial_number"]:
+        return port.serial_number == cached["serial_number"]
+    return port.location == cached["location"]
+
+
+def load_cache(path: str = PORT_CACHE) -> dict:
+    try:
+        with open(path) as cache:
+            return json.load(cache)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache: dict, path: str = PORT_CACHE):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as tmp:
+        json.dump(cache, tmp, indent=2)
+    os.replace(tmp_path, path)
+
+
+class PortDiscovery:
+    """Finds and opens the port of one driver.
+
+    The adapter that worked last time is looked up first by its USB
+    fingerprint, so a restart or a replug (which may renumber the
+    /dev/ttyUSB* names) reopens it straight away. Otherwise all candidate
+    ports are probed in parallel: they must match the driver's USB ids, if
+    it has any, and answer its handshake, if it has one. Ports are opened
+    exclusively, so a port held by another driver is skipped instead of
+    shared.
+
+    A driver with none of these cannot tell its instrument from another
+    one. It takes the first free port that opens, skipping adapters other
+    drivers recognized, and never caches it.
+    """
+
+    def __init__(
+        self, driver, name: str = None, port: str = None, cache_path: str = PORT_CACHE
+    ):
+        self.driver = driver
+        # cache key, the edge agent uses the instrument id
+        self.name = name or type(driver).__name__
+        self.port = port
+        self.cache_path = cache_path
+
+    def candidates(self):
+        ports = [
+            port
+            for port in list_ports.comports()
+            if port.device.startswith(SERIAL_DEVICE_PREFIXES) or port.vid
+        ]
+        if self.driver.usb_ids:
+            ports = [p for p in ports if (p.vid, p.pid) in self.driver.usb_ids]
+        if self.driver.usb_serial:
+            ports = [p for p in ports if p.serial_number == self.driver.usb_serial]
+        return sorted(ports, key=lambda port: port.device)
+
+    def identified(self) -> bool:
+        "Whether a port that opens is known to be this driver's instrument"
+        driver = self.driver
+        return bool(driver.usb_ids or driver.usb_serial or driver.handshake)
+
+    def find(self) -> serial.Serial:
+        "Returns the opened port, None if no port matches right now"
+        # SERIAL_PORT pins the port, e.g. for tests against a pseudo terminal
+        pinned = self.port or os.getenv("SERIAL_PORT")
+        if pinned:
+            return self.try_open(pinned, handshake=False)
+
+        ports = self.candidates()
+        cache = load_cache(self.cache_path)
+        cached = cache.get(self.name)
+        if cached and self.identified():
+            for port in ports:
+                if same_adapter(port, cached):
+                    ser = self.try_open(port.device, handshake=False)
+                    if ser:
+                        self.remember(port)
+                        return ser
+        if not self.identified():
+            # without anything to recognize the instrument by, at least leave
+            # the adapters other drivers have recognized alone
+            others = [entry for name, entry in cache.items() if name != self.name]
+            ports = [
+                port
+                for port in ports
+                if not any(same_adapter(port, entry) for entry in others)
+            ]
+
+        if not ports:
+            return None
+        with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+            opened = list(pool.map(self.try_open, [port.device for port in ports]))
+        found = None
+        for port, ser in zip(ports, opened):
+            if ser and not found:
+                found = ser
+                # only an adapter the instrument was recognized on is remembered
+                if self.identified():
+                    self.remember(port)
+            elif ser:
+                ser.close()
+        if found and not self.identified() and sum(map(bool, opened)) > 1:
+            print(
+                f"Warning: {self.name} took {found.port} of several free ports, "
+                "set usb_ids, usb_serial or a handshake on the driver, or pin "
+                "the port (SERIAL_PORT, `port` in agent.json)",
+                file=sys.stderr,
+            )
+        return found
+
+    def wait(self) -> serial.Serial:
+        "Blocks until the port is available again"
+        reported = False
+        while True:
+            ser = self.find()
+            if ser:
+                return ser
+            if not reported:
+                print(f"Error: no serial port found for {self.name}", file=sys.stderr)
+                reported = True
+            time.sleep(RECONNECT_INTERVAL)
+
+    async def wait_async(self) -> serial.Serial:
+        "wait() for the edge agent, probing runs in a thread"
+        reported = False
+        while True:
+            ser = await asyncio.to_thread(self.find)
+            if ser:
+                return ser
+            if not reported:
+                print(f"Error: no serial port found for {self.name}", file=sys.stderr)
+                reported = True
+            await asyncio.sleep(RECONNECT_INTERVAL)
+
+    def try_open(self, device: str, handshake: bool = True):
+        try:
+            ser = self.driver.open(device)
+        except (serial.SerialException, OSError):
+            return None
+        if handshake and self.driver.handshake and not self.answers(ser):
+            ser.close()
+            return None
+        return ser
+
+    def answers(self, ser) -> bool:
+        "Sends the handshake command and waits for one frame the driver understands"
+        frames = FrameBuffer(self.driver.frame_length)
+        ser.timeout = 0.1
+        try:
+            ser.reset_input_buffer()
+            ser.write(self.driver.encode_command(self.driver.handshake))
+            deadline = time.monotonic() + HANDSHAKE_TIMEOUT
+            while time.monotonic() < deadline:
+                for frame in frames.feed(ser.read(max(1, ser.in_waiting))):
+                    reading = self.driver.parse(frame)
+                    if reading is not None and reading.status != UNKNOWN:
+                        return True
+            return False
+        except (serial.SerialException, OSError):
+            return False
+        finally:
+            ser.timeout = None
+
+    def remember(self, port):
+        cache = load_cache(self.cache_path)
+        if cache.get(self.name) == fingerprint(port):
+            return
+        cache[self.name] = fingerprint(port)
+        try:
+            save_cache(cache, self.cache_path)
+        except OSError as e:
+            print(f"Error: could not write {self.cache_path}: {e}", file=sys.stderr)
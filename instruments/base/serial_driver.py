@@ -0,0 +1,180 @@
+# serial_driver.py (shared core of the serial instrument drivers)
+import asyncio
+import os
+import sys
+import threading
+import time
+import serial
+
+from framing import FrameBuffer, text_reading
+from port_discovery import PortDiscovery
+
+
+# Prefix every line on stdout with the capture time (main.js sets it)
+DRIVER_TIMESTAMPS = os.getenv("DRIVER_TIMESTAMPS") == "1"
+
+
+class SerialDriver:
+    """Event driven serial driver.
+
+    A driver only describes its instrument: serial settings, how frames are
+    delimited, how a frame turns into a reading and how a command is
+    encoded. The core blocks on the port until a complete frame has arrived
+    and writes commands the moment they come in on stdin, so there is no
+    polling interval adding latency in either direction.
+
+    Readings go to stdout, one per line, prefixed with the device time they
+    arrived at and a tab when DRIVER_TIMESTAMPS=1 (main.js sets it). The port
+    is found by PortDiscovery and found again after the instrument was
+    unplugged.
+    """
+
+    # Identification, see PortDiscovery
+    usb_ids = ()  # (vid, pid) pairs of the USB serial adapter
+    usb_serial = None  # adapter serial number, pins one unit
+    handshake = None  # command the instrument answers with a frame
+
+    # Serial settings
+    baud_rate = 9600
+    parity = serial.PARITY_NONE
+    stopbits = serial.STOPBITS_ONE
+    bytesize = serial.EIGHTBITS
+    rtscts = True
+
+    # Framing: frames end with CR, LF or CR LF. Set frame_length for
+    # instruments with fixed size frames so broken ones are dropped.
+    frame_length = None
+
+    def parse(self, frame: bytes):
+        "Turns one frame into the Reading sent to the hub, None to skip it"
+        return text_reading(frame)  # the whole frame, the hub parses it
+
+    def encode_command(self, command: str) -> bytes:
+        return bytes([0x1B]) + command.encode() + bytes([0x0D, 0x0A])
+
+    # --- core ---
+
+    def __init__(self):
+        self.ser = None
+        self.write_lock = threading.Lock()
+        self.output_lock = threading.Lock()
+        self.frames = FrameBuffer(self.frame_length)
+        self.discovery = PortDiscovery(self)
+        # SERIAL_CAPTURE records the raw bytes, e.g. for the framing benchmark
+        self.capture = None
+        if os.getenv("SERIAL_CAPTURE"):
+            self.capture = open(os.getenv("SERIAL_CAPTURE"), "ab")
+
+    def open(self, port: str) -> serial.Serial:
+        return serial.Serial(
+            port,
+            self.baud_rate,
+            timeout=None,  # block until data arrives, no polling
+            bytesize=self.bytesize,
+            parity=self.parity,
+            stopbits=self.stopbits,
+            rtscts=self.rtscts,
+            exclusive=True,  # never share a port with another driver
+        )
+
+    def emit(self, reading, captured_at: float):
+        line = f"{reading}\n"
+        if DRIVER_TIMESTAMPS:
+            line = f"{captured_at:.6f}\t{line}"
+        with self.output_lock:
+            sys.stdout.write(line)
+            sys.stdout.flush()  # Ensure immediate output
+
+    def readings(self, data: bytes) -> list:
+        "Readings completed by the bytes just received"
+        if self.capture:
+            self.capture.write(data)
+            self.capture.flush()
+        readings = [self.parse(frame) for frame in self.frames.feed(data)]
+        return [reading for reading in readings if reading is not None]
+
+    def read_frames(self):
+        while True:
+            # blocks for the first byte, then takes whatever else has arrived
+            data = self.ser.read(max(1, self.ser.in_waiting))
+            captured_at = time.time()  # the last byte of the frame just arrived
+            for reading in self.readings(data):
+                self.emit(reading, captured_at)
+
+    def send_command(self, command: str):
+        with self.write_lock:
+            if self.ser is None:
+                print(f"Error: instrument disconnected: {command}", file=sys.stderr)
+                return
+            self.ser.write(self.encode_command(command))
+
+    def serve(self):
+        "Reads frames in a background thread and forwards stdin commands"
+        listener = threading.Thread(target=self._listen, daemon=True)
+        listener.start()
+        for line in sys.stdin:
+            command = line.strip()
+            if command == "Q":
+                break
+            if command:
+                self.send_command(command)
+
+    def _listen(self):
+        while True:
+            try:
+                self.read_frames()
+            except (serial.SerialException, OSError) as e:
+                print(f"Error: serial port lost: {e}", file=sys.stderr)
+            with self.write_lock:
+                self.ser.close()
+                self.ser = None
+            self.frames = FrameBuffer(self.frame_length)
+            ser = self.discovery.wait()
+            with self.write_lock:
+                self.ser = ser
+
+    def run(self):
+        self.ser = self.discovery.wait()
+        self.serve()
+        with self.write_lock:
+            if self.ser:
+                self.ser.close()
+
+    async def run_async(self, emit, set_online):
+        """Edge agent entry point: the same driver inside an event loop.
+
+        The port is watched with add_reader instead of a thread, emit() gets
+        every reading with its capture time and set_online() is called when
+        the port is found or lost.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            ser = await self.discovery.wait_async()
+            with self.write_lock:
+                self.ser = ser
+            set_online(True)
+            lost = loop.create_future()
+
+            def on_readable():
+                try:
+                    data = ser.read(max(1, ser.in_waiting))
+                except (serial.SerialException, OSError) as e:
+                    loop.remove_reader(ser.fileno())
+                    if not lost.done():
+                        lost.set_result(e)
+                    return
+                captured_at = time.time()
+                for reading in self.readings(data):
+                    emit(reading, captured_at)
+
+            loop.add_reader(ser.fileno(), on_readable)
+            try:
+                error = await lost
+                print(f"Error: serial port lost: {error}", file=sys.stderr)
+            finally:
+                loop.remove_reader(ser.fileno())
+                with self.write_lock:
+                    self.ser = None
+                ser.close()
+                self.frames = FrameBuffer(self.frame_length)
+                set_online(False)
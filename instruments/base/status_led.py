@@ -1,70 +1,193 @@
-# led_blink.py
+# status_led.py (status LEDs of the instrument box)
+import os
 import sys
-import time
+import threading
+from collections import deque
+from typing import NamedTuple
+
 from gpiozero import LED
 
-# Setup for GPIO pin 16
-LED_PIN_GREEN = 20
-LED_PIN_BLUE = 16
-LED_PIN_RED = 21
 
-# Create LED objects
-led_green = LED(LED_PIN_GREEN)
-led_blue = LED(LED_PIN_BLUE)
-led_red = LED(LED_PIN_RED)
+# GPIO pins of the LEDs
+LED_PINS = {"green": 20, "blue": 16, "red": 21}
+STANDBY_COLOR = "blue"
+# Blinks waiting to be shown, further data blinks replace the oldest one
+LED_QUEUE_SIZE = int(os.getenv("LED_QUEUE_SIZE", "4"))
 
-LED_MAPPER = {"green": led_green, "blue": led_blue, "red": led_red}
-standby_turned_on = False
 
+class Blink(NamedTuple):
+    color: str
+    duration: float  # seconds on, and off between two flashes
+    count: int
+    find: bool = False  # find_my_instrument request, shown before data blinks
 
-def blink_led(led, duration: float, count: int):
-    for i in range(count):
-        led.on()
-        time.sleep(duration)
-        led.off()
-        if i + 1 != count:
-            time.sleep(duration)
 
+def parse_command(command: str):
+    """Turns a line like green_0.2_1 or find_red_0.5_3 into a Blink.
 
-def standby_on():
-    global standby_turned_on
-    led_blue.on()
-    standby_turned_on = True
+    standby_on and standby_off are returned as they are, None means the
+    line was not understood.
+    """
+    if command in ("standby_on", "standby_off"):
+        return command
+    parts = command.split("_")
+    find = parts[0] == "find"
+    if find:
+        parts = parts[1:]
+    try:
+        color, duration, count = parts
+        blink = Blink(color, float(duration), int(count), find)
+    except ValueError:
+        return None
+    if color not in LED_PINS or blink.duration < 0 or blink.count < 1:
+        return None
+    return blink
 
 
-def standby_off():
-    global standby_turned_on
-    led_blue.off()
-    standby_turned_on = False
+class LEDController:
+    """Shows blinks one after the other on a timer thread.
 
+    `command` only queues and returns right away, so whoever feeds it (the
+    stdin loop below or the edge agent) is never held up by a blink. The
+    queue is short: a data blink equal to one already waiting is dropped,
+    and when the queue is full the oldest data blink makes room. A find-me
+    blink discards all waiting data blinks and cuts short the one being
+    shown. The blue standby LED is off while another LED blinks.
 
-try:
-    print("LED control started")
-    while True:
-        # Wait for input from the parent process
-        command = sys.stdin.readline().strip()
-        if command == "standby_on":
-            standby_on()
-            print("Standby is turned on")
-        elif command == "standby_off":
-            standby_off()
-            print("Standby is turned off")
+    Off the Pi, GPIOZERO_PIN_FACTORY=mock gives gpiozero fake pins.
+    """
+
+    def __init__(self, leds: dict = None, max_pending: int = LED_QUEUE_SIZE):
+        self.leds = leds or {color: LED(pin) for color, pin in LED_PINS.items()}
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.current = None
+        self.standby = False
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.interrupt = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+        # metrics
+        self.shown = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.preempted = 0
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.pending.clear()
+            self.interrupt.set()
+            self.condition.notify()
+        if self.thread.is_alive():
+            self.thread.join()
+        for led in self.leds.values():
+            led.off()
+
+    def command(self, command: str):
+        parsed = parse_command(command)
+        if parsed is None:
+            print(f"Error: unknown LED command: {command}", file=sys.stderr)
+        elif parsed == "standby_on":
+            self.set_standby(True)
+        elif parsed == "standby_off":
+            self.set_standby(False)
         else:
-            if standby_turned_on:
-                standby_off()
-                color, duration, count = command.split("_")
-                blink_led(
-                    led=LED_MAPPER[color], duration=float(duration), count=int(count)
+            self.blink(parsed)
+
+    def set_standby(self, on: bool):
+        with self.condition:
+            self.standby = on
+            if self.current is None:
+                self._show_standby()
+
+    def blink(self, blink: Blink):
+        with self.condition:
+            if blink.find:
+                self.pending = deque(
+                    waiting for waiting in self.pending if waiting.find
                 )
-                standby_on()
-            else:
-                color, duration, count = command.split("_")
-                blink_led(
-                    led=LED_MAPPER[color], duration=float(duration), count=int(count)
+                if self.current is not None and not self.current.find:
+                    self.preempted += 1
+                    self.interrupt.set()
+            if blink in self.pending:
+                self.coalesced += 1
+                return
+            if len(self.pending) >= self.max_pending:
+                oldest_data = next(
+                    (waiting for waiting in self.pending if not waiting.find), None
                 )
+                if oldest_data is None:
+                    self.dropped += 1  # queue full of find-me blinks
+                    return
+                self.pending.remove(oldest_data)
+                self.dropped += 1
+            self.pending.append(blink)
+            self.condition.notify()
+
+    def _show_standby(self):
+        if self.standby:
+            self.leds[STANDBY_COLOR].on()
+        else:
+            self.leds[STANDBY_COLOR].off()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                blink = self.current = self.pending.popleft()
+                self.interrupt.clear()
+                self.leds[STANDBY_COLOR].off()
+            self._show(blink)
+            with self.condition:
+                self.current = None
+                self.shown += 1
+                self._show_standby()
+
+    def _show(self, blink: Blink):
+        led = self.leds[blink.color]
+        for flash in range(blink.count):
+            led.on()
+            interrupted = self.interrupt.wait(blink.duration)
+            led.off()
+            if interrupted:
+                return
+            if flash + 1 != blink.count and self.interrupt.wait(blink.duration):
+                return
+
+    def metrics(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "shown": self.shown,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "preempted": self.preempted,
+        }
+
+
+def main():
+    controller = LEDController()
+    controller.start()
+    print("LED control started")
+    try:
+        # one command per line from the parent process (main.js)
+        for line in sys.stdin:
+            command = line.strip()
+            if command:
+                controller.command(command)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        controller.stop()
+        print("LED control stopped")
+
 
-except KeyboardInterrupt:
-    print("LED control stopped")
-finally:
-    for led in LED_MAPPER.values():
-        led.off()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Memory and CPU of one process per instrument versus the edge agent.
+
+Both setups run N serial instruments played by loopback pseudo terminals
+that each send `--rate` frames per second:
+
+- processes: one driver.py per instrument, like main.js starts them
+- agent: one edge_agent.py holding all instruments and one websocket to a
+  stand-in gateway run by this script
+
+Memory is the PSS (proportional set size, shared pages split between the
+processes sharing them) summed over the measured processes; CPU is their
+user plus system time over the run. The main.js (bun) and status_led.py
+processes of the per-instrument setup are not started here, so the
+per-instrument numbers are a lower bound. Run it on the Pi to get numbers
+for the real hardware.
+
+Usage:
+    python instruments/benchmarks/edge_footprint.py --instruments 4 --duration 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import pty
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tty
+import uuid
+
+import websockets
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASE = os.path.join(HERE, "..", "base")
+sys.path.append(BASE)
+
+from gateway_protocol import ACK, READINGS, decode, encode
+
+DEFAULT_DRIVER = os.path.join(
+    HERE, "..", "drivers", "saturius_scale_EB6DCE-L", "driver.py"
+)
+FRAME = b"+   12.345 g  \r\n"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def pss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/smaps_rollup") as smaps:
+        for line in smaps:
+            if line.startswith("Pss:"):
+                return int(line.split()[1])
+    return 0
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    # utime and stime are fields 14 and 15 of the whole line
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def play_instruments(masters, rate, stop):
+    "Writes a frame to every instrument `rate` times per second"
+    interval = 1 / rate
+    next_frame = time.monotonic()
+    while not stop.is_set():
+        for master in masters:
+            os.write(master, FRAME)
+        next_frame += interval
+        time.sleep(max(0, next_frame - time.monotonic()))
+
+
+def drain(stream, counter):
+    for _ in stream:
+        counter[0] += 1
+
+
+def start_processes(driver, ports):
+    processes = []
+    counter = [0]
+    for port in ports:
+        process = subprocess.Popen(
+            [sys.executable, driver],
+            env={**os.environ, "SERIAL_PORT": port},
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        threading.Thread(
+            target=drain, args=(process.stdout, counter), daemon=True
+        ).start()
+        processes.append(process)
+    return processes, counter
+
+
+def start_agent(driver, ports, gateway_url, workdir):
+    config = {
+        "hub_gateway_url": gateway_url,
+        "instruments": [
+            {"id": str(uuid.uuid4()), "driver": driver, "port": port} for port in ports
+        ],
+    }
+    config_path = os.path.join(workdir, "agent.json")
+    with open(config_path, "w") as config_file:
+        json.dump(config, config_file)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BASE, "edge_agent.py")],
+        env={**os.environ, "AGENT_CONFIG": config_path, "AGENT_STATUS_LED": "0"},
+        cwd=workdir,
+        stdout=subprocess.DEVNULL,
+    )
+    return [process]
+
+
+def run_gateway(port, counter, ready):
+    async def handler(websocket):
+        try:
+            async for frame in websocket:
+                message = decode(frame)
+                if message[0] == READINGS:
+                    counter[0] += len(message[1])
+                    await websocket.send(encode([ACK, message[1][-1][1]]))
+        except websockets.ConnectionClosed:
+            pass  # the agent is killed at the end of the run
+
+    async def serve():
+        async with websockets.serve(handler, "127.0.0.1", port):
+            ready.set()
+            await asyncio.Future()
+
+    asyncio.run(serve())
+
+
+def measure(mode, args, workdir):
+    pairs = [pty.openpty() for _ in range(args.instruments)]
+    for _, slave in pairs:
+        tty.setraw(slave)
+    ports = [os.ttyname(slave) for _, slave in pairs]
+
+    if mode == "processes":
+        processes, counter = start_processes(args.driver, ports)
+    else:
+        counter, ready = [0], threading.Event()
+        threading.Thread(
+            target=run_gateway, args=(args.gateway_port, counter, ready), daemon=True
+        ).start()
+        ready.wait()
+        gateway_url = f"ws://127.0.0.1:{args.gateway_port}"
+        processes = start_agent(args.driver, ports, gateway_url, workdir)
+
+    time.sleep(args.warmup)  # imports and port discovery are not measured
+    stop = threading.Event()
+    player = threading.Thread(
+        target=play_instruments, args=([m for m, _ in pairs], args.rate, stop)
+    )
+    pids = [process.pid for process in processes]
+    cpu_before = sum(cpu_seconds(pid) for pid in pids)
+    received_before = counter[0]
+    player.start()
+    time.sleep(args.duration)
+    stop.set()
+    player.join()
+    cpu = sum(cpu_seconds(pid) for pid in pids) - cpu_before
+    pss = sum(pss_kb(pid) for pid in pids)
+    time.sleep(0.5)
+    received = counter[0] - received_before
+
+    for process in processes:
+        process.kill()
+        process.wait()
+    for master, slave in pairs:
+        os.close(master)
+        os.close(slave)
+
+    return {
+        "processes": len(pids),
+        "pss_mb": round(pss / 1024, 1),
+        "cpu_percent": round(cpu / args.duration * 100, 2),
+        "readings_received": received,
+        "readings_sent": args.instruments * args.rate * args.duration,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--instruments", type=int, default=4)
+    parser.add_argument(
+        "--rate", type=int, default=10, help="frames per second and instrument"
+    )
+    parser.add_argument("--duration", type=int, default=20)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--driver", default=DEFAULT_DRIVER)
+    parser.add_argument("--gateway-port", type=int, default=9555)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+    args.driver = os.path.abspath(args.driver)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = {
+            "instruments": args.instruments,
+            "processes": measure("processes", args, workdir),
+            "agent": measure("agent", args, workdir),
+        }
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
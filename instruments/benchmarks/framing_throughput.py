@@ -0,0 +1,163 @@
+"""Throughput of the frame reassembly and parsers on recorded byte captures.
+
+Captures are raw serial bytes, e.g. recorded on the Pi with
+SERIAL_CAPTURE=/tmp/scale.bin set for the driver. Without --capture a
+synthetic capture is generated per profile, with a share of corrupted
+frames and cut into chunks of random size the way a serial port hands
+them out.
+
+For every profile the benchmark reports bytes and frames per second and
+how many readings came out intact, next to the old fixed-size reads
+(`ser.read(N)` and slicing) on the same bytes.
+
+Usage:
+    python instruments/benchmarks/framing_throughput.py
+    python instruments/benchmarks/framing_throughput.py --profile sbi --capture /tmp/scale.bin
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, "..", "base"))
+
+from framing import OK, FrameBuffer, sbi_reading, text_reading
+
+
+def sbi_frame(rng):
+    return f"{rng.choice('+-')}{rng.uniform(0, 9999):9.3f} g  \r\n".encode()
+
+
+def rpt2_frame(rng):
+    return f"{rng.uniform(0, 99):6.3f}\r\n".encode()
+
+
+def c173_frame(rng):
+    label = "C173 LINE 1 STATION 04 COATING"
+    return f"{label:<41}{rng.uniform(0, 99):8.2f} CTU\r\n".encode()
+
+
+# name -> (frame length without CR LF, parser, synthetic frame)
+PROFILES = {
+    "sbi": (14, sbi_reading, sbi_frame),
+    "rpt2": (6, text_reading, rpt2_frame),
+    "c173": (53, text_reading, c173_frame),
+}
+
+
+def synthetic_capture(make_frame, frames, noise, rng):
+    "Returns the capture and the frames that were left intact"
+    capture = bytearray()
+    intact = []
+    for _ in range(frames):
+        frame = bytearray(make_frame(rng))
+        if rng.random() < noise:
+            # dropped or extra bytes, as on a loose cable
+            position = rng.randrange(len(frame) - 2)
+            if rng.random() < 0.5:
+                del frame[position]
+            else:
+                frame.insert(position, rng.randrange(32, 127))
+        else:
+            intact.append(bytes(frame))
+        capture += frame
+    return bytes(capture), intact
+
+
+def chunks(capture, rng, largest=64):
+    position = 0
+    while position < len(capture):
+        size = rng.randint(1, largest)
+        yield capture[position : position + size]
+        position += size
+
+
+def run_framebuffer(capture, frame_length, parser, rng):
+    pieces = list(chunks(capture, rng))
+    buffer = FrameBuffer(frame_length)
+    readings = []
+    started = time.perf_counter()
+    for piece in pieces:
+        for frame in buffer.feed(piece):
+            reading = parser(frame)
+            if reading is not None and reading.status == OK:
+                readings.append(reading)
+    elapsed = time.perf_counter() - started
+    return elapsed, readings, buffer
+
+
+def run_fixed_reads(capture, frame_length, parser):
+    # what the drivers used to do: read N bytes, hope a frame starts there
+    size = frame_length + 2
+    readings = []
+    started = time.perf_counter()
+    for position in range(0, len(capture), size):
+        reading = parser(capture[position : position + size].strip())
+        if reading is not None and reading.status == OK:
+            readings.append(reading)
+    return time.perf_counter() - started, readings
+
+
+def correct(readings, expected):
+    "Readings that match one of the intact frames"
+    if expected is None:
+        return None
+    return sum(str(reading) in expected for reading in readings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profile", choices=PROFILES, action="append")
+    parser.add_argument("--capture", help="raw bytes recorded from one instrument")
+    parser.add_argument("--frames", type=int, default=100000)
+    parser.add_argument("--noise", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    if args.capture and len(args.profile or []) != 1:
+        parser.error("--capture needs exactly one --profile")
+
+    results = {}
+    for name in args.profile or PROFILES:
+        frame_length, parse, make_frame = PROFILES[name]
+        rng = random.Random(args.seed)
+        if args.capture:
+            with open(args.capture, "rb") as capture_file:
+                capture = capture_file.read()
+            intact = expected = None
+        else:
+            capture, intact = synthetic_capture(
+                make_frame, args.frames, args.noise, rng
+            )
+            expected = {str(parse(frame.strip())) for frame in intact}
+
+        elapsed, readings, buffer = run_framebuffer(
+            capture, frame_length, parse, rng
+        )
+        legacy_elapsed, legacy = run_fixed_reads(capture, frame_length, parse)
+        results[name] = {
+            "bytes": len(capture),
+            "intact_frames": len(intact) if intact is not None else None,
+            "mb_per_s": round(len(capture) / elapsed / 1e6, 2),
+            "frames_per_s": round(buffer.frames / elapsed),
+            "readings": len(readings),
+            "correct_readings": correct(readings, expected),
+            "dropped_bytes": buffer.dropped_bytes,
+            "fixed_reads_readings": len(legacy),
+            "fixed_reads_correct_readings": correct(legacy, expected),
+            "fixed_reads_mb_per_s": round(len(capture) / legacy_elapsed / 1e6, 2),
+        }
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""End-to-end latency of a serial driver against a loopback pseudo terminal.
+
+The driver is started the way main.js starts it, with SERIAL_PORT pointing
+at the slave side of a pty. The harness plays the instrument on the master
+side and measures
+
+- reading latency: frame written by the "instrument" -> line on driver stdout
+- command latency: command written to driver stdin -> bytes at the "instrument"
+
+Usage:
+    python instruments/benchmarks/pty_latency.py \
+        instruments/drivers/saturius_scale_EB6DCE-L/driver.py --count 200
+"""
+
+import argparse
+import json
+import os
+import pty
+import select
+import statistics
+import subprocess
+import sys
+import time
+import tty
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summary(latencies):
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        "count": len(ms),
+        "p50_ms": round(percentile(ms, 0.50), 3),
+        "p95_ms": round(percentile(ms, 0.95), 3),
+        "p99_ms": round(percentile(ms, 0.99), 3),
+        "max_ms": round(max(ms), 3),
+        "mean_ms": round(statistics.mean(ms), 3),
+    }
+
+
+def read_line(stream, timeout):
+    ready, _, _ = select.select([stream], [], [], timeout)
+    if not ready:
+        raise TimeoutError("driver did not answer in time")
+    return stream.readline()
+
+
+def read_until(fd, marker: bytes, timeout):
+    received = b""
+    deadline = time.perf_counter() + timeout
+    while marker not in received:
+        remaining = deadline - time.perf_counter()
+        ready, _, _ = select.select([fd], [], [], max(remaining, 0))
+        if not ready:
+            raise TimeoutError("command did not reach the instrument in time")
+        received += os.read(fd, 1024)
+    return received
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("driver", help="path to a serial driver.py")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--frame", default="+   12.345 g  \r\n")
+    parser.add_argument("--command", default="P")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    master, slave = pty.openpty()
+    tty.setraw(slave)  # no echo of the frames before the driver opens the port
+    driver = subprocess.Popen(
+        [sys.executable, args.driver],
+        env={**os.environ, "SERIAL_PORT": os.ttyname(slave)},
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+    )
+    frame = args.frame.encode()
+
+    try:
+        # opening the port flushes its input, so repeat the first frame until
+        # the driver is listening
+        deadline = time.perf_counter() + args.timeout
+        while True:
+            os.write(master, frame)
+            try:
+                read_line(driver.stdout, 0.2)
+                break
+            except TimeoutError:
+                if time.perf_counter() > deadline:
+                    raise
+        time.sleep(0.5)
+        while select.select([driver.stdout], [], [], 0)[0]:
+            driver.stdout.readline()  # readings of the extra warm-up frames
+
+        readings = []
+        for _ in range(args.count):
+            started = time.perf_counter()
+            os.write(master, frame)
+            read_line(driver.stdout, args.timeout)
+            readings.append(time.perf_counter() - started)
+
+        commands = []
+        for _ in range(args.count):
+            started = time.perf_counter()
+            driver.stdin.write(args.command + "\n")
+            driver.stdin.flush()
+            read_until(master, args.command.encode() + b"\r\n", args.timeout)
+            commands.append(time.perf_counter() - started)
+    finally:
+        driver.kill()
+        driver.wait()
+        os.close(master)
+        os.close(slave)
+
+    results = {
+        "driver": args.driver,
+        "reading": summary(readings),
+        "command": summary(commands),
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()